@@ -1,5 +1,7 @@
 # ========== Redis除去版 パート1: 基本設定・インポート・初期化 ==========
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_from_directory, current_app
+from flask.cli import with_appcontext
+import click
 from flask_cors import CORS
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -16,7 +18,6 @@ import json
 import hashlib
 import threading
 import time
-import queue
 import psycopg2.pool
 from contextlib import contextmanager
 import atexit
@@ -33,75 +34,44 @@ from routes.admin import admin_bp
 from routes.study import study_bp
 from routes.choice_studies import choice_studies_bp
 from models.user import User
-from utils.db import get_db_connection, get_db_cursor
+from utils.db import get_db_connection, get_db_cursor, close_pg_pool, close_sqlite_pools
+from utils.log_writer import LogPipeline
+from utils.session_store import StudySessionStore
+from utils.cache import create_cache, SharedInvalidations
+from utils.progress import apply_study_log_progress, clear_study_log_cache
+from utils.jobs import JobRunner
+from utils.distractors import DistractorPool
+from utils.migrations import run_migrations, plan_migrations
+from utils.backup import SnapshotScheduler
+from utils.log_maintenance import LogMaintenanceScheduler, convert_log_tables, run_log_maintenance
 
 # ========== 設定エリア ==========
-# ローカル開発用の環境変数ファイルを読み込み（本番環境では無視される）
-load_dotenv(dotenv_path='dbname.env')
-
-# 環境変数の確認とログ出力
-print("🔍 環境変数チェック:")
-print(f"DB_TYPE: {os.getenv('DB_TYPE', 'sqlite')}")
-print(f"DB_PATH: {os.getenv('DB_PATH', 'flashcards.db')}")
-print(f"DB_HOST: {os.getenv('DB_HOST', 'Not set')}")
-print(f"DB_PORT: {os.getenv('DB_PORT', 'Not set')}")
-print(f"DB_NAME: {os.getenv('DB_NAME', 'Not set')}")
-print(f"DB_USER: {os.getenv('DB_USER', 'Not set')}")
-print(f"DB_PASSWORD: {'Set' if os.getenv('DB_PASSWORD') else 'Not set'}")
-print(f"WASABI_ACCESS_KEY: {'Set' if os.getenv('WASABI_ACCESS_KEY') else 'Not set'}")
-print(f"WASABI_SECRET_KEY: {'Set' if os.getenv('WASABI_SECRET_KEY') else 'Not set'}")
-print(f"WASABI_BUCKET: {os.getenv('WASABI_BUCKET', 'Not set')}")
-print(f"WASABI_ENDPOINT: {os.getenv('WASABI_ENDPOINT', 'Not set')}")
-
-app = Flask(__name__)
-CORS(app)
-app.secret_key = 'your_secret_key'
-# csrf = CSRFProtect(app)  # 本番環境ではCSRF保護を無効化
+def print_environment():
+    """環境変数の確認（init-db コマンドと開発用サーバーの起動時に表示）"""
+    print("🔍 環境変数チェック:")
+    print(f"DB_TYPE: {os.getenv('DB_TYPE', 'sqlite')}")
+    print(f"DB_PATH: {os.getenv('DB_PATH', 'flashcards.db')}")
+    print(f"DB_HOST: {os.getenv('DB_HOST', 'Not set')}")
+    print(f"DB_PORT: {os.getenv('DB_PORT', 'Not set')}")
+    print(f"DB_NAME: {os.getenv('DB_NAME', 'Not set')}")
+    print(f"DB_USER: {os.getenv('DB_USER', 'Not set')}")
+    print(f"DB_PASSWORD: {'Set' if os.getenv('DB_PASSWORD') else 'Not set'}")
+    print(f"WASABI_ACCESS_KEY: {'Set' if os.getenv('WASABI_ACCESS_KEY') else 'Not set'}")
+    print(f"WASABI_SECRET_KEY: {'Set' if os.getenv('WASABI_SECRET_KEY') else 'Not set'}")
+    print(f"WASABI_BUCKET: {os.getenv('WASABI_BUCKET', 'Not set')}")
+    print(f"WASABI_ENDPOINT: {os.getenv('WASABI_ENDPOINT', 'Not set')}")
 
-# CSRFトークンを空文字列として提供（テンプレート互換性のため）
-@app.context_processor
-def inject_csrf_token():
-    return dict(csrf_token=lambda: '')
-logging.basicConfig(level=logging.INFO)
-
-app.config.update(
-    # JSON処理高速化
-    JSON_SORT_KEYS=False,
-    JSONIFY_PRETTYPRINT_REGULAR=False,
-    
-    # セッション最適化
-    PERMANENT_SESSION_LIFETIME=timedelta(hours=2),
-    
-    # 静的ファイルキャッシュとパフォーマンス最適化
-    SEND_FILE_MAX_AGE_DEFAULT=31536000,  # 1年
-    TEMPLATES_AUTO_RELOAD=False,
-    
-    # データベース設定
-    DB_TYPE=os.getenv('DB_TYPE', 'sqlite'),
-    DB_PATH=os.getenv('DB_PATH', 'flashcards.db'),
-    DB_HOST=os.getenv('DB_HOST'),
-    DB_PORT=os.getenv('DB_PORT'),
-    DB_NAME=os.getenv('DB_NAME'),
-    DB_USER=os.getenv('DB_USER'),
-    DB_PASSWORD=os.getenv('DB_PASSWORD')
-)
-
-print("🚀 バックエンド高速化システム初期化完了")
-
-# Flask-Login 初期化
+# Flask-Login（create_app でアプリに登録）
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.get(user_id)
 
-# Blueprint登録
-app.register_blueprint(auth_bp)
-app.register_blueprint(admin_bp)
-app.register_blueprint(study_bp)
-app.register_blueprint(choice_studies_bp)
+# CSRFトークンを空文字列として提供（テンプレート互換性のため）
+def inject_csrf_token():
+    return dict(csrf_token=lambda: '')
 
 # --- ここからカスタムフィルタ追加 ---
 def to_kanji_circle(value):
@@ -114,53 +84,108 @@ def to_kanji_circle(value):
     except Exception:
         return str(value)
 
-app.jinja_env.filters['to_kanji_circle'] = to_kanji_circle
-# --- カスタムフィルタここまで ---
-
-# Jinja2フィルターを追加
-@app.template_filter('int_to_letter')
 def int_to_letter(value):
     """数字を文字（A, B, C, D...）に変換"""
     if isinstance(value, int) and 1 <= value <= 26:
         return chr(64 + value)  # A=65, B=66, ...
     return str(value)
+# --- カスタムフィルタここまで ---
 
-# 🚀 非同期ログ処理システム
-log_queue = queue.Queue(maxsize=1000)
-log_worker_active = True
-
-def log_worker():
-    """バックグラウンドでログを処理するワーカー"""
-    while log_worker_active:
-        try:
-            log_data = log_queue.get(timeout=1)
-            if log_data is None:  # 終了シグナル
-                break
-            
-            user_id, card_id, result, stage, mode = log_data
-            
-            try:
-                with get_db_connection() as conn:
-                    with get_db_cursor(conn) as cur:
-                        cur.execute('''
-                            INSERT INTO study_log (user_id, card_id, result, stage, mode)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (user_id, card_id, result, stage, mode))
-                        conn.commit()
-                app.logger.info(f"非同期ログ記録完了: user={user_id}, card={card_id}")
-            except Exception as e:
-                app.logger.error(f"非同期ログ書き込みエラー: {e}")
-            finally:
-                log_queue.task_done()
-                
-        except queue.Empty:
-            continue
-        except Exception as e:
-            app.logger.error(f"ログワーカーエラー: {e}")
+# ========== バックグラウンド処理（プロセスごとに起動） ==========
+_background_services_lock = threading.Lock()
+
+def start_background_services(app):
+    """
+    ログ書き込み・ジョブランナー・スナップショットのスレッドを起動（プロセスごとに1回）
+
+    スレッドは fork で子プロセスに引き継がれないため、モジュールの読み込み時には起動しない。
+    gunicorn では post_worker_init でワーカーごとに起動し、それ以外の起動方法では
+    最初のリクエストで起動する。
+    """
+    pid = os.getpid()
+    if app.extensions.get('background_services_pid') == pid:
+        return
+    with _background_services_lock:
+        if app.extensions.get('background_services_pid') == pid:
+            return
+
+        # 🚀 非同期ログ処理システム（学習ログをテーブルごとにバッチ書き込み）
+        log_pipeline = LogPipeline(
+            app,
+            maxsize=app.config['LOG_WRITER_QUEUE_SIZE'],
+            batch_size=app.config['LOG_WRITER_BATCH_SIZE'],
+            max_delay=app.config['LOG_WRITER_MAX_DELAY_MS'] / 1000.0,
+            spill_dir=app.config['LOG_SPILL_DIR'],
+            spill_retry_interval=app.config['LOG_SPILL_RETRY_INTERVAL']
+        )
+        # study_log は書き込みと同じトランザクションでチャンク進捗の集計テーブルも更新する
+        log_pipeline.register_table('study_log', ('user_id', 'card_id', 'source', 'stage', 'mode', 'result', 'page_range', 'difficulty'),
+                                    on_write=apply_study_log_progress, after_commit=clear_study_log_cache)
+        log_pipeline.register_table('study_logs', ('session_id', 'question_id', 'user_answer', 'correct_answer', 'is_correct', 'study_type'))
+        log_pipeline.register_table('choice_study_log', ('user_id', 'question_id', 'user_answer', 'correct_answer', 'is_correct', 'answered_at'))
+        app.extensions['log_pipeline'] = log_pipeline
+        log_pipeline.start()
+
+        # 管理画面の重い処理（CSV取り込み・データ復元など）を実行するジョブランナー
+        app.extensions['job_runner'] = JobRunner(
+            app,
+            max_workers=app.config['JOB_RUNNER_MAX_WORKERS'],
+            progress_interval=app.config['JOB_PROGRESS_INTERVAL'],
+            upload_dir=app.config['JOB_UPLOAD_DIR']
+        )
+
+        # SQLiteの定期スナップショット（世代数を超えた古いものは削除。複数ワーカーでもロックで1つだけ実行）
+        if os.getenv('DB_TYPE', 'sqlite') == 'sqlite' and app.config['BACKUP_INTERVAL_MINUTES'] > 0:
+            snapshot_scheduler = SnapshotScheduler(
+                app,
+                os.getenv('DB_PATH', 'flashcards.db'),
+                app.config['BACKUP_DIR'],
+                interval=app.config['BACKUP_INTERVAL_MINUTES'] * 60,
+                keep=app.config['BACKUP_KEEP'],
+                compression=app.config['BACKUP_COMPRESSION']
+            )
+            app.extensions['snapshot_scheduler'] = snapshot_scheduler
+            snapshot_scheduler.start()
+
+        # 学習ログのパーティション作成・日別集計・保持期間の削除（複数ワーカーでも同じ範囲は1回だけ処理）
+        if app.config['LOG_MAINTENANCE_INTERVAL_HOURS'] > 0:
+            log_maintenance_scheduler = LogMaintenanceScheduler(
+                app,
+                interval=app.config['LOG_MAINTENANCE_INTERVAL_HOURS'] * 3600,
+                rollup_after_days=app.config['LOG_ROLLUP_AFTER_DAYS'],
+                retention_days=app.config['LOG_RAW_RETENTION_DAYS'],
+                months_ahead=app.config['LOG_PARTITION_MONTHS_AHEAD']
+            )
+            app.extensions['log_maintenance_scheduler'] = log_maintenance_scheduler
+            log_maintenance_scheduler.start()
 
-# ワーカースレッド開始
-log_thread = threading.Thread(target=log_worker, daemon=True)
-log_thread.start()
+        app.extensions['background_services_pid'] = pid
+        # 終了時に残りのログをフラッシュ
+        atexit.register(stop_background_services, app)
+        app.logger.info(f"バックグラウンド処理を起動しました: pid={pid}")
+
+def stop_background_services(app):
+    """バックグラウンド処理を停止（残りのログを書き込む。起動したプロセス以外では何もしない）"""
+    with _background_services_lock:
+        if app.extensions.get('background_services_pid') != os.getpid():
+            return
+        app.extensions.pop('background_services_pid', None)
+        snapshot_scheduler = app.extensions.pop('snapshot_scheduler', None)
+        log_maintenance_scheduler = app.extensions.pop('log_maintenance_scheduler', None)
+        job_runner = app.extensions.pop('job_runner', None)
+        log_pipeline = app.extensions.pop('log_pipeline', None)
+    if snapshot_scheduler is not None:
+        snapshot_scheduler.stop()
+    if log_maintenance_scheduler is not None:
+        log_maintenance_scheduler.stop()
+    if job_runner is not None:
+        job_runner.shutdown()
+    if log_pipeline is not None:
+        log_pipeline.stop()
+
+def ensure_background_services():
+    # 起動済みのプロセスでは pid の比較のみ
+    start_background_services(current_app._get_current_object())
 
 # Wasabi S3クライアント初期化
 def init_wasabi_client():
@@ -215,7 +240,7 @@ def get_unit_image_folder_path(question_id):
                     return "social_studies/default"
                     
     except Exception as e:
-        app.logger.error(f"フォルダパス生成エラー: {e}")
+        current_app.logger.error(f"フォルダパス生成エラー: {e}")
         return "social_studies/default"
 
 def get_unit_image_folder_path_by_unit_id(unit_id):
@@ -267,7 +292,7 @@ def get_unit_image_folder_path_by_unit_id(unit_id):
                     return "social_studies/default"
                     
     except Exception as e:
-        app.logger.error(f"フォルダパス生成エラー: {e}")
+        current_app.logger.error(f"フォルダパス生成エラー: {e}")
         return "social_studies/default"
 
 # 画像アップロード関数
@@ -281,7 +306,6 @@ def set_image_public_access(image_url):
     print("⚠️ 画像公開アクセス設定は現在無効化されています")
     return None
 
-@app.route('/social_studies/api/check_image')
 def social_studies_check_image():
     """画像存在確認API"""
     try:
@@ -318,13 +342,12 @@ def social_studies_check_image():
         })
         
     except Exception as e:
-        app.logger.error(f"画像確認APIエラー: {e}")
+        current_app.logger.error(f"画像確認APIエラー: {e}")
         return jsonify({
             'error': '画像確認に失敗しました',
             'exists': False
         }), 500
 
-@app.route('/social_studies/api/textbooks')
 def social_studies_api_textbooks():
     """教材一覧取得API"""
     try:
@@ -361,10 +384,9 @@ def social_studies_api_textbooks():
                 return jsonify(textbooks)
                 
     except Exception as e:
-        app.logger.error(f"教材一覧取得APIエラー: {e}")
+        current_app.logger.error(f"教材一覧取得APIエラー: {e}")
         return jsonify({'error': '教材一覧の取得に失敗しました'}), 500
 
-@app.route('/social_studies/api/textbook/<int:textbook_id>')
 def social_studies_api_textbook(textbook_id):
     """教材詳細取得API"""
     try:
@@ -393,10 +415,9 @@ def social_studies_api_textbook(textbook_id):
                 return jsonify(textbook)
                 
     except Exception as e:
-        app.logger.error(f"教材詳細取得APIエラー: {e}")
+        current_app.logger.error(f"教材詳細取得APIエラー: {e}")
         return jsonify({'error': '教材詳細の取得に失敗しました'}), 500
 
-@app.route('/social_studies/api/units')
 def social_studies_api_units():
     """単元一覧取得API"""
     try:
@@ -426,10 +447,9 @@ def social_studies_api_units():
                 return jsonify(units)
                 
     except Exception as e:
-        app.logger.error(f"単元一覧取得APIエラー: {e}")
+        current_app.logger.error(f"単元一覧取得APIエラー: {e}")
         return jsonify({'error': '単元一覧の取得に失敗しました'}), 500
 
-@app.route('/')
 def home():
     if not current_user.is_authenticated:
         return redirect(url_for('auth.login'))
@@ -440,457 +460,204 @@ def home():
         else:
             return render_template('index.html')
 
+# ========== アプリケーションの作成 ==========
+def create_app():
+    """
+    アプリケーションを作成
+
+    DB接続・テーブル作成・データ移行・スレッドの起動は行わないため、ワーカーはすぐに起動できる。
+    DBの初期化は `flask --app app init-db`（スキーマの変更のみは `flask --app app migrate`）で
+    デプロイ時に1回だけ実行する。
+    """
+    # ローカル開発用の環境変数ファイルを読み込み（本番環境では無視される）
+    load_dotenv(dotenv_path='dbname.env')
+    logging.basicConfig(level=logging.INFO)
+
+    app = Flask(__name__)
+    CORS(app)
+    app.secret_key = 'your_secret_key'
+    # csrf = CSRFProtect(app)  # 本番環境ではCSRF保護を無効化
+    app.context_processor(inject_csrf_token)
+
+    app.config.update(
+        # JSON処理高速化
+        JSON_SORT_KEYS=False,
+        JSONIFY_PRETTYPRINT_REGULAR=False,
+    
+        # セッション最適化
+        PERMANENT_SESSION_LIFETIME=timedelta(hours=2),
+    
+        # 静的ファイルキャッシュとパフォーマンス最適化
+        SEND_FILE_MAX_AGE_DEFAULT=31536000,  # 1年
+        TEMPLATES_AUTO_RELOAD=False,
+    
+        # データベース設定
+        DB_TYPE=os.getenv('DB_TYPE', 'sqlite'),
+        DB_PATH=os.getenv('DB_PATH', 'flashcards.db'),
+        DB_HOST=os.getenv('DB_HOST'),
+        DB_PORT=os.getenv('DB_PORT'),
+        DB_NAME=os.getenv('DB_NAME'),
+        DB_USER=os.getenv('DB_USER'),
+        DB_PASSWORD=os.getenv('DB_PASSWORD'),
+    
+        # PostgreSQL接続プール設定
+        DB_POOL_MIN_SIZE=int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+        DB_POOL_MAX_SIZE=int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+        DB_POOL_ACQUIRE_TIMEOUT=float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', 10)),
+        DB_POOL_HEALTHCHECK_INTERVAL=float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', 30)),
+        DB_CONNECT_TIMEOUT=int(os.getenv('DB_CONNECT_TIMEOUT', 10)),
+    
+        # 学習ログのバッチ書き込み設定
+        LOG_WRITER_QUEUE_SIZE=int(os.getenv('LOG_WRITER_QUEUE_SIZE', 1000)),
+        LOG_WRITER_BATCH_SIZE=int(os.getenv('LOG_WRITER_BATCH_SIZE', 100)),
+        LOG_WRITER_MAX_DELAY_MS=int(os.getenv('LOG_WRITER_MAX_DELAY_MS', 200)),
+        LOG_SPILL_DIR=os.getenv('LOG_SPILL_DIR', 'log_spill'),
+        LOG_SPILL_RETRY_INTERVAL=float(os.getenv('LOG_SPILL_RETRY_INTERVAL', 30)),
+    
+        # 学習ログの日別集計・保持期間（どちらも 0 = 行わない、詳細は utils/log_maintenance.py）
+        # 集計を有効にすると、SQLite では集計した月の生ログが study_log から月別テーブルに移る
+        LOG_ROLLUP_AFTER_DAYS=int(os.getenv('LOG_ROLLUP_AFTER_DAYS', 0)),
+        LOG_RAW_RETENTION_DAYS=int(os.getenv('LOG_RAW_RETENTION_DAYS', 0)),
+        LOG_PARTITION_MONTHS_AHEAD=int(os.getenv('LOG_PARTITION_MONTHS_AHEAD', 3)),
+        LOG_MAINTENANCE_INTERVAL_HOURS=float(os.getenv('LOG_MAINTENANCE_INTERVAL_HOURS', 24)),
+    
+        # 学習セッションのサーバーサイドストア設定
+        SESSION_STORE_PATH=os.getenv('SESSION_STORE_PATH', 'study_sessions.db'),
+        SESSION_STORE_TTL=int(os.getenv('SESSION_STORE_TTL', 7200)),
+        SESSION_STORE_MAX_ENTRIES=int(os.getenv('SESSION_STORE_MAX_ENTRIES', 10000)),
+    
+        # ログインユーザーのキャッシュ設定（無効化は USER_CACHE_INVALIDATION_PATH で同じホストのワーカーに伝える。
+        # 複数のホストで動かす場合、他のホストには TTL 秒後に反映されるため USER_CACHE_TTL=0 でキャッシュしない）
+        USER_CACHE_TTL=int(os.getenv('USER_CACHE_TTL', 60)),
+        USER_CACHE_MAX_SIZE=int(os.getenv('USER_CACHE_MAX_SIZE', 1000)),
+        USER_CACHE_INVALIDATION_PATH=os.getenv('USER_CACHE_INVALIDATION_PATH', 'user_cache.db'),
+    
+        # 学習進捗のキャッシュ設定（複数ワーカーで共有する場合は sqlite）
+        STUDY_CACHE_BACKEND=os.getenv('STUDY_CACHE_BACKEND', 'memory'),
+        STUDY_CACHE_PATH=os.getenv('STUDY_CACHE_PATH', 'study_cache.db'),
+        STUDY_CACHE_MAX_ENTRIES=int(os.getenv('STUDY_CACHE_MAX_ENTRIES', 5000)),
+    
+        # 選択肢生成用の単元ごとの候補キャッシュ（他ワーカーでの問題の変更は TTL 秒で反映）
+        DISTRACTOR_POOL_TTL=int(os.getenv('DISTRACTOR_POOL_TTL', 600)),
+        DISTRACTOR_POOL_MAX_UNITS=int(os.getenv('DISTRACTOR_POOL_MAX_UNITS', 200)),
+    
+        # 管理画面のバックグラウンドジョブ設定
+        JOB_RUNNER_MAX_WORKERS=int(os.getenv('JOB_RUNNER_MAX_WORKERS', 2)),
+        JOB_PROGRESS_INTERVAL=float(os.getenv('JOB_PROGRESS_INTERVAL', 0.5)),
+        JOB_UPLOAD_DIR=os.getenv('JOB_UPLOAD_DIR', 'job_uploads'),
+    
+        # ユーザー一括登録のパスワードハッシュ設定（werkzeug形式、例: pbkdf2:sha256:600000 / scrypt:32768:8:1）
+        BULK_PASSWORD_HASH_METHOD=os.getenv('BULK_PASSWORD_HASH_METHOD', 'pbkdf2:sha256'),
+        BULK_PASSWORD_HASH_WORKERS=int(os.getenv('BULK_PASSWORD_HASH_WORKERS', 0)) or None,
+    
+        # SQLiteのスナップショット設定（BACKUP_INTERVAL_MINUTES=0 で定期保存は無効、zstd は zstandard が必要）
+        BACKUP_DIR=os.getenv('BACKUP_DIR', 'backups'),
+        BACKUP_INTERVAL_MINUTES=int(os.getenv('BACKUP_INTERVAL_MINUTES', 0)),
+        BACKUP_KEEP=int(os.getenv('BACKUP_KEEP', 7)),
+        BACKUP_COMPRESSION=os.getenv('BACKUP_COMPRESSION', 'gzip'),
+        BACKUP_PAGES_PER_STEP=int(os.getenv('BACKUP_PAGES_PER_STEP', 1024)),
+        BACKUP_TEMP_DIR=os.getenv('BACKUP_TEMP_DIR') or None
+    )
+
+    # プロセス終了時に接続プールを閉じる（接続自体は最初に使うときに作成される）
+    atexit.register(close_pg_pool)
+    atexit.register(close_sqlite_pools)
+
+    # Flask-Login 初期化
+    login_manager.init_app(app)
+
+    # Blueprint登録
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(study_bp)
+    app.register_blueprint(choice_studies_bp)
+
+    # アプリ直下のルート（エンドポイント名はテンプレートの url_for と合わせる）
+    app.add_url_rule('/', 'home', home)
+    app.add_url_rule('/social_studies/api/check_image', 'social_studies_check_image', social_studies_check_image)
+    app.add_url_rule('/social_studies/api/textbooks', 'social_studies_api_textbooks', social_studies_api_textbooks)
+    app.add_url_rule('/social_studies/api/textbook/<int:textbook_id>', 'social_studies_api_textbook', social_studies_api_textbook)
+    app.add_url_rule('/social_studies/api/units', 'social_studies_api_units', social_studies_api_units)
+
+    # Jinja2フィルター
+    app.jinja_env.filters['to_kanji_circle'] = to_kanji_circle
+    app.jinja_env.filters['int_to_letter'] = int_to_letter
+
+    # 学習セッションのサーバーサイドストア（問題リストをクッキーに入れない）
+    app.extensions['study_session_store'] = StudySessionStore(
+        app.config['SESSION_STORE_PATH'],
+        ttl=app.config['SESSION_STORE_TTL'],
+        max_entries=app.config['SESSION_STORE_MAX_ENTRIES']
+    )
+
+    # ログインユーザーのキャッシュの無効化をワーカー間で共有する（models/user.py の invalidate_user_cache）
+    app.extensions['user_cache_invalidations'] = SharedInvalidations(
+        app.config['USER_CACHE_INVALIDATION_PATH'],
+        keep=max(app.config['USER_CACHE_TTL'], 1) * 2
+    )
+
+    # 学習履歴・進捗のキャッシュ（simple_cache / clear_user_cache が使用）
+    app.extensions['study_cache'] = create_cache(
+        app.config['STUDY_CACHE_BACKEND'],
+        path=app.config['STUDY_CACHE_PATH'],
+        max_entries=app.config['STUDY_CACHE_MAX_ENTRIES']
+    )
+
+    # 選択問題の誤答選択肢の候補キャッシュ（generate_choices_from_unit が使用）
+    app.extensions['distractor_pool'] = DistractorPool(
+        ttl=app.config['DISTRACTOR_POOL_TTL'],
+        max_units=app.config['DISTRACTOR_POOL_MAX_UNITS']
+    )
+
+    # バックグラウンド処理は最初のリクエストで起動（gunicorn では post_worker_init で起動済み）
+    app.before_request(ensure_background_services)
+
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(maintain_logs_command)
+    app.cli.add_command(partition_logs_command)
+    return app
+
 # ========== データベース初期化 ==========
 def init_database():
-    """データベースの初期化とテーブル作成"""
+    """データベースのスキーマを最新にする（utils/migrations.py の未適用のマイグレーションを実行）"""
     db_type = os.getenv('DB_TYPE', 'sqlite')
-    
     if db_type == 'sqlite':
-        db_path = os.getenv('DB_PATH', 'flashcards.db')
-        print(f"🔍 データベース設定: type=sqlite, path={db_path}")
-        
-        # データベースファイルの存在確認
-        if os.path.exists(db_path):
-            print("✅ SQLiteデータベースは既に存在します")
+        print(f"🔍 データベース設定: type=sqlite, path={os.getenv('DB_PATH', 'flashcards.db')}")
+    else:
+        print(f"🔍 データベース設定: type=postgresql")
+    
+    try:
+        with get_db_connection() as conn:
+            run_migrations(conn, log=print)
             
-            # 既存のデータを確認
-            try:
-                with get_db_connection() as conn:
-                    with get_db_cursor(conn) as cur:
-                        cur.execute('SELECT COUNT(*) FROM users')
-                        user_count = cur.fetchone()[0]
-                        print(f"👥 既存のユーザー数: {user_count}")
-                        
-                        if user_count > 1:
-                            print("⚠️  既存のユーザーデータが存在します - データを保持します")
-            except Exception as e:
-                print(f"⚠️  データベース確認エラー: {e}")
-        else:
-            print("📝 SQLiteデータベースを作成します")
-        
-        # データベース接続とテーブル作成
-        try:
-            with get_db_connection() as conn:
+            if db_type != 'sqlite':
+                # デフォルト管理者ユーザーを作成（パスワード: admin123）
                 with get_db_cursor(conn) as cur:
-                    # テーブル作成（CREATE TABLE IF NOT EXISTSなので既存データは保持される）
+                    admin_password_hash = generate_password_hash('admin123')
                     cur.execute('''
-                        CREATE TABLE IF NOT EXISTS users (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            username TEXT UNIQUE NOT NULL,
-                            full_name TEXT,
-                            email TEXT,
-                            password_hash TEXT NOT NULL,
-                            is_admin BOOLEAN DEFAULT FALSE,
-                            is_active BOOLEAN DEFAULT TRUE,
-                            grade TEXT DEFAULT '一般',
-                            last_login TIMESTAMP,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    ''')
-                    
-                    # その他のテーブルも作成
-                    cur.execute('''
-                        CREATE TABLE IF NOT EXISTS input_textbooks (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            title TEXT NOT NULL,
-                            description TEXT,
-                            question_types TEXT DEFAULT '["input"]',
-                            subject TEXT DEFAULT '地理',
-                            grade TEXT DEFAULT '高校',
-                            publisher TEXT,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    ''')
-                    
-                    cur.execute('''
-                        CREATE TABLE IF NOT EXISTS input_units (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            textbook_id INTEGER,
-                            title TEXT NOT NULL,
-                            description TEXT,
-                            unit_number INTEGER,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (textbook_id) REFERENCES input_textbooks (id)
-                        )
-                    ''')
-                    
-                    cur.execute('''
-                        CREATE TABLE IF NOT EXISTS input_questions (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            unit_id INTEGER,
-                            question_text TEXT NOT NULL,
-                            correct_answer TEXT NOT NULL,
-                            explanation TEXT,
-                            image_path TEXT,
-                            question_type TEXT DEFAULT 'input',
-                            question_data TEXT,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (unit_id) REFERENCES input_units (id)
-                        )
-                    ''')
-                    
-                    conn.commit()
-                    print("✅ テーブル作成完了")
-                    
-        except Exception as e:
-            print(f"❌ データベース初期化エラー: {e}")
-            return False
-        
-        return True
-    else:
-        # PostgreSQLの場合
-        print(f"🔍 データベース設定: type=postgresql")
-        try:
-            # アプリケーションコンテキスト内で実行
-            with app.app_context():
-                with get_db_connection() as conn:
-                    with get_db_cursor(conn) as cur:
-                        # PostgreSQL用のテーブル作成
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS users (
-                                id SERIAL PRIMARY KEY,
-                                username VARCHAR(255) UNIQUE NOT NULL,
-                                full_name VARCHAR(255),
-                                email VARCHAR(255),
-                                password_hash TEXT NOT NULL,
-                                is_admin BOOLEAN DEFAULT FALSE,
-                                is_active BOOLEAN DEFAULT TRUE,
-                                grade VARCHAR(50) DEFAULT '一般',
-                                last_login TIMESTAMP,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        # 学習ログテーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS study_log (
-                                id SERIAL PRIMARY KEY,
-                                user_id INTEGER NOT NULL,
-                                card_id INTEGER NOT NULL,
-                                source TEXT NOT NULL,
-                                stage INTEGER NOT NULL,
-                                mode TEXT NOT NULL,
-                                result TEXT NOT NULL,
-                                page_range TEXT,
-                                difficulty TEXT,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        # チャンク進捗テーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS chunk_progress (
-                                id SERIAL PRIMARY KEY,
-                                user_id INTEGER NOT NULL,
-                                source TEXT NOT NULL,
-                                stage INTEGER NOT NULL,
-                                page_range TEXT NOT NULL,
-                                difficulty TEXT NOT NULL,
-                                chunk_number INTEGER NOT NULL,
-                                is_completed BOOLEAN DEFAULT FALSE,
-                                is_passed BOOLEAN DEFAULT FALSE,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        # 画像テーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS image (
-                                id SERIAL PRIMARY KEY,
-                                source TEXT NOT NULL,
-                                page_number INTEGER NOT NULL,
-                                level TEXT,
-                                image_path TEXT,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        # ユーザー設定テーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS user_settings (
-                                id SERIAL PRIMARY KEY,
-                                user_id INTEGER NOT NULL,
-                                source TEXT NOT NULL,
-                                page_range TEXT,
-                                difficulty TEXT,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        # 入力問題テーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS input_textbooks (
-                                id SERIAL PRIMARY KEY,
-                                name TEXT NOT NULL,
-                                subject TEXT NOT NULL,
-                                grade TEXT,
-                                publisher TEXT,
-                                description TEXT,
-                                wasabi_folder_path TEXT,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS input_units (
-                                id SERIAL PRIMARY KEY,
-                                textbook_id INTEGER NOT NULL,
-                                name TEXT NOT NULL,
-                                chapter_number INTEGER,
-                                description TEXT,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS input_questions (
-                                id SERIAL PRIMARY KEY,
-                                subject TEXT NOT NULL,
-                                textbook_id INTEGER NOT NULL,
-                                unit_id INTEGER,
-                                question TEXT NOT NULL,
-                                correct_answer TEXT NOT NULL,
-                                acceptable_answers TEXT,
-                                answer_suffix TEXT,
-                                explanation TEXT,
-                                difficulty_level TEXT,
-                                image_name TEXT,
-                                image_url TEXT,
-                                image_title TEXT,
-                                question_number INTEGER,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        # 入力問題学習ログテーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS input_study_log (
-                                id SERIAL PRIMARY KEY,
-                                user_id INTEGER NOT NULL,
-                                question_id INTEGER NOT NULL,
-                                user_answer TEXT,
-                                is_correct BOOLEAN,
-                                subject TEXT,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        # 選択問題テーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS choice_textbooks (
-                                id SERIAL PRIMARY KEY,
-                                source TEXT NOT NULL,
-                                chapter_name TEXT NOT NULL,
-                                chapter_number INTEGER NOT NULL,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS choice_units (
-                                id SERIAL PRIMARY KEY,
-                                textbook_id INTEGER NOT NULL,
-                                name TEXT NOT NULL,
-                                unit_number INTEGER NOT NULL,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS choice_questions (
-                                id SERIAL PRIMARY KEY,
-                                unit_id INTEGER NOT NULL,
-                                question TEXT NOT NULL,
-                                correct_answer TEXT NOT NULL,
-                                choices TEXT NOT NULL,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS choice_study_log (
-                                id SERIAL PRIMARY KEY,
-                                user_id INTEGER NOT NULL,
-                                question_id INTEGER NOT NULL,
-                                user_answer TEXT,
-                                correct_answer TEXT,
-                                is_correct BOOLEAN NOT NULL,
-                                answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        # 統一された教材テーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS textbooks (
-                                id SERIAL PRIMARY KEY,
-                                name TEXT NOT NULL,
-                                subject TEXT NOT NULL,
-                                grade TEXT,
-                                publisher TEXT,
-                                description TEXT,
-                                study_type TEXT DEFAULT 'both',
-                                is_active BOOLEAN DEFAULT TRUE,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS units (
-                                id SERIAL PRIMARY KEY,
-                                textbook_id INTEGER NOT NULL,
-                                name TEXT NOT NULL,
-                                unit_number INTEGER NOT NULL,
-                                description TEXT,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS questions (
-                                id SERIAL PRIMARY KEY,
-                                unit_id INTEGER NOT NULL,
-                                question TEXT NOT NULL,
-                                correct_answer TEXT NOT NULL,
-                                choices TEXT,
-                                acceptable_answers TEXT,
-                                answer_suffix TEXT,
-                                explanation TEXT,
-                                difficulty_level TEXT,
-                                image_name TEXT,
-                                image_url TEXT,
-                                image_title TEXT,
-                                question_number INTEGER,
-                                is_active BOOLEAN DEFAULT TRUE,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        # 学習セッションテーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS study_sessions (
-                                id SERIAL PRIMARY KEY,
-                                user_id INTEGER NOT NULL,
-                                textbook_id INTEGER NOT NULL,
-                                unit_id INTEGER,
-                                study_type TEXT NOT NULL,
-                                progress REAL DEFAULT 0.0,
-                                completed BOOLEAN DEFAULT FALSE,
-                                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                completed_at TIMESTAMP,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        # 統一された学習ログテーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS study_logs (
-                                id SERIAL PRIMARY KEY,
-                                session_id INTEGER NOT NULL,
-                                question_id INTEGER NOT NULL,
-                                user_answer TEXT,
-                                correct_answer TEXT,
-                                is_correct BOOLEAN NOT NULL,
-                                study_type TEXT NOT NULL,
-                                response_time INTEGER,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        # 教材割り当てテーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS textbook_assignments (
-                                id SERIAL PRIMARY KEY,
-                                user_id INTEGER NOT NULL,
-                                textbook_id INTEGER NOT NULL,
-                                study_type TEXT DEFAULT 'both',
-                                units TEXT,
-                                chunks TEXT,
-                                is_active BOOLEAN DEFAULT TRUE,
-                                assigned_by INTEGER NOT NULL,
-                                assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                expires_at TIMESTAMP
-                            )
-                        ''')
-                        
-                        # 教材割り当て詳細テーブル
-                        cur.execute('''
-                            CREATE TABLE IF NOT EXISTS assignment_details (
-                                id SERIAL PRIMARY KEY,
-                                assignment_id INTEGER NOT NULL,
-                                unit_id INTEGER,
-                                chunk_start INTEGER,
-                                chunk_end INTEGER,
-                                difficulty_level TEXT,
-                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )
-                        ''')
-                        
-                        conn.commit()
-                        print("✅ PostgreSQLテーブル作成完了")
-                        
-                        # インデックス作成
-                        indexes = [
-                            "CREATE INDEX IF NOT EXISTS idx_study_log_user_stage_mode ON study_log(user_id, stage, mode);",
-                            "CREATE INDEX IF NOT EXISTS idx_study_log_composite ON study_log(user_id, stage, mode, card_id, id DESC);",
-                            "CREATE INDEX IF NOT EXISTS idx_image_source_page ON image(source, page_number);",
-                            "CREATE INDEX IF NOT EXISTS idx_image_source_level ON image(source, level);",
-                            "CREATE INDEX IF NOT EXISTS idx_chunk_progress_user_source_stage ON chunk_progress(user_id, source, stage);",
-                            "CREATE INDEX IF NOT EXISTS idx_study_log_card_result ON study_log(card_id, result, id DESC);",
-                            "CREATE INDEX IF NOT EXISTS idx_user_settings_user_source ON user_settings(user_id, source);",
-                            "CREATE INDEX IF NOT EXISTS idx_questions_textbook_unit ON input_questions(textbook_id, unit_id);",
-                            "CREATE INDEX IF NOT EXISTS idx_choice_units_textbook ON choice_units(textbook_id, unit_number);",
-                            "CREATE INDEX IF NOT EXISTS idx_choice_questions_unit ON choice_questions(unit_id);",
-                            "CREATE INDEX IF NOT EXISTS idx_choice_study_log_user_question ON choice_study_log(user_id, question_id);",
-                            "CREATE INDEX IF NOT EXISTS idx_choice_study_log_user ON choice_study_log(user_id, answered_at);"
-                        ]
-                        
-                        for index_sql in indexes:
-                            cur.execute(index_sql)
-                        
-                        print("✅ PostgreSQLインデックス作成完了")
-                        
-                        # デフォルト管理者ユーザーを作成（パスワード: admin123）
-                        from werkzeug.security import generate_password_hash
-                        
-                        admin_password_hash = generate_password_hash('admin123')
-                        cur.execute('''
-                            INSERT INTO users (username, email, password_hash, is_admin, is_active)
-                            VALUES (%s, %s, %s, %s, %s)
-                            ON CONFLICT (username) DO NOTHING
-                        ''', ('admin', 'admin@example.com', admin_password_hash, True, True))
-                        
-                        conn.commit()
-                        print("✅ PostgreSQL管理者ユーザー作成完了")
-                        print("   ユーザー名: admin")
-                        print("   パスワード: admin123")
-                    
-        except Exception as e:
-            print(f"❌ PostgreSQL初期化エラー: {e}")
-            return False
-        
-        return True
+                        INSERT INTO users (username, email, password_hash, is_admin, is_active)
+                        VALUES (%s, %s, %s, %s, %s)
+                        ON CONFLICT (username) DO NOTHING
+                    ''', ('admin', 'admin@example.com', admin_password_hash, True, True))
+                conn.commit()
+                print("✅ PostgreSQL管理者ユーザー作成完了")
+                print("   ユーザー名: admin")
+                print("   パスワード: admin123")
+    except Exception as e:
+        print(f"❌ データベース初期化エラー: {e}")
+        return False
+    
+    return True
 
-if __name__ == '__main__':
+def run_startup_tasks():
+    """起動前のDB初期化・初期データ復元（失敗した場合は False）"""
     # データベース初期化
     if not init_database():
         print("❌ データベース初期化に失敗しました")
-        exit(1)
+        return False
     
-    # PostgreSQLの場合、データ移行を実行
-    if os.getenv('DB_TYPE') == 'postgresql':
-        try:
-            print("🔄 PostgreSQLデータベースへの移行を確認しています...")
-            from migrate_to_postgresql import migrate_to_postgresql
-            migrate_to_postgresql()
-        except Exception as e:
-            print(f"❌ データ移行エラー: {e}")
+    # SQLiteからのデータ移行は init-db では行わない（移行時に python migrate_to_postgresql.py を1回実行）
     
     # 初期データの復元
     try:
@@ -899,8 +666,73 @@ if __name__ == '__main__':
         restore_initial_data()
     except Exception as e:
         print(f"❌ 初期データ復元エラー: {e}")
+    return True
+
+@click.command('migrate')
+@click.option('--dry-run', is_flag=True, help='実行するSQLを表示するだけでDBは変更しない')
+@click.option('--to', 'target', type=int, default=None, help='この version まで適用する')
+@with_appcontext
+def migrate_command(dry_run, target):
+    """スキーマのマイグレーションを適用（flask --app app migrate [--dry-run] [--to VERSION]）"""
+    with get_db_connection() as conn:
+        if not dry_run:
+            run_migrations(conn, target=target, log=print)
+            return
+        plan = plan_migrations(conn, target=target)
+    if not plan:
+        print("✅ スキーマは最新です（未適用のマイグレーションはありません）")
+        return
+    for migration, statements in plan:
+        print(f"-- version {migration.version}: {migration.name}")
+        for sql in statements:
+            print(f"{sql.strip()};" if not sql.lstrip().startswith('--') else sql.strip())
+        print()
+
+@click.command('maintain-logs')
+@with_appcontext
+def maintain_logs_command():
+    """学習ログのパーティション作成・日別集計・保持期間の削除（flask --app app maintain-logs）"""
+    config = current_app.config
+    with get_db_connection() as conn:
+        stats = run_log_maintenance(
+            conn,
+            rollup_after_days=config['LOG_ROLLUP_AFTER_DAYS'],
+            retention_days=config['LOG_RAW_RETENTION_DAYS'],
+            months_ahead=config['LOG_PARTITION_MONTHS_AHEAD'],
+            log=print
+        )
+    if stats is not None:
+        print(f"✅ ログのメンテナンスが完了しました: {stats}")
+
+@click.command('partition-logs')
+@with_appcontext
+def partition_logs_command():
+    """PostgreSQL: 学習ログのテーブルを月別パーティションに変換（書き込みが止まるためメンテナンスの時間帯に実行）"""
+    if os.getenv('DB_TYPE', 'sqlite') == 'sqlite':
+        print("⏭️ SQLiteではパーティションに変換しません")
+        return
+    with get_db_connection() as conn:
+        converted = convert_log_tables(conn, months_ahead=current_app.config['LOG_PARTITION_MONTHS_AHEAD'], log=print)
+    if converted is not None:
+        print(f"✅ パーティションへの変換が完了しました: {', '.join(converted) or '変換済み'}")
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """DB初期化・初期データ復元（デプロイ時に1回実行: flask --app app init-db）"""
+    print_environment()
+    if not run_startup_tasks():
+        raise SystemExit(1)
+    print("✅ データベースの初期化が完了しました")
+
+if __name__ == '__main__':
+    # 開発用サーバーで起動（本番は gunicorn -c gunicorn.conf.py wsgi:app）
+    # DBの初期化は事前に flask --app app init-db で行う
+    print_environment()
+    app = create_app()
+    start_background_services(app)
     
     # アプリケーションを起動
     port = int(os.environ.get('PORT', 10000))
-    print(f"🚀 アプリケーションを起動します: port={port}")
-    app.run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
+    print(f"🚀 アプリケーションを起動します（開発用サーバー）: port={port}")
+    app.run(debug=False, host='0.0.0.0', port=port)
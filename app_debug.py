@@ -3,7 +3,9 @@
 
 import os
 import sys
-from app import app
+from app import create_app
+
+app = create_app()
 
 if __name__ == '__main__':
     # デバッグモードを有効にする
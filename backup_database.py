@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+SQLiteデータベースのスナップショットを保存してローテーションするスクリプト
+
+アプリを止めずに sqlite3 の backup API で一貫したコピーを作成する（cronからの実行を想定）。
+
+使い方:
+    python backup_database.py [--dir backups] [--keep 7] [--compress gzip|zstd|none]
+"""
+
+import argparse
+import os
+from dotenv import load_dotenv
+
+# 環境変数を読み込み
+load_dotenv('dbname.env')
+
+from utils.backup import COMPRESSIONS, is_compression_available, write_snapshot
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLiteデータベースのスナップショットを保存')
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'flashcards.db'), help='対象のデータベースファイル')
+    parser.add_argument('--dir', default=os.getenv('BACKUP_DIR', 'backups'), help='保存先ディレクトリ')
+    parser.add_argument('--keep', type=int, default=int(os.getenv('BACKUP_KEEP', 7)), help='残す世代数')
+    parser.add_argument('--compress', default=os.getenv('BACKUP_COMPRESSION', 'gzip'), choices=sorted(COMPRESSIONS))
+    parser.add_argument('--pages', type=int, default=int(os.getenv('BACKUP_PAGES_PER_STEP', 1024)), help='1ステップでコピーするページ数')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"❌ データベースファイルが見つかりません: {args.db}")
+        return 1
+    if not is_compression_available(args.compress):
+        print(f"❌ 利用できない圧縮形式です: {args.compress}（zstd は zstandard パッケージが必要です）")
+        return 1
+
+    print(f"🔄 スナップショット作成中: {args.db}")
+    try:
+        stats = write_snapshot(args.db, args.dir, args.compress, args.keep, pages=args.pages)
+    except Exception as e:
+        print(f"❌ スナップショット作成エラー: {e}")
+        return 1
+
+    print(f"✅ 保存完了: {stats['path']}")
+    print(f"   サイズ: {stats['bytes']:,} bytes → {stats['compressed_bytes']:,} bytes")
+    print(f"   所要時間: {stats['seconds']}秒（ステップ: {stats['steps']}, やり直し: {stats['restarts']}）")
+    for path in stats['removed']:
+        print(f"🗑️  古いスナップショットを削除: {path}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+回答の類似度判定のベンチマークスクリプト
+
+合成した正解と回答（ランダムに数文字を編集したもの）の組で、
+旧方式（(len1+1)x(len2+1) の表を作るDP）と utils.answer_matching
+（ビット並列・閾値での打ち切り・正規化済みの AnswerKey）を比較する。
+
+使い方:
+    python benchmark_answer_matching.py [--pairs 20000] [--max-length 30] [--repeat 3]
+"""
+
+import argparse
+import random
+import time
+
+from utils.answer_matching import SIMILARITY_THRESHOLD, AnswerKey, bounded_similarity, edit_distance
+
+CHARSET = 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん' \
+          'アイウエオカキクケコ日本語漢字学習問題正解abcdefghijklmnopqrstuvwxyz0123456789'
+
+def legacy_levenshtein_distance(str1, str2):
+    """旧方式（utils/choice_utils.py の変更前の実装）"""
+    len1, len2 = len(str1), len(str2)
+    dp = [[0] * (len2 + 1) for _ in range(len1 + 1)]
+    for i in range(len1 + 1):
+        dp[i][0] = i
+    for j in range(len2 + 1):
+        dp[0][j] = j
+    for i in range(1, len1 + 1):
+        for j in range(1, len2 + 1):
+            if str1[i-1] == str2[j-1]:
+                dp[i][j] = dp[i-1][j-1]
+            else:
+                dp[i][j] = min(dp[i-1][j], dp[i][j-1], dp[i-1][j-1]) + 1
+    return dp[len1][len2]
+
+def legacy_similarity(str1, str2):
+    if not str1 or not str2:
+        return 0.0
+    distance = legacy_levenshtein_distance(str1, str2)
+    return max(0.0, 1.0 - distance / max(len(str1), len(str2)))
+
+def mutate(rng, text, edits):
+    """text に edits 回のランダムな置換・挿入・削除を加える"""
+    chars = list(text)
+    for _ in range(edits):
+        op = rng.choice(('replace', 'insert', 'delete'))
+        position = rng.randrange(len(chars) + 1)
+        if op == 'insert' or not chars:
+            chars.insert(position, rng.choice(CHARSET))
+        elif op == 'delete':
+            del chars[min(position, len(chars) - 1)]
+        else:
+            chars[min(position, len(chars) - 1)] = rng.choice(CHARSET)
+    return ''.join(chars)
+
+def create_pairs(count, max_length, seed=42):
+    """(正解, 回答) の組を作成（一部は完全一致・大きく異なる回答）"""
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        correct = ''.join(rng.choice(CHARSET) for _ in range(rng.randint(2, max_length)))
+        kind = rng.random()
+        if kind < 0.1:
+            answer = correct
+        elif kind < 0.3:
+            answer = ''.join(rng.choice(CHARSET) for _ in range(rng.randint(1, max_length)))
+        else:
+            answer = mutate(rng, correct, rng.randint(1, max(1, len(correct) // 3)))
+        pairs.append((correct, answer))
+    return pairs
+
+def measure(label, func, pairs, repeat):
+    """全組の判定にかかった時間（最良値）と判定結果を返す"""
+    best = None
+    results = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = [func(correct, answer) for correct, answer in pairs]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label}: {best * 1000:.1f}ms（1組あたり {best / len(pairs) * 1e6:.2f}µs）")
+    return best, results
+
+def main():
+    parser = argparse.ArgumentParser(description='回答の類似度判定のベンチマーク')
+    parser.add_argument('--pairs', type=int, default=20000, help='正解と回答の組の数')
+    parser.add_argument('--max-length', type=int, default=30, help='正解の最大文字数')
+    parser.add_argument('--repeat', type=int, default=3, help='繰り返し回数（最良値を採用）')
+    args = parser.parse_args()
+
+    pairs = create_pairs(args.pairs, args.max_length)
+    keys = {correct: AnswerKey(correct, normalized=True) for correct, _ in pairs}
+    print(f"🔧 {len(pairs):,}組（正解は最大{args.max_length}文字）, 類似度の閾値 {SIMILARITY_THRESHOLD}")
+
+    print("📏 編集距離（正確な値）")
+    legacy_time, legacy_distances = measure('旧方式（全表DP）', legacy_levenshtein_distance, pairs, args.repeat)
+    new_time, new_distances = measure('ビット並列', edit_distance, pairs, args.repeat)
+    print(f"    🚀 速度比: {legacy_time / new_time:.1f}倍")
+    mismatches = sum(1 for a, b in zip(legacy_distances, new_distances) if a != b)
+
+    print(f"✅ 類似判定（{SIMILARITY_THRESHOLD:.0%}以上か）")
+    legacy_time, legacy_matches = measure(
+        '旧方式（全表DP）',
+        lambda correct, answer: legacy_similarity(answer, correct) >= SIMILARITY_THRESHOLD,
+        pairs, args.repeat
+    )
+    for label, func in (
+        ('打ち切りあり', lambda correct, answer: bounded_similarity(answer, correct) is not None),
+        ('AnswerKey（正解側を事前計算）', lambda correct, answer: keys[correct].similarity(answer) is not None),
+    ):
+        elapsed, matches = measure(label, func, pairs, args.repeat)
+        print(f"    🚀 速度比: {legacy_time / elapsed:.1f}倍")
+        mismatches += sum(1 for a, b in zip(legacy_matches, matches) if a != b)
+
+    if mismatches:
+        print(f"❌ 旧方式との結果の不一致: {mismatches}件")
+        return 1
+    print("✅ 結果は旧方式と全て一致")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+ステージ完了判定のベンチマークスクリプト
+
+一時SQLiteデータベースに合成データ（study_log 10万行）を作成し、
+旧方式（カードごとにCOUNTするN+1クエリ）と get_stage_completion（集計クエリ1回）を比較する。
+
+使い方:
+    python benchmark_stage_completion.py [--rows 100000] [--cards 600] [--users 50] [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+def create_synthetic_db(path, rows, cards, users, source):
+    """合成データを作成"""
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE image (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            page_number INTEGER NOT NULL,
+            level TEXT,
+            image_path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE study_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            card_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            stage INTEGER NOT NULL,
+            mode TEXT NOT NULL,
+            result TEXT NOT NULL,
+            page_range TEXT,
+            difficulty TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX idx_image_source_page ON image(source, page_number);
+        CREATE INDEX idx_study_log_composite ON study_log(user_id, stage, mode, card_id, id DESC);
+        CREATE INDEX idx_study_log_card_result ON study_log(card_id, result, id DESC);
+        CREATE INDEX idx_study_log_user_card ON study_log(user_id, card_id, result, stage);
+    ''')
+    conn.executemany(
+        'INSERT INTO image (source, page_number, level) VALUES (?, ?, ?)',
+        [(source, n // 3 + 1, random.choice(['A', 'B', 'C'])) for n in range(cards)]
+    )
+    rng = random.Random(42)
+    conn.executemany(
+        'INSERT INTO study_log (user_id, card_id, source, stage, mode, result) VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            (rng.randint(1, users), rng.randint(1, cards), source, rng.randint(1, 3), 'test',
+             'known' if rng.random() < 0.7 else 'unknown')
+            for _ in range(rows)
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+def legacy_is_stage_perfect(cur, user_id, card_ids):
+    """旧方式：カードごとにCOUNTクエリを実行（全カードを判定した場合の時間を測るため途中で打ち切らない）"""
+    perfect = True
+    for card_id in card_ids:
+        cur.execute('''
+            SELECT COUNT(*) FROM study_log
+            WHERE user_id = ? AND card_id = ? AND result = 'known'
+        ''', (user_id, card_id))
+        if cur.fetchone()[0] == 0:
+            perfect = False
+    return perfect
+
+def main():
+    parser = argparse.ArgumentParser(description='ステージ完了判定のベンチマーク')
+    parser.add_argument('--rows', type=int, default=100000, help='study_logの行数')
+    parser.add_argument('--cards', type=int, default=600, help='教材のカード数')
+    parser.add_argument('--users', type=int, default=50, help='ユーザー数')
+    parser.add_argument('--repeat', type=int, default=5, help='計測回数')
+    args = parser.parse_args()
+
+    source = 'bench'
+    workdir = tempfile.mkdtemp(prefix='stage_bench_')
+    db_path = os.path.join(workdir, 'bench.db')
+    print(f"🔧 合成データ作成中: study_log={args.rows:,}行, cards={args.cards}, users={args.users}")
+    create_synthetic_db(db_path, args.rows, args.cards, args.users, source)
+
+    # アプリと同じ接続経路（utils.db）で計測する
+    os.environ['DB_TYPE'] = 'sqlite'
+    os.environ['DB_PATH'] = db_path
+    from flask import Flask
+    from utils.db import close_sqlite_pools
+    from utils.study_utils import get_stage_completion
+
+    app = Flask(__name__)
+    user_ids = list(range(1, args.users + 1))
+    with app.app_context():
+        conn = sqlite3.connect(db_path)
+        cur = conn.cursor()
+        card_ids = [row[0] for row in cur.execute(
+            'SELECT id FROM image WHERE source = ? ORDER BY page_number, level, id', (source,)
+        )]
+
+        def measure():
+            legacy_times = []
+            new_times = []
+            mismatches = 0
+            for _ in range(args.repeat):
+                for user_id in user_ids:
+                    started = time.perf_counter()
+                    legacy = legacy_is_stage_perfect(cur, user_id, card_ids)
+                    legacy_times.append(time.perf_counter() - started)
+
+                    started = time.perf_counter()
+                    completion = get_stage_completion(user_id, source, '', '')
+                    new_times.append(time.perf_counter() - started)
+
+                    if legacy != completion['all_known']:
+                        mismatches += 1
+            return legacy_times, new_times, mismatches
+
+        results = [('idx_study_log_user_card あり', measure())]
+        cur.execute('DROP INDEX idx_study_log_user_card')
+        conn.commit()
+        results.append(('idx_study_log_user_card なし', measure()))
+        conn.close()
+        close_sqlite_pools()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    def summarize(label, times):
+        times = sorted(times)
+        avg = sum(times) / len(times) * 1000
+        p95 = times[int(len(times) * 0.95) - 1] * 1000
+        print(f"    {label}: 平均 {avg:.2f}ms / p95 {p95:.2f}ms")
+        return avg
+
+    print(f"📊 1ユーザーあたりの判定時間（{args.users * args.repeat}回, クエリ数: 旧方式 {len(card_ids)}回 / 新方式 1回）")
+    for label, (legacy_times, new_times, mismatches) in results:
+        print(f"  [{label}]")
+        legacy_avg = summarize('旧方式（N+1）  ', legacy_times)
+        new_avg = summarize('集計クエリ1回 ', new_times)
+        print(f"    🚀 速度比: {legacy_avg / new_avg:.1f}倍")
+        if mismatches:
+            print(f"    ❌ 判定結果の不一致: {mismatches}件")
+        else:
+            print("    ✅ 判定結果は全て一致")
+    print("※ PostgreSQLではクエリごとにネットワーク往復が発生するため、クエリ数の差がそのまま効く")
+
+if __name__ == "__main__":
+    main()
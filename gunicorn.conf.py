@@ -0,0 +1,76 @@
+"""
+gunicorn の設定（本番用）
+
+使い方:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+設定は環境変数で変更できる。
+    PORT                       待ち受けポート（既定: 10000）
+    WEB_CONCURRENCY            ワーカープロセス数（既定: CPU数 x 2 + 1）
+    GUNICORN_THREADS           ワーカーごとのスレッド数（既定: 4）
+    GUNICORN_KEEPALIVE         keep-alive 接続を保持する秒数（既定: 75）
+    GUNICORN_TIMEOUT           応答のないワーカーを再起動するまでの秒数（既定: 60）
+    GUNICORN_GRACEFUL_TIMEOUT  停止・再起動時に処理中のリクエストを待つ秒数（既定: 30）
+    GUNICORN_MAX_REQUESTS      この件数を処理したワーカーを入れ替える（既定: 1000、0で無効）
+    GUNICORN_PRELOAD           true でマスターに読み込んでから fork する（既定: false）
+
+グレースフルリロード:
+    kill -HUP <マスターのpid>
+    処理中のリクエストを終えたワーカーから順に新しいワーカーに入れ替える。
+    GUNICORN_PRELOAD=true の場合はコードは読み直されないため、コードの更新には
+    USR2（新しいマスターを起動）→ 古いマスターに TERM を送る。
+
+DBの初期化・データ移行はワーカーの起動時には行わない。デプロイ時に
+    flask --app app init-db
+を1回実行する。
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+
+# ワーカー: I/O 待ち（DB）が多いため、プロセス数 x スレッド数で同時に処理する
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# keep-alive: 前段のロードバランサーのアイドルタイムアウトより長くし、
+# ロードバランサー側から切断させる（こちらが先に切ると再利用中の接続で 502 になる）
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 75))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# メモリの増加に備えてワーカーを定期的に入れ替える（同時に入れ替わらないようにずらす）
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max(max_requests // 10, 0)
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
+
+# ハートビートのファイルをメモリ上に置く（コンテナのディスクが遅い場合の停止を防ぐ）
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+# 学習進捗のキャッシュはワーカー間で無効化を共有できるよう sqlite にする（明示的な指定を優先）
+if workers > 1:
+    os.environ.setdefault('STUDY_CACHE_BACKEND', 'sqlite')
+
+def post_worker_init(worker):
+    """ワーカーごとにログ書き込みなどのバックグラウンド処理を起動"""
+    from app import start_background_services
+    start_background_services(worker.wsgi)
+
+def worker_exit(server, worker):
+    """ワーカーの終了時に残りの学習ログを書き込み、接続を閉じる"""
+    from app import stop_background_services
+    from utils.db import close_pg_pool, close_sqlite_pools
+    # アプリの読み込みに失敗したワーカーでは wsgi がない
+    if getattr(worker, 'wsgi', None) is not None:
+        stop_background_services(worker.wsgi)
+    close_pg_pool()
+    close_sqlite_pools()
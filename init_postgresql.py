@@ -83,6 +83,43 @@ def init_postgresql():
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )''',
             
+            # チャンク進捗の集計テーブル（カード単位、study_log から更新）
+            '''CREATE TABLE IF NOT EXISTS chunk_card_progress (
+                user_id INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                stage INTEGER NOT NULL,
+                mode TEXT NOT NULL,
+                page_range TEXT NOT NULL DEFAULT '',
+                difficulty TEXT NOT NULL DEFAULT '',
+                chunk_number INTEGER NOT NULL,
+                card_id INTEGER NOT NULL,
+                correct_count INTEGER NOT NULL DEFAULT 0,
+                wrong_count INTEGER NOT NULL DEFAULT 0,
+                last_result TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, source, stage, mode, page_range, difficulty, card_id)
+            )''',
+            
+            # 管理画面のバックグラウンドジョブ（CSV取り込み・データ復元など）
+            '''CREATE TABLE IF NOT EXISTS background_jobs (
+                id TEXT PRIMARY KEY,
+                job_type TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                params TEXT,
+                progress_current INTEGER NOT NULL DEFAULT 0,
+                progress_total INTEGER,
+                message TEXT,
+                result TEXT,
+                error TEXT,
+                cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+                created_by INTEGER,
+                worker_pid INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''',
+            
             # 画像テーブル
             '''CREATE TABLE IF NOT EXISTS image (
                 id SERIAL PRIMARY KEY,
@@ -178,6 +215,7 @@ def init_postgresql():
                 question TEXT NOT NULL,
                 correct_answer TEXT NOT NULL,
                 choices TEXT NOT NULL,
+                correct_answer_norm TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )''',
             
@@ -222,6 +260,8 @@ def init_postgresql():
                 correct_answer TEXT NOT NULL,
                 choices TEXT,
                 acceptable_answers TEXT,
+                correct_answer_norm TEXT,
+                acceptable_answers_norm TEXT,
                 answer_suffix TEXT,
                 explanation TEXT,
                 difficulty_level TEXT,
@@ -303,12 +343,18 @@ def init_postgresql():
             "CREATE INDEX IF NOT EXISTS idx_image_source_page ON image(source, page_number);",
             "CREATE INDEX IF NOT EXISTS idx_image_source_level ON image(source, level);",
             "CREATE INDEX IF NOT EXISTS idx_chunk_progress_user_source_stage ON chunk_progress(user_id, source, stage);",
+            "CREATE INDEX IF NOT EXISTS idx_chunk_card_progress_chunk ON chunk_card_progress(user_id, source, stage, page_range, difficulty, chunk_number);",
+            "CREATE INDEX IF NOT EXISTS idx_background_jobs_status ON background_jobs(status, created_at);",
             "CREATE INDEX IF NOT EXISTS idx_study_log_card_result ON study_log(card_id, result, id DESC);",
+            "CREATE INDEX IF NOT EXISTS idx_study_log_user_card ON study_log(user_id, card_id, result, stage);",
             "CREATE INDEX IF NOT EXISTS idx_user_settings_user_source ON user_settings(user_id, source);",
             "CREATE INDEX IF NOT EXISTS idx_questions_textbook_unit ON input_questions(textbook_id, unit_id);",
             "CREATE INDEX IF NOT EXISTS idx_choice_units_textbook ON choice_units(textbook_id, unit_number);",
             "CREATE INDEX IF NOT EXISTS idx_choice_questions_unit ON choice_questions(unit_id);",
             "CREATE INDEX IF NOT EXISTS idx_choice_study_log_user_question ON choice_study_log(user_id, question_id);",
+            "CREATE INDEX IF NOT EXISTS idx_textbook_assignments_user ON textbook_assignments(user_id, is_active, assigned_at);",
+            "CREATE INDEX IF NOT EXISTS idx_assignment_details_assignment ON assignment_details(assignment_id, unit_id);",
+            "CREATE INDEX IF NOT EXISTS idx_assignment_details_unit ON assignment_details(unit_id, assignment_id);",
             "CREATE INDEX IF NOT EXISTS idx_choice_study_log_user ON choice_study_log(user_id, answered_at);"
         ]
         
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+教材割り当ての単元を assignment_details に移行するスクリプト
+
+textbook_assignments.units（単元IDのJSON）にしか単元がない既存の割り当てを
+assignment_details の行に展開し、単元からの逆引き用のインデックスを作成する。
+何度実行してもよい（移行済みの割り当ては対象外）。
+
+使い方:
+    python migrate_assignment_details.py
+"""
+
+import time
+from dotenv import load_dotenv
+from flask import Flask
+
+# 環境変数を読み込み
+load_dotenv('dbname.env')
+
+from utils.db import get_db_connection, get_db_cursor, close_pg_pool, close_sqlite_pools
+from utils.assignments import create_assignment_indexes, backfill_assignment_details
+
+def main():
+    app = Flask(__name__)
+    print("🔄 割り当て単元を assignment_details に移行中...")
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            with get_db_connection() as conn:
+                with get_db_cursor(conn) as cur:
+                    create_assignment_indexes(cur)
+                    stats = backfill_assignment_details(cur)
+                conn.commit()
+        elapsed = time.perf_counter() - started
+        print(f"✅ 移行完了: {stats['assignments']}件の割り当て, {stats['units']}単元 ({elapsed:.2f}秒)")
+        return 0
+    except Exception as e:
+        print(f"❌ 移行エラー: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        close_pg_pool()
+        close_sqlite_pools()
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,281 +1,409 @@
 #!/usr/bin/env python3
 """
 SQLiteからPostgreSQLへのデータ移行スクリプト
+
+各テーブルを rowid 順のチャンク（WHERE rowid > 前回の最後 ORDER BY rowid LIMIT n）で読み、
+CSV のバッファにまとめて COPY FROM STDIN で書き込む。チャンクを書き込むたびに最後の rowid と
+件数を data_transfer_progress テーブルに（同じトランザクションで）記録するため、
+途中で中断した場合も同じコマンドを再実行すれば続きから再開できる。
+最後に移行元と移行先の件数とチェックサムを照合する。
+
+使い方:
+    python migrate_to_postgresql.py [--sqlite-path flashcards.db] [--tables study_log,study_logs]
+                                    [--chunk-size 50000] [--truncate] [--restart] [--verify-only]
+
+    --truncate     移行先のテーブルに移行前からある行（init-db で作成した admin など）を削除してから移行する
+    --restart      記録した進捗を捨てて最初から移行する（移行先のテーブルは --truncate で空にする）
+    --verify-only  移行せずに件数とチェックサムの照合だけを行う
+
+移行先のテーブルは utils/migrations.py のマイグレーションで作成する（flask --app app migrate と同じ）。
+移行元と移行先の両方にある列だけを移行し、id の連番は移行後に最大値に合わせる。
+学習ログは親テーブル（study_log など）に書き込み、PostgreSQL の月別パーティションに振り分けられる
+（COPY の前に移行元の最も古い月からのパーティションを作成し、DEFAULT パーティションに入らないようにする）。
+SQLite の月別テーブル（study_log_p202401 など、日別に集計済みの古い生ログ）は移行しない
+（集計の study_log_daily と log_rollup_state は移行する）。
+アプリの起動時や init-db では実行しない（PostgreSQL への移行時に1回実行する）。
 """
 
+import argparse
+import hashlib
+import io
+import os
 import sqlite3
+import time
+from datetime import date, datetime
 import psycopg2
-import os
-from datetime import datetime
-from werkzeug.security import generate_password_hash
 from dotenv import load_dotenv
+from flask import Flask
 
-def migrate_to_postgresql():
-    """SQLiteからPostgreSQLへのデータ移行"""
-    load_dotenv(dotenv_path='dbname.env')
-    
-    # 環境変数の確認
-    db_type = os.getenv('DB_TYPE', 'sqlite')
-    if db_type != 'postgresql':
-        print("❌ DB_TYPEがpostgresqlに設定されていません")
+load_dotenv('dbname.env')
+
+from utils.migrations import run_migrations
+from utils.log_maintenance import LOG_TABLES, ensure_partitions, is_log_partition_name, is_partitioned, to_date
+
+# 参照される側のテーブルから順に移行する（ここにない共通のテーブルはその後に名前順で移行）
+TRANSFER_ORDER = [
+    'users', 'user_settings', 'image',
+    'textbooks', 'units', 'questions',
+    'input_textbooks', 'input_units', 'input_questions',
+    'choice_textbooks', 'choice_units', 'choice_questions',
+    'textbook_assignments', 'assignment_details',
+    'chunk_progress', 'chunk_card_progress', 'study_sessions',
+    'study_log', 'study_logs', 'input_study_log', 'choice_study_log',
+]
+
+# 移行しないテーブル（スキーマの管理用・一時的なジョブ・この移行の進捗）
+EXCLUDED_TABLES = {'sqlite_sequence', 'schema_version', 'background_jobs', 'data_transfer_progress'}
+
+PROGRESS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS data_transfer_progress (
+        table_name TEXT PRIMARY KEY,
+        source_path TEXT NOT NULL,
+        last_rowid BIGINT NOT NULL DEFAULT 0,
+        rows_copied BIGINT NOT NULL DEFAULT 0,
+        completed BOOLEAN NOT NULL DEFAULT FALSE,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+CHECKSUM_MODULUS = 2 ** 64
+
+class TransferError(Exception):
+    """移行を続けられない状態（移行先に既存の行がある、移行元が変わったなど）"""
+
+def connect_postgresql():
+    """移行先の PostgreSQL に接続（アプリの接続プールとは別の専用の接続）"""
+    params = {
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT'),
+        'database': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+    }
+    if not all(params.values()):
+        raise TransferError("PostgreSQL接続情報が不完全です（DB_HOST / DB_PORT / DB_NAME / DB_USER / DB_PASSWORD）")
+    return psycopg2.connect(connect_timeout=10, **params)
+
+def connect_sqlite(path):
+    """移行元の SQLite を読み取り専用で開く"""
+    if not os.path.exists(path):
+        raise TransferError(f"SQLiteファイルが見つかりません: {path}")
+    return sqlite3.connect(f'file:{os.path.abspath(path)}?mode=ro', uri=True)
+
+def get_sqlite_columns(src, table):
+    """移行元の列名のリスト（定義順）"""
+    return [row[1] for row in src.execute(f'PRAGMA table_info({table})')]
+
+def get_postgresql_columns(cur, table):
+    """移行先の列名 -> 型（information_schema の data_type）"""
+    cur.execute('''
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+    ''', (table,))
+    return dict(cur.fetchall())
+
+def get_transfer_tables(src, cur, requested=None):
+    """移行元と移行先の両方にあるテーブル（TRANSFER_ORDER の順）"""
+    source_tables = {row[0] for row in src.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    cur.execute('SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()')
+    target_tables = {row[0] for row in cur.fetchall()}
+    archived = sorted(table for table in source_tables if is_log_partition_name(table))
+    if archived:
+        print(f"⚠️ SQLiteの月別テーブル（集計済みの古い生ログ）は移行しません: {', '.join(archived)}")
+    common = {
+        table for table in (source_tables & target_tables) - EXCLUDED_TABLES
+        if not is_log_partition_name(table)
+    }
+    if requested:
+        missing = set(requested) - common
+        if missing:
+            raise TransferError(f"移行元または移行先にないテーブルです: {', '.join(sorted(missing))}")
+        common = set(requested)
+    ordered = [table for table in TRANSFER_ORDER if table in common]
+    return ordered + sorted(common - set(ordered))
+
+def csv_field(value):
+    """COPY (FORMAT csv) の1項目（引用符なしの空が NULL、文字列は常に引用符で囲んで空文字列と区別する）"""
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, bytes):
+        return '"\\x' + value.hex() + '"'
+    return '"' + str(value).replace('"', '""') + '"'
+
+def normalize_value(value, data_type):
+    """チェックサム用に移行元（SQLite の値）と移行先（psycopg2 の値）を同じ文字列にそろえる"""
+    if value is None:
+        return '\\N'
+    if data_type == 'boolean':
+        if isinstance(value, str):
+            value = value.strip().lower() in ('1', 't', 'true', 'y', 'yes', 'on')
+        return '1' if value else '0'
+    if data_type.startswith('timestamp') or data_type == 'date':
+        if isinstance(value, str):
+            try:
+                value = datetime.fromisoformat(value.strip())
+            except ValueError:
+                return value
+            if data_type == 'date':
+                value = value.date()
+        if isinstance(value, datetime):
+            # タイムゾーンなしの TIMESTAMP にはオフセットが保存されない
+            return value.replace(tzinfo=None).isoformat(sep=' ')
+        if isinstance(value, date):
+            return value.isoformat()
+        return str(value)
+    if data_type in ('smallint', 'integer', 'bigint'):
+        return str(int(value))
+    if data_type in ('real', 'double precision', 'numeric'):
+        # real は単精度で保存されるため有効数字6桁で比較する
+        return f'{float(value):.6g}' if data_type == 'real' else repr(float(value))
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+def row_hash(row, data_types):
+    """1行のハッシュ（64ビット整数）"""
+    text = '\x1f'.join(normalize_value(value, data_type) for value, data_type in zip(row, data_types))
+    digest = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+def load_progress(cur, table):
+    """記録した進捗 (source_path, last_rowid, rows_copied, completed)（記録がない場合は None）"""
+    cur.execute('''
+        SELECT source_path, last_rowid, rows_copied, completed
+        FROM data_transfer_progress WHERE table_name = %s
+    ''', (table,))
+    return cur.fetchone()
+
+def save_progress(cur, table, source_path, last_rowid, rows_copied, completed=False):
+    cur.execute('''
+        INSERT INTO data_transfer_progress (table_name, source_path, last_rowid, rows_copied, completed, updated_at)
+        VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (table_name) DO UPDATE SET
+            source_path = EXCLUDED.source_path,
+            last_rowid = EXCLUDED.last_rowid,
+            rows_copied = EXCLUDED.rows_copied,
+            completed = EXCLUDED.completed,
+            updated_at = EXCLUDED.updated_at
+    ''', (table, source_path, last_rowid, rows_copied, completed))
+
+def get_transfer_columns(src, cur, table):
+    """移行する列（移行元の定義順）と、移行先にないため移行しない列"""
+    target_columns = get_postgresql_columns(cur, table)
+    source_columns = get_sqlite_columns(src, table)
+    columns = [column for column in source_columns if column in target_columns]
+    skipped = [column for column in source_columns if column not in target_columns]
+    return columns, [target_columns[column] for column in columns], skipped
+
+def reset_sequence(cur, table):
+    """id の連番を移行した最大値の次に合わせる（SERIAL の列がない場合は何もしない）"""
+    cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+    row = cur.fetchone()
+    if row and row[0]:
+        cur.execute(
+            f'SELECT setval(%s, COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table}',
+            (row[0],)
+        )
+
+def prepare_log_partitions(src, cur, table):
+    """
+    学習ログ: 移行元の最も古い月から先の月までの月別パーティションを作成する（作成した名前のリスト）
+
+    パーティションのない月の行は DEFAULT パーティションに入るため、COPY の前に作成しておく。
+    """
+    if table not in LOG_TABLES or not is_partitioned(cur, table):
+        return []
+    first = to_date(src.execute(f'SELECT MIN(created_at) FROM {table}').fetchone()[0])
+    return ensure_partitions(cur, table, int(os.getenv('LOG_PARTITION_MONTHS_AHEAD', 3)), since=first)
+
+def transfer_table(src, pg, table, source_path, chunk_size, truncate=False, restart=False):
+    """
+    1テーブルを rowid 順のチャンクで COPY する（記録した進捗があればその続きから）
+
+    戻り値: このテーブルの移行済みの件数
+    """
+    with pg.cursor() as cur:
+        columns, data_types, skipped = get_transfer_columns(src, cur, table)
+        if skipped:
+            print(f"⚠️ {table}: 移行先にない列は移行しません: {', '.join(skipped)}")
+        if not columns:
+            print(f"⚠️ {table}: 共通の列がないためスキップします")
+            return 0
+
+        progress = None if restart else load_progress(cur, table)
+        if progress is not None and progress[0] != source_path:
+            raise TransferError(
+                f"{table}: 前回の移行元 ({progress[0]}) と異なります。最初から移行する場合は --restart を指定してください"
+            )
+        if progress is not None and progress[3]:
+            print(f"⏭️ {table}: 移行済み（{progress[2]:,}件）")
+            return progress[2]
+
+        if progress is None:
+            cur.execute(f'SELECT EXISTS (SELECT 1 FROM {table})')
+            if cur.fetchone()[0]:
+                if not truncate:
+                    raise TransferError(
+                        f"{table}: 移行先に既存の行があります。削除して移行する場合は --truncate を指定してください"
+                    )
+                cur.execute(f'TRUNCATE {table}')
+            last_rowid, rows_copied = 0, 0
+            save_progress(cur, table, source_path, last_rowid, rows_copied)
+            pg.commit()
+        else:
+            _, last_rowid, rows_copied, _ = progress
+            print(f"🔄 {table}: rowid {last_rowid} の続きから再開します（移行済み {rows_copied:,}件）")
+
+        created = prepare_log_partitions(src, cur, table)
+        pg.commit()
+        if created:
+            print(f"✅ {table}: 月別パーティションを作成しました（{created[0]} 〜 {created[-1]}、{len(created)}個）")
+
+        column_list = ', '.join(columns)
+        select_sql = f'SELECT rowid, {column_list} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?'
+        copy_sql = f'COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)'
+        started = time.monotonic()
+        copied_now = 0
+        while True:
+            rows = src.execute(select_sql, (last_rowid, chunk_size)).fetchall()
+            if not rows:
+                break
+            buffer = io.StringIO()
+            for row in rows:
+                buffer.write(','.join([csv_field(value) for value in row[1:]]))
+                buffer.write('\n')
+            buffer.seek(0)
+            # チャンクの行と進捗を同じトランザクションでコミットする（中断しても重複・欠落しない）
+            cur.copy_expert(copy_sql, buffer)
+            last_rowid = rows[-1][0]
+            rows_copied += len(rows)
+            copied_now += len(rows)
+            save_progress(cur, table, source_path, last_rowid, rows_copied)
+            pg.commit()
+            elapsed = max(time.monotonic() - started, 0.001)
+            print(f"   {table}: {rows_copied:,}件（rowid {last_rowid}、{copied_now / elapsed:,.0f}件/秒）")
+
+        if 'id' in columns:
+            reset_sequence(cur, table)
+        save_progress(cur, table, source_path, last_rowid, rows_copied, completed=True)
+        pg.commit()
+        # 大量に追加した直後は統計情報が古く、実行計画が悪くなるため更新しておく
+        cur.execute(f'ANALYZE {table}')
+        pg.commit()
+    print(f"✅ {table}: {rows_copied:,}件を移行しました（{time.monotonic() - started:.1f}秒）")
+    return rows_copied
+
+def table_checksum(rows, data_types):
+    """行の順序によらないチェックサム（各行のハッシュの和）と件数"""
+    checksum = 0
+    count = 0
+    for row in rows:
+        checksum = (checksum + row_hash(row, data_types)) % CHECKSUM_MODULUS
+        count += 1
+    return checksum, count
+
+def verify_table(src, pg, table):
+    """移行元と移行先の件数とチェックサムを照合（一致すれば True）"""
+    with pg.cursor() as cur:
+        columns, data_types, _ = get_transfer_columns(src, cur, table)
+    if not columns:
+        return True
+    column_list = ', '.join(columns)
+    source_checksum, source_count = table_checksum(src.execute(f'SELECT {column_list} FROM {table}'), data_types)
+    # 名前付きカーソル（サーバー側カーソル）で全行をメモリに読み込まずに走査する
+    with pg.cursor(name=f'verify_{table}') as cur:
+        cur.itersize = 10000
+        cur.execute(f'SELECT {column_list} FROM {table}')
+        target_checksum, target_count = table_checksum(cur, data_types)
+    pg.commit()
+    if source_count != target_count:
+        print(f"❌ {table}: 件数が一致しません（移行元 {source_count:,}件 / 移行先 {target_count:,}件）")
         return False
-    
-    # PostgreSQL接続情報
-    db_host = os.getenv('DB_HOST')
-    db_port = os.getenv('DB_PORT')
-    db_name = os.getenv('DB_NAME')
-    db_user = os.getenv('DB_USER')
-    db_password = os.getenv('DB_PASSWORD')
-    
-    if not all([db_host, db_port, db_name, db_user, db_password]):
-        print("❌ PostgreSQL接続情報が不完全です")
+    if source_checksum != target_checksum:
+        print(f"❌ {table}: チェックサムが一致しません（{source_count:,}件 移行元 {source_checksum:016x} / 移行先 {target_checksum:016x}）")
         return False
-    
-    # SQLiteファイルの確認
-    sqlite_path = 'flashcards.db'
-    if not os.path.exists(sqlite_path):
-        print("❌ SQLiteファイルが見つかりません")
+    print(f"✅ {table}: {target_count:,}件 チェックサム一致 ({target_checksum:016x})")
+    return True
+
+def migrate_to_postgresql(sqlite_path=None, tables=None, chunk_size=50000, truncate=False,
+                          restart=False, verify_only=False):
+    """SQLiteからPostgreSQLへのデータ移行（すべてのテーブルの照合が一致すれば True）"""
+    if os.getenv('DB_TYPE', 'sqlite') != 'postgresql':
+        print("❌ DB_TYPEがpostgresqlに設定されていません")
         return False
-    
+    sqlite_path = os.path.abspath(sqlite_path or os.getenv('DB_PATH', 'flashcards.db'))
+
+    src = pg = None
     try:
-        # SQLite接続
-        sqlite_conn = sqlite3.connect(sqlite_path)
-        sqlite_conn.row_factory = sqlite3.Row
-        
-        # PostgreSQL接続
-        pg_conn = psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            database=db_name,
-            user=db_user,
-            password=db_password,
-            connect_timeout=10
-        )
-        
-        print("✅ データベース接続完了")
-        
-        # ユーザーデータの移行
-        print("👥 ユーザーデータを移行中...")
-        sqlite_cursor = sqlite_conn.cursor()
-        pg_cursor = pg_conn.cursor()
-        
-        # ユーザーテーブルの作成
-        pg_cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(255) UNIQUE NOT NULL,
-                full_name VARCHAR(255),
-                email VARCHAR(255),
-                password_hash TEXT NOT NULL,
-                is_admin BOOLEAN DEFAULT FALSE,
-                is_active BOOLEAN DEFAULT TRUE,
-                grade VARCHAR(50) DEFAULT '一般',
-                last_login TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 既存のユーザーデータを取得
-        sqlite_cursor.execute('SELECT * FROM users')
-        users = sqlite_cursor.fetchall()
-        
-        for user in users:
-            # ユーザーが既に存在するかチェック
-            pg_cursor.execute('SELECT id FROM users WHERE username = %s', (user['username'],))
-            if not pg_cursor.fetchone():
-                # boolean型の変換
-                is_admin = bool(user['is_admin']) if user['is_admin'] is not None else False
-                is_active = bool(user['is_active']) if user['is_active'] is not None else True
-                
-                pg_cursor.execute('''
-                    INSERT INTO users (username, full_name, email, password_hash, is_admin, is_active, grade, last_login, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ''', (
-                    user['username'],
-                    user['full_name'],
-                    user['email'],
-                    user['password_hash'],
-                    is_admin,
-                    is_active,
-                    user['grade'],
-                    user['last_login'],
-                    user['created_at']
-                ))
-                print(f"✅ ユーザー '{user['username']}' を移行しました")
-            else:
-                print(f"⚠️  ユーザー '{user['username']}' は既に存在します")
-        
-        # 教材データの移行
-        print("📚 教材データを移行中...")
-        
-        # input_textbooksテーブルの作成
-        pg_cursor.execute('''
-            CREATE TABLE IF NOT EXISTS input_textbooks (
-                id SERIAL PRIMARY KEY,
-                title VARCHAR(255) NOT NULL,
-                description TEXT,
-                question_types TEXT DEFAULT '["input"]',
-                subject VARCHAR(100) DEFAULT '地理',
-                grade VARCHAR(50) DEFAULT '高校',
-                publisher VARCHAR(255),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # input_unitsテーブルの作成
-        pg_cursor.execute('''
-            CREATE TABLE IF NOT EXISTS input_units (
-                id SERIAL PRIMARY KEY,
-                textbook_id INTEGER,
-                title VARCHAR(255) NOT NULL,
-                description TEXT,
-                unit_number INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (textbook_id) REFERENCES input_textbooks (id)
-            )
-        ''')
-        
-        # input_questionsテーブルの作成
-        pg_cursor.execute('''
-            CREATE TABLE IF NOT EXISTS input_questions (
-                id SERIAL PRIMARY KEY,
-                unit_id INTEGER,
-                question_text TEXT NOT NULL,
-                correct_answer TEXT NOT NULL,
-                explanation TEXT,
-                image_path TEXT,
-                question_type VARCHAR(50) DEFAULT 'input',
-                question_data TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (unit_id) REFERENCES input_units (id)
-            )
-        ''')
-        
-        # 教材データの移行
-        sqlite_cursor.execute('SELECT * FROM input_textbooks')
-        textbooks = sqlite_cursor.fetchall()
-        
-        for textbook in textbooks:
-            pg_cursor.execute('SELECT id FROM input_textbooks WHERE title = %s', (textbook['name'],))
-            if not pg_cursor.fetchone():
-                pg_cursor.execute('''
-                    INSERT INTO input_textbooks (title, description, subject, grade, publisher, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                ''', (
-                    textbook['name'],
-                    textbook['description'],
-                    textbook['subject'],
-                    textbook['grade'],
-                    textbook['publisher'],
-                    textbook['created_at']
-                ))
-                pg_cursor.execute('SELECT lastval()')
-                new_textbook_id = pg_cursor.fetchone()[0]
-                print(f"✅ 教材 '{textbook['name']}' を移行しました (ID: {new_textbook_id})")
-        
-        # 単元データの移行
-        sqlite_cursor.execute('SELECT * FROM input_units')
-        units = sqlite_cursor.fetchall()
-        
-        for unit in units:
-            pg_cursor.execute('SELECT id FROM input_units WHERE title = %s AND textbook_id = %s', 
-                            (unit['name'], unit['textbook_id']))
-            if not pg_cursor.fetchone():
-                pg_cursor.execute('''
-                    INSERT INTO input_units (textbook_id, title, description, unit_number, created_at)
-                    VALUES (%s, %s, %s, %s, %s)
-                ''', (
-                    unit['textbook_id'],
-                    unit['name'],
-                    unit['description'],
-                    unit['chapter_number'],
-                    unit['created_at']
-                ))
-                print(f"✅ 単元 '{unit['name']}' を移行しました")
-        
-        # 問題データの移行
-        sqlite_cursor.execute('SELECT * FROM input_questions')
-        questions = sqlite_cursor.fetchall()
-        
-        for question in questions:
-            pg_cursor.execute('SELECT id FROM input_questions WHERE question_text = %s AND unit_id = %s', 
-                            (question['question'], question['unit_id']))
-            if not pg_cursor.fetchone():
-                pg_cursor.execute('''
-                    INSERT INTO input_questions (unit_id, question_text, correct_answer, explanation, image_path, question_type, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ''', (
-                    question['unit_id'],
-                    question['question'],
-                    question['correct_answer'],
-                    question['explanation'],
-                    question['image_url'],
-                    'input',
-                    question['created_at']
-                ))
-                print(f"✅ 問題 '{question['question'][:30]}...' を移行しました")
-        
-        # 変更をコミット
-        pg_conn.commit()
-        print("✅ データ移行が完了しました")
-        
-        # study_logテーブルの移行
-        print("📊 study_logデータを移行中...")
-        
-        # study_logテーブルの作成
-        pg_cursor.execute('''
-            CREATE TABLE IF NOT EXISTS study_log (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                card_id INTEGER NOT NULL,
-                source TEXT NOT NULL,
-                stage INTEGER NOT NULL,
-                mode TEXT NOT NULL,
-                result TEXT NOT NULL,
-                page_range TEXT,
-                difficulty TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # study_logデータの移行
-        try:
-            sqlite_cursor.execute('SELECT * FROM study_log')
-            study_logs = sqlite_cursor.fetchall()
-            
-            for log in study_logs:
-                pg_cursor.execute('''
-                    INSERT INTO study_log (user_id, card_id, source, stage, mode, result, page_range, difficulty, created_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ''', (
-                    log['user_id'],
-                    log['card_id'],
-                    log['source'],
-                    log['stage'],
-                    log['mode'],
-                    log['result'],
-                    log['page_range'],
-                    log['difficulty'],
-                    log['created_at']
-                ))
-            
-            print(f"✅ {len(study_logs)}件のstudy_logデータを移行しました")
-        except Exception as e:
-            print(f"⚠️  study_logデータの移行でエラーが発生しました: {e}")
-        
-        # 変更をコミット
-        pg_conn.commit()
-        print("✅ データ移行が完了しました")
-        
-        # 接続を閉じる
-        sqlite_conn.close()
-        pg_conn.close()
-        
+        src = connect_sqlite(sqlite_path)
+        pg = connect_postgresql()
+        print(f"✅ データベース接続完了（移行元: {sqlite_path}）")
+
+        if not verify_only:
+            # 移行先のテーブルを作成（作成済みなら何もしない）
+            with Flask(__name__).app_context():
+                run_migrations(pg, log=print)
+            with pg.cursor() as cur:
+                cur.execute(PROGRESS_TABLE_SQL)
+                # 中断しても進捗の記録から再開できるため、コミットごとのWALの書き込みは待たない
+                cur.execute('SET synchronous_commit = off')
+            pg.commit()
+
+        with pg.cursor() as cur:
+            transfer_tables = get_transfer_tables(src, cur, tables)
+        pg.commit()
+
+        if not verify_only:
+            started = time.monotonic()
+            total = 0
+            for table in transfer_tables:
+                total += transfer_table(src, pg, table, sqlite_path, chunk_size, truncate=truncate, restart=restart)
+            print(f"✅ データ移行が完了しました（{total:,}件、{time.monotonic() - started:.1f}秒）")
+
+        print("🔍 件数とチェックサムを照合しています...")
+        results = [verify_table(src, pg, table) for table in transfer_tables]
+        if not all(results):
+            print("❌ 移行元と一致しないテーブルがあります")
+            return False
+        print("🎉 すべてのテーブルが移行元と一致しました")
         return True
-        
+    except TransferError as e:
+        print(f"❌ {e}")
+        return False
     except Exception as e:
+        if pg is not None:
+            pg.rollback()
         print(f"❌ データ移行エラー: {e}")
+        print("   同じコマンドを再実行すると、最後にコミットしたチャンクの続きから再開します")
         return False
+    finally:
+        if src is not None:
+            src.close()
+        if pg is not None:
+            pg.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLiteからPostgreSQLへのデータ移行（中断した場合は再実行で再開）')
+    parser.add_argument('--sqlite-path', help='移行元のSQLiteファイル（既定: DB_PATH または flashcards.db）')
+    parser.add_argument('--tables', help='移行するテーブル（カンマ区切り、既定: 両方にある全テーブル）')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='1回の COPY で書き込む行数（既定: 50000）')
+    parser.add_argument('--truncate', action='store_true', help='移行先のテーブルに既存の行があれば削除してから移行する')
+    parser.add_argument('--restart', action='store_true', help='記録した進捗を捨てて最初から移行する')
+    parser.add_argument('--verify-only', action='store_true', help='移行せずに件数とチェックサムだけを照合する')
+    args = parser.parse_args()
+
+    tables = [table.strip() for table in args.tables.split(',') if table.strip()] if args.tables else None
+    ok = migrate_to_postgresql(
+        sqlite_path=args.sqlite_path,
+        tables=tables,
+        chunk_size=max(args.chunk_size, 1),
+        truncate=args.truncate,
+        restart=args.restart,
+        verify_only=args.verify_only,
+    )
+    return 0 if ok else 1
 
 if __name__ == '__main__':
-    migrate_to_postgresql() 
\ No newline at end of file
+    raise SystemExit(main())
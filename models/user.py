@@ -1,6 +1,54 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, has_app_context
 from flask_login import UserMixin
 from utils.db import get_db_connection, get_db_cursor, get_placeholder
 
+# load_userで毎リクエストDBを引かないためのプロセス内キャッシュ（user_id -> (期限, 行, キャッシュした時刻)）
+# 他のワーカーでの無効化は app.extensions['user_cache_invalidations'] の記録で確認する
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+_user_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'shared_invalidations': 0}
+
+def get_shared_invalidations():
+    """ワーカー間で共有する無効化の記録（アプリの外や未設定の場合は None）"""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('user_cache_invalidations')
+
+def invalidate_user_cache(user_id=None):
+    """ユーザーキャッシュを無効化（user_idがNoneの場合は全件、他のワーカーのキャッシュも無効にする）"""
+    with _user_cache_lock:
+        if user_id is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(str(user_id), None)
+        _user_cache_stats['invalidations'] += 1
+    shared = get_shared_invalidations()
+    if shared is not None:
+        try:
+            shared.invalidate(None if user_id is None else str(user_id))
+        except Exception as e:
+            current_app.logger.warning(f"ユーザーキャッシュの無効化を他のワーカーに記録できませんでした: {e}")
+
+def is_cache_entry_valid(key, cached_at):
+    """他のワーカーでキャッシュした後に無効化されていないか（確認できない場合は使わない）"""
+    shared = get_shared_invalidations()
+    if shared is None:
+        return True
+    try:
+        return shared.is_valid(key, cached_at)
+    except Exception:
+        return False
+
+def get_user_cache_stats():
+    """ユーザーキャッシュのヒット・ミス数を取得"""
+    with _user_cache_lock:
+        stats = dict(_user_cache_stats)
+        stats['size'] = len(_user_cache)
+    return stats
+
 class User(UserMixin):
     def __init__(self, id, username, password_hash, full_name, is_admin):
         self.id = id
@@ -11,6 +59,26 @@ class User(UserMixin):
 
     @classmethod
     def get(cls, user_id):
+        key = str(user_id)
+        now = time.monotonic()
+        # DBから読む前の時刻を記録し、読んでいる間に他のワーカーで無効化された行を使わない
+        cached_at = time.time()
+        with _user_cache_lock:
+            cached = _user_cache.get(key)
+        if cached and cached[0] > now:
+            if is_cache_entry_valid(key, cached[2]):
+                with _user_cache_lock:
+                    if key in _user_cache:
+                        _user_cache.move_to_end(key)
+                    _user_cache_stats['hits'] += 1
+                return cls(*cached[1])
+            with _user_cache_lock:
+                if _user_cache.get(key) is cached:
+                    del _user_cache[key]
+                _user_cache_stats['shared_invalidations'] += 1
+        with _user_cache_lock:
+            _user_cache_stats['misses'] += 1
+
         try:
             with get_db_connection() as conn:
                 with get_db_cursor(conn) as cur:
@@ -18,8 +86,17 @@ class User(UserMixin):
                     cur.execute(f"SELECT id, username, password_hash, full_name, is_admin FROM users WHERE id = {placeholder}", (user_id,))
                     row = cur.fetchone()
                     if row:
-                        return cls(row[0], row[1], row[2], row[3], row[4])
+                        row = (row[0], row[1], row[2], row[3], row[4])
+                        ttl = current_app.config.get('USER_CACHE_TTL', 60)
+                        max_size = current_app.config.get('USER_CACHE_MAX_SIZE', 1000)
+                        with _user_cache_lock:
+                            _user_cache[key] = (now + ttl, row, cached_at)
+                            _user_cache.move_to_end(key)
+                            while len(_user_cache) > max_size:
+                                _user_cache.popitem(last=False)
+                                _user_cache_stats['evictions'] += 1
+                        return cls(*row)
         except Exception as e:
             # ログ出力は省略
             pass
-        return None 
\ No newline at end of file
+        return None
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+採点用の正規化済みの正解（correct_answer_norm など）を埋めるスクリプト
+
+列がない既存のDBには列を追加し、未設定の行だけを正規化する。
+utils/normalization.py の正規化の規則を変えた場合は --all で全行を計算し直す。
+
+使い方:
+    python rebuild_answer_norms.py [--all]
+"""
+
+import argparse
+import time
+from dotenv import load_dotenv
+from flask import Flask
+
+# 環境変数を読み込み
+load_dotenv('dbname.env')
+
+from utils.db import get_db_connection, get_db_cursor, close_pg_pool, close_sqlite_pools
+from utils.normalization import ensure_answer_norm_columns, backfill_answer_norms
+
+def main():
+    parser = argparse.ArgumentParser(description='採点用の正規化済みの正解を埋める')
+    parser.add_argument('--all', action='store_true', help='設定済みの行も含めて全行を計算し直す')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    print(f"🔄 正規化済みの正解を{'再計算' if args.all else '補完'}中...")
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            with get_db_connection() as conn:
+                with get_db_cursor(conn) as cur:
+                    for column in ensure_answer_norm_columns(cur):
+                        print(f"➕ 列を追加: {column}")
+                    updated = backfill_answer_norms(cur, rebuild=args.all)
+                conn.commit()
+        elapsed = time.perf_counter() - started
+        for table, count in updated.items():
+            print(f"✅ {table}: {count}行")
+        print(f"✅ 完了 ({elapsed:.2f}秒)")
+        return 0
+    except Exception as e:
+        print(f"❌ 正規化エラー: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        close_pg_pool()
+        close_sqlite_pools()
+
+if __name__ == "__main__":
+    raise SystemExit(main())
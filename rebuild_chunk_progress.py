@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+チャンク進捗の集計テーブル（chunk_card_progress）を study_log から再構築するスクリプト
+
+集計テーブル導入前の学習履歴のバックフィルや、集計がずれた場合の修復に使う。
+
+使い方:
+    python rebuild_chunk_progress.py [--user-id 12]
+"""
+
+import argparse
+import time
+from dotenv import load_dotenv
+from flask import Flask
+
+# 環境変数を読み込み
+load_dotenv('dbname.env')
+
+from utils.db import close_pg_pool, close_sqlite_pools
+from utils.progress import rebuild_chunk_card_progress
+
+def main():
+    parser = argparse.ArgumentParser(description='チャンク進捗の集計テーブルを再構築')
+    parser.add_argument('--user-id', type=int, default=None, help='対象ユーザー（省略時は全ユーザー）')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    target = f"user_id={args.user_id}" if args.user_id is not None else "全ユーザー"
+    print(f"🔄 チャンク進捗を再構築中: {target}")
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            stats = rebuild_chunk_card_progress(args.user_id)
+        elapsed = time.perf_counter() - started
+        print(f"✅ 再構築完了: {stats['groups']}組, {stats['rows']}行 ({elapsed:.2f}秒)")
+        if stats['skipped_cards']:
+            print(f"⚠️  現在の教材に存在しないカード: {stats['skipped_cards']}件（スキップ）")
+    except Exception as e:
+        print(f"❌ 再構築エラー: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        close_pg_pool()
+        close_sqlite_pools()
+
+if __name__ == "__main__":
+    main()
@@ -324,6 +324,7 @@ def reset_postgresql():
             "CREATE INDEX idx_image_source_level ON image(source, level);",
             "CREATE INDEX idx_chunk_progress_user_source_stage ON chunk_progress(user_id, source, stage);",
             "CREATE INDEX idx_study_log_card_result ON study_log(card_id, result, id DESC);",
+            "CREATE INDEX idx_study_log_user_card ON study_log(user_id, card_id, result, stage);",
             "CREATE INDEX idx_user_settings_user_source ON user_settings(user_id, source);",
             "CREATE INDEX idx_questions_textbook_unit ON input_questions(textbook_id, unit_id);",
             "CREATE INDEX idx_choice_units_textbook ON choice_units(textbook_id, unit_number);",
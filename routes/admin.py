@@ -1,14 +1,27 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
-from utils.db import get_db_connection, get_db_cursor, get_placeholder
+from utils.db import get_db_connection, get_db_cursor, get_placeholder, get_pool_stats
+from models.user import invalidate_user_cache, get_user_cache_stats
+from utils.csv_import import CsvImporter, RowError, iter_csv_rows, iter_csv_dicts
+from utils.jobs import register_job, get_job_runner, submit_job
+from utils.passwords import DEFAULT_HASH_METHOD, hash_passwords
+from utils.csv_export import iter_query, get_table_columns, stream_csv, stream_zip, streaming_download
+from utils.backup import COMPRESSIONS, is_compression_available, stream_snapshot
+from utils.assignments import (
+    invalidate_assignment_cache, normalize_unit_ids, sync_assignment_units,
+    fetch_assignment_units, get_unit_assignees, get_unit_type, unit_type_condition
+)
+from utils.distractors import (
+    get_distractor_pool, generate_choices, generate_unit_choices, invalidate_unit_distractors
+)
+from utils.normalization import normalize_question_answer, normalize_acceptable_answers
+from utils.log_maintenance import count_study_log_rows, delete_study_log_history, get_month_tables
 from functools import wraps
-import csv
-import io
 import json
 from datetime import datetime
 import os
 from flask import send_file
-import random
+import time
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -58,8 +71,8 @@ def admin():
                 cur.execute('SELECT COUNT(*) FROM users')
                 user_count = cur.fetchone()[0]
                 
-                cur.execute('SELECT COUNT(*) FROM study_log')
-                study_log_count = cur.fetchone()[0]
+                # 日別に集計済みの件数と最近の生ログの件数の合計（古い月のパーティションは読まない）
+                study_log_count = count_study_log_rows(cur)
                 
                 cur.execute('SELECT COUNT(*) FROM questions WHERE is_active = TRUE')
                 question_count = cur.fetchone()[0]
@@ -77,30 +90,69 @@ def admin():
         flash('管理画面の読み込みに失敗しました', 'error')
         return redirect(url_for('home'))
 
+def wants_background_job():
+    """リクエストがバックグラウンドジョブでの実行を求めているか（background=1）"""
+    value = request.form.get('background') or request.args.get('background') or ''
+    return value.lower() in ('1', 'true', 'yes')
+
+def start_csv_import_job(kind, file, **params):
+    """アップロードファイルを保存してCSV取り込みジョブを登録し、202でジョブIDを返す"""
+    runner = get_job_runner()
+    path = runner.save_upload(file)
+    try:
+        job_id = runner.submit('csv_import', {'kind': kind, 'path': path, **params},
+                               user_id=current_user.id, upload_path=path)
+    except Exception:
+        os.remove(path)
+        raise
+    return jsonify({
+        'message': 'CSVの取り込みをバックグラウンドで開始しました',
+        'job_id': job_id,
+        'status_url': url_for('admin.admin_job_status', job_id=job_id)
+    }), 202
+
+def flash_job_started(label, job_id):
+    """ジョブ開始のメッセージを表示"""
+    flash(f'{label}をバックグラウンドで開始しました（ジョブID: {job_id}、状態: {url_for("admin.admin_job_status", job_id=job_id)}）', 'info')
+
+@register_job('restore_data')
+def restore_data_job(job):
+    """初期データの復元（ジョブ）"""
+    from restore_data import restore_initial_data
+    job.progress(0, 1, '初期データを復元中', force=True)
+    restore_initial_data()
+    return {'message': '初期データの復元が完了しました'}
+
 @admin_bp.route('/admin/restore_data', methods=['POST'])
 @login_required
 @admin_required
 def restore_data():
     """初期データの復元"""
     try:
-        from restore_data import restore_initial_data
-        restore_initial_data()
-        flash('初期データの復元が完了しました', 'success')
+        job_id = submit_job('restore_data', user_id=current_user.id)
+        flash_job_started('初期データの復元', job_id)
     except Exception as e:
         current_app.logger.error(f"データ復元エラー: {e}")
         flash('データ復元に失敗しました', 'error')
     
     return redirect(url_for('admin.admin'))
 
+@register_job('check_integrity')
+def check_integrity_job(job):
+    """データベース整合性チェック（ジョブ、詳細はサーバーログに出力される）"""
+    from check_db_integrity import check_database_integrity
+    job.progress(0, 1, '整合性をチェック中', force=True)
+    check_database_integrity()
+    return {'message': 'データベース整合性チェックが完了しました'}
+
 @admin_bp.route('/admin/check_integrity', methods=['POST'])
 @login_required
 @admin_required
 def check_integrity():
     """データベース整合性チェック"""
     try:
-        from check_db_integrity import check_database_integrity
-        check_database_integrity()
-        flash('データベース整合性チェックが完了しました', 'success')
+        job_id = submit_job('check_integrity', user_id=current_user.id)
+        flash_job_started('データベース整合性チェック', job_id)
     except Exception as e:
         current_app.logger.error(f"整合性チェックエラー: {e}")
         flash('整合性チェックに失敗しました', 'error')
@@ -238,11 +290,117 @@ def admin_add_user():
     
     return redirect(url_for('admin.admin_users'))
 
+# 学年表記の統一
+GRADE_MAPPING = {
+    '1年生': '小4', '2年生': '小5', '3年生': '小6', '4年生': '小4', '5年生': '小5', '6年生': '小6',
+    '小学1年生': '小4', '小学2年生': '小5', '小学3年生': '小6', '小学4年生': '小4', '小学5年生': '小5', '小学6年生': '小6',
+    '中学1年生': '中1', '中学2年生': '中2', '中学3年生': '中3',
+    '高校1年生': '高1', '高校2年生': '高1', '高校3年生': '高1',
+    '小4': '小4', '小5': '小5', '小6': '小6', '中1': '中1', '中2': '中2', '中3': '中3', '高1': '高1'
+}
+
+def import_users_csv(file, progress=None, hash_progress=None):
+    """
+    ユーザーCSVを取り込んで結果（件数・エラーレポート・処理速度）を返す
+
+    リクエスト内でもバックグラウンドジョブ内でも使う。
+    1. CSVを読み込んで検証し、既存のログインIDを読み取りだけのクエリで除外する
+    2. パスワードをトランザクションの外でプロセスプールを使って並列にハッシュ化する
+    3. ハッシュ済みの行をバッチで書き込む（書き込みロックを持つのはこの間だけ）
+    progress(row_num) は読み込み中の行ごと、hash_progress(done, total) はハッシュ化の途中で呼ばれる。
+    """
+    started = time.perf_counter()
+    hash_method = current_app.config.get('BULK_PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD)
+    hash_workers = current_app.config.get('BULK_PASSWORD_HASH_WORKERS') or os.cpu_count() or 1
+    
+    # 1. CSVファイルを少しずつ読み込んで検証（BOM対応）
+    rows = []
+    row_errors = []
+    seen_usernames = set()
+    for row_num, row in iter_csv_dicts(file):
+        if progress:
+            progress(row_num)
+        try:
+            # 新しいヘッダー構造に対応
+            full_name = (row.get('表示名（氏名）') or row.get('full_name') or '').strip()
+            username = (row.get('ログインID') or row.get('username') or '').strip()
+            password = (row.get('パスワード') or row.get('password') or '').strip()
+            grade_raw = (row.get('学年') or row.get('grade') or '').strip()
+            role = (row.get('役割') or row.get('role') or 'user').strip()
+            
+            grade = GRADE_MAPPING.get(grade_raw, grade_raw) if grade_raw else ''
+            
+            if not all([full_name, username, password]):
+                raise RowError('表示名・ログインID・パスワードは必須です')
+            if username in seen_usernames:
+                raise RowError(f'ログインIDがファイル内で重複しています: {username}')
+            seen_usernames.add(username)
+            
+            # 権限の日本語対応
+            is_admin = (role.lower() in ['admin', '管理者'])
+            rows.append((row_num, username, password, is_admin, full_name, grade))
+        except RowError as e:
+            row_errors.append((row_num, e))
+    
+    # 既存のログインIDはハッシュ化する前に除外する（IN句でまとめて確認）
+    existing = set()
+    if rows:
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                placeholder = get_placeholder()
+                for i in range(0, len(rows), 500):
+                    usernames = [row[1] for row in rows[i:i + 500]]
+                    cur.execute(
+                        f"SELECT username FROM users WHERE username IN ({', '.join([placeholder] * len(usernames))})",
+                        usernames
+                    )
+                    existing.update(row[0] for row in cur.fetchall())
+    for row in rows:
+        if row[1] in existing:
+            row_errors.append((row[0], f'ログインIDが既に存在します: {row[1]}'))
+    rows = [row for row in rows if row[1] not in existing]
+    
+    # 2. パスワードのハッシュ化（DB接続を持たずに並列で実行）
+    hash_started = time.perf_counter()
+    password_hashes = hash_passwords(
+        [row[2] for row in rows], method=hash_method, workers=hash_workers, progress=hash_progress
+    )
+    hash_seconds = time.perf_counter() - hash_started
+    
+    # 3. バッチで書き込み
+    insert_started = time.perf_counter()
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            importer = CsvImporter(cur, 'users', ('username', 'email', 'password_hash', 'is_admin', 'full_name', 'grade'))
+            for row_num, message in row_errors:
+                importer.error(row_num, message)
+            for (row_num, username, _, is_admin, full_name, grade), password_hash in zip(rows, password_hashes):
+                importer.add(row_num, (username, None, password_hash, is_admin, full_name, grade))
+            report = importer.finish()
+            conn.commit()
+    insert_seconds = time.perf_counter() - insert_started
+    
+    elapsed = time.perf_counter() - started
+    users_per_second = report['success_count'] / elapsed if elapsed > 0 else 0.0
+    current_app.logger.info(
+        f"ユーザー一括登録: {report['success_count']}人, ハッシュ化 {hash_seconds:.2f}秒（{hash_workers}並列, {hash_method}）, "
+        f"書き込み {insert_seconds:.2f}秒, {users_per_second:.1f}人/秒"
+    )
+    report.update({
+        'hash_method': hash_method,
+        'hash_workers': hash_workers,
+        'hash_seconds': round(hash_seconds, 3),
+        'insert_seconds': round(insert_seconds, 3),
+        'elapsed_seconds': round(elapsed, 3),
+        'users_per_second': round(users_per_second, 1)
+    })
+    return report
+
 @admin_bp.route('/admin/users/upload_csv', methods=['POST'])
 @login_required
 @admin_required
 def admin_upload_users_csv():
-    """CSVファイルからユーザーを一括追加"""
+    """CSVファイルからユーザーを一括追加（background=1 の場合はバックグラウンドジョブで実行）"""
     if 'csv_file' not in request.files:
         flash('CSVファイルが選択されていません', 'error')
         return redirect(url_for('admin.admin_users'))
@@ -257,72 +415,15 @@ def admin_upload_users_csv():
         return redirect(url_for('admin.admin_users'))
     
     try:
-        # CSVファイルを読み込み（BOM対応）
-        content = file.read()
-        if content.startswith(b'\xef\xbb\xbf'):
-            content = content[3:]  # BOMを除去
-        content = content.decode('utf-8')
-        csv_reader = csv.DictReader(io.StringIO(content))
+        if wants_background_job():
+            return start_csv_import_job('users', file)
         
-        success_count = 0
-        error_count = 0
-        
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
-                for row in csv_reader:
-                    try:
-                        # 新しいヘッダー構造に対応
-                        full_name = row.get('表示名（氏名）', row.get('full_name', '')).strip()
-                        username = row.get('ログインID', row.get('username', '')).strip()
-                        password = row.get('パスワード', row.get('password', '')).strip()
-                        grade_raw = row.get('学年', row.get('grade', '')).strip()
-                        role = row.get('役割', row.get('role', 'user')).strip()
-                        
-                        # 学年表記の統一
-                        grade = ''
-                        if grade_raw:
-                            grade_mapping = {
-                                '1年生': '小4', '2年生': '小5', '3年生': '小6', '4年生': '小4', '5年生': '小5', '6年生': '小6',
-                                '小学1年生': '小4', '小学2年生': '小5', '小学3年生': '小6', '小学4年生': '小4', '小学5年生': '小5', '小学6年生': '小6',
-                                '中学1年生': '中1', '中学2年生': '中2', '中学3年生': '中3',
-                                '高校1年生': '高1', '高校2年生': '高1', '高校3年生': '高1',
-                                '小4': '小4', '小5': '小5', '小6': '小6', '中1': '中1', '中2': '中2', '中3': '中3', '高1': '高1'
-                            }
-                            grade = grade_mapping.get(grade_raw, grade_raw)
-                        
-                        if not all([full_name, username, password]):
-                            error_count += 1
-                            continue
-                        
-                        # 重複チェック
-                        db_type = os.getenv('DB_TYPE', 'sqlite')
-                        placeholder = '%s' if db_type == 'postgresql' else '?'
-                        cur.execute(f'SELECT id FROM users WHERE username = {placeholder}', (username,))
-                        if cur.fetchone():
-                            error_count += 1
-                            continue
-                        
-                        # ユーザー追加
-                        from werkzeug.security import generate_password_hash
-                        hashed_password = generate_password_hash(password)
-                        # 権限の日本語対応
-                        is_admin = (role.lower() in ['admin', '管理者'])
-                        
-                        cur.execute(f'''
-                            INSERT INTO users (username, email, password_hash, is_admin, full_name, grade, created_at)
-                            VALUES ({placeholder}, NULL, {placeholder}, {placeholder}, {placeholder}, {placeholder}, CURRENT_TIMESTAMP)
-                        ''', (username, hashed_password, is_admin, full_name, grade))
-                        
-                        success_count += 1
-                        
-                    except Exception as e:
-                        current_app.logger.error(f"CSV行処理エラー: {e}")
-                        error_count += 1
-                
-                conn.commit()
+        report = import_users_csv(file)
         
+        success_count = report['success_count']
+        error_count = report['error_count']
         if success_count > 0:
-            message = f'{success_count}人のユーザーが正常に追加されました'
+            message = f'{success_count}人のユーザーが正常に追加されました（{report["users_per_second"]}人/秒）'
         else:
             message = 'ユーザーの追加に失敗しました'
             
@@ -332,10 +433,14 @@ def admin_upload_users_csv():
         return jsonify({
             'success': success_count > 0,
             'message': message,
-            'success_count': success_count,
-            'error_count': error_count
+            **report
         })
             
+    except UnicodeDecodeError:
+        return jsonify({
+            'success': False,
+            'error': 'CSVファイルはUTF-8で保存してください'
+        }), 400
     except Exception as e:
         current_app.logger.error(f"CSVアップロードエラー: {e}")
         return jsonify({
@@ -348,31 +453,13 @@ def admin_upload_users_csv():
 @admin_required
 def admin_users_csv_template():
     """ユーザーCSVテンプレートのダウンロード"""
-    from flask import send_file
-    
-    # CSVテンプレートを作成（BOM付きUTF-8で文字化けを防ぐ）
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['表示名（氏名）', 'ログインID', 'パスワード', '学年', '役割'])
-    writer.writerow(['田中太郎', 'tanaka001', 'So-12345', '小4', 'user'])
-    writer.writerow(['佐藤花子', 'sato002', 'So-67890', '中2', 'user'])
-    
-    # BOM付きUTF-8でエンコード
-    csv_content = output.getvalue()
-    output_bytes = io.BytesIO()
-    output_bytes.write(b'\xef\xbb\xbf')  # BOM
-    output_bytes.write(csv_content.encode('utf-8'))
-    output_bytes.seek(0)
-    
-    from flask import Response
-    return Response(
-        output_bytes.getvalue(),
-        mimetype='text/csv; charset=utf-8',
-        headers={
-            'Content-Disposition': 'attachment; filename=users_template.csv',
-            'Content-Type': 'text/csv; charset=utf-8'
-        }
-    )
+    return streaming_download(stream_csv(
+        ['表示名（氏名）', 'ログインID', 'パスワード', '学年', '役割'],
+        [
+            ['田中太郎', 'tanaka001', 'So-12345', '小4', 'user'],
+            ['佐藤花子', 'sato002', 'So-67890', '中2', 'user']
+        ]
+    ), 'users_template.csv')
 
 @admin_bp.route('/admin/users/<int:user_id>')
 @login_required
@@ -459,6 +546,7 @@ def admin_update_user(user_id):
                     ''', (username, full_name, grade, is_admin, user_id))
                 
                 conn.commit()
+                invalidate_user_cache(user_id)
                 return jsonify({'message': 'ユーザーを更新しました'})
                 
     except Exception as e:
@@ -488,10 +576,12 @@ def admin_delete_user(user_id):
                 # 学習ログを削除
                 cur.execute(f'DELETE FROM study_log WHERE user_id = {placeholder}', (user_id,))
                 study_log_deleted = cur.rowcount
+                study_log_deleted += delete_study_log_history(cur, user_id)
                 
                 # チャンク進捗を削除
                 cur.execute(f'DELETE FROM chunk_progress WHERE user_id = {placeholder}', (user_id,))
                 chunk_progress_deleted = cur.rowcount
+                cur.execute(f'DELETE FROM chunk_card_progress WHERE user_id = {placeholder}', (user_id,))
                 
                 # ユーザー設定を削除
                 cur.execute(f'DELETE FROM user_settings WHERE user_id = {placeholder}', (user_id,))
@@ -502,6 +592,7 @@ def admin_delete_user(user_id):
                 user_deleted = cur.rowcount
                 
                 conn.commit()
+                invalidate_user_cache(user_id)
                 
                 current_app.logger.info(f"ユーザー削除完了: user_id={user_id}, study_log={study_log_deleted}, chunk_progress={chunk_progress_deleted}, user_settings={user_settings_deleted}, user={user_deleted}")
                 
@@ -1212,7 +1303,7 @@ def input_studies_admin_unit_questions(unit_id):
 @login_required
 @admin_required
 def download_units_csv(textbook_id):
-    """単元CSVダウンロード"""
+    """単元CSVダウンロード（サーバーサイドカーソルから少しずつ送信）"""
     try:
         with get_db_connection() as conn:
             with get_db_cursor(conn) as cur:
@@ -1220,59 +1311,50 @@ def download_units_csv(textbook_id):
                 placeholder = get_placeholder()
                 cur.execute(f'SELECT name FROM input_textbooks WHERE id = {placeholder}', (textbook_id,))
                 textbook_data = cur.fetchone()
-                
-                if not textbook_data:
-                    flash('教材が見つかりません', 'error')
-                    return redirect(url_for('admin.input_studies_admin_unified'))
-                
-                # 単元一覧を取得
-                cur.execute(f'''
-                    SELECT name, chapter_number, description
-                    FROM input_units 
-                    WHERE textbook_id = {placeholder}
-                    ORDER BY chapter_number, name
-                ''', (textbook_id,))
-                units_data = cur.fetchall()
-                
-                # CSVデータを作成（BOM付きUTF-8で文字化けを防ぐ）
-                output = io.StringIO()
-                writer = csv.writer(output)
-                writer.writerow(['章番号', '単元名', '説明'])
-                
-                for unit_data in units_data:
-                    writer.writerow([
-                        unit_data[1] or '',
-                        unit_data[0] or '',
-                        unit_data[2] or ''
-                    ])
-                
-                # BOM付きUTF-8でエンコード
-                csv_content = output.getvalue()
-                output_bytes = io.BytesIO()
-                output_bytes.write(b'\xef\xbb\xbf')  # BOM
-                output_bytes.write(csv_content.encode('utf-8'))
-                output_bytes.seek(0)
-                
-                from flask import Response
-                return Response(
-                    output_bytes.getvalue(),
-                    mimetype='text/csv; charset=utf-8',
-                    headers={
-                        'Content-Disposition': f'attachment; filename=units_{textbook_id}.csv',
-                        'Content-Type': 'text/csv; charset=utf-8'
-                    }
-                )
+        
+        if not textbook_data:
+            flash('教材が見つかりません', 'error')
+            return redirect(url_for('admin.input_studies_admin_unified'))
+        
+        # 単元一覧を取得
+        units = iter_query(f'''
+            SELECT name, chapter_number, description
+            FROM input_units 
+            WHERE textbook_id = {placeholder}
+            ORDER BY chapter_number, name
+        ''', (textbook_id,))
+        return streaming_download(stream_csv(
+            ['章番号', '単元名', '説明'],
+            ([unit[1] or '', unit[0] or '', unit[2] or ''] for unit in units)
+        ), f'units_{textbook_id}.csv')
                 
     except Exception as e:
         current_app.logger.error(f"単元CSVダウンロードエラー: {e}")
         flash('CSVダウンロードに失敗しました', 'error')
         return redirect(url_for('admin.input_studies_admin_textbook_unified', textbook_id=textbook_id))
 
+# 問題CSVの列（アップロード用のテンプレートと同じ並び）
+QUESTION_CSV_HEADER = ['問題番号', '問題文', '正解', '難易度', '許容回答', '解答欄の補足', '解説', '画像パス']
+
+def question_csv_row(question_data):
+    """input_questions の行（question, correct_answer, acceptable_answers, answer_suffix,
+    explanation, difficulty_level, image_name, question_number）をCSVの列順に並べ替える"""
+    return [
+        question_data[7] or '',  # 問題番号
+        question_data[0] or '',  # 問題文
+        question_data[1] or '',  # 正解
+        question_data[5] or 'normal',  # 難易度
+        question_data[2] or '',  # 許容回答
+        question_data[3] or '',  # 解答欄の補足
+        question_data[4] or '',  # 解説
+        question_data[6] or ''  # 画像パス
+    ]
+
 @admin_bp.route('/admin/input_studies/units/<int:unit_id>/questions/csv')
 @login_required
 @admin_required
 def download_unit_questions_csv(unit_id):
-    """単元問題CSVダウンロード"""
+    """単元問題CSVダウンロード（サーバーサイドカーソルから少しずつ送信）"""
     try:
         with get_db_connection() as conn:
             with get_db_cursor(conn) as cur:
@@ -1285,66 +1367,64 @@ def download_unit_questions_csv(unit_id):
                     WHERE u.id = {placeholder}
                 ''', (unit_id,))
                 unit_data = cur.fetchone()
-                
-                if not unit_data:
-                    flash('単元が見つかりません', 'error')
-                    return redirect(url_for('admin.input_studies_admin_unified'))
-                
-                # 単元の章番号を取得
-                cur.execute(f'''
-                    SELECT chapter_number FROM input_units WHERE id = {placeholder}
-                ''', (unit_id,))
-                chapter_number = cur.fetchone()[0]
-                
-                # 問題一覧を取得
-                cur.execute(f'''
-                    SELECT question, correct_answer, acceptable_answers, answer_suffix, 
-                           explanation, difficulty_level, image_name, question_number
-                    FROM input_questions 
-                    WHERE unit_id = {placeholder}
-                    ORDER BY question_number, created_at
-                ''', (unit_id,))
-                questions_data = cur.fetchall()
-                
-                # CSVデータを作成（BOM付きUTF-8で文字化けを防ぐ）
-                output = io.StringIO()
-                writer = csv.writer(output)
-                writer.writerow(['問題番号', '問題文', '正解', '難易度', '許容回答', '解答欄の補足', '解説', '画像パス'])
-                
-                for question_data in questions_data:
-                    writer.writerow([
-                        question_data[7] or '',  # 問題番号
-                        question_data[0] or '',  # 問題文
-                        question_data[1] or '',  # 正解
-                        question_data[5] or 'normal',  # 難易度
-                        question_data[2] or '',  # 許容回答
-                        question_data[3] or '',  # 解答欄の補足
-                        question_data[4] or '',  # 解説
-                        question_data[6] or ''  # 画像パス
-                    ])
-                
-                # BOM付きUTF-8でエンコード
-                csv_content = output.getvalue()
-                output_bytes = io.BytesIO()
-                output_bytes.write(b'\xef\xbb\xbf')  # BOM
-                output_bytes.write(csv_content.encode('utf-8'))
-                output_bytes.seek(0)
-                
-                from flask import Response
-                return Response(
-                    output_bytes.getvalue(),
-                    mimetype='text/csv; charset=utf-8',
-                    headers={
-                        'Content-Disposition': f'attachment; filename=questions_unit_{unit_id}.csv',
-                        'Content-Type': 'text/csv; charset=utf-8'
-                    }
-                )
+        
+        if not unit_data:
+            flash('単元が見つかりません', 'error')
+            return redirect(url_for('admin.input_studies_admin_unified'))
+        
+        # 問題一覧を取得
+        questions = iter_query(f'''
+            SELECT question, correct_answer, acceptable_answers, answer_suffix, 
+                   explanation, difficulty_level, image_name, question_number
+            FROM input_questions 
+            WHERE unit_id = {placeholder}
+            ORDER BY question_number, created_at
+        ''', (unit_id,))
+        return streaming_download(stream_csv(
+            QUESTION_CSV_HEADER,
+            (question_csv_row(question_data) for question_data in questions)
+        ), f'questions_unit_{unit_id}.csv')
                 
     except Exception as e:
         current_app.logger.error(f"単元問題CSVダウンロードエラー: {e}")
         flash('CSVダウンロードに失敗しました', 'error')
         return redirect(url_for('admin.input_studies_admin_unit_questions', unit_id=unit_id))
 
+@admin_bp.route('/admin/input_studies/textbooks/<int:textbook_id>/questions/csv')
+@login_required
+@admin_required
+def download_textbook_questions_csv(textbook_id):
+    """教材全体の問題CSVダウンロード（全単元分を章番号順に1ファイルで送信）"""
+    try:
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                placeholder = get_placeholder()
+                cur.execute(f'SELECT name FROM input_textbooks WHERE id = {placeholder}', (textbook_id,))
+                textbook_data = cur.fetchone()
+        
+        if not textbook_data:
+            flash('教材が見つかりません', 'error')
+            return redirect(url_for('admin.input_studies_admin_unified'))
+        
+        questions = iter_query(f'''
+            SELECT u.chapter_number, u.name,
+                   q.question, q.correct_answer, q.acceptable_answers, q.answer_suffix,
+                   q.explanation, q.difficulty_level, q.image_name, q.question_number
+            FROM input_questions q
+            JOIN input_units u ON q.unit_id = u.id
+            WHERE u.textbook_id = {placeholder}
+            ORDER BY u.chapter_number, u.id, q.question_number, q.created_at
+        ''', (textbook_id,))
+        return streaming_download(stream_csv(
+            ['章番号', '単元名'] + QUESTION_CSV_HEADER,
+            ([row[0] or '', row[1] or ''] + question_csv_row(row[2:]) for row in questions)
+        ), f'questions_textbook_{textbook_id}.csv')
+        
+    except Exception as e:
+        current_app.logger.error(f"教材問題CSVダウンロードエラー: {e}")
+        flash('CSVダウンロードに失敗しました', 'error')
+        return redirect(url_for('admin.input_studies_admin_textbook_unified', textbook_id=textbook_id))
+
 @admin_bp.route('/input_studies/admin/edit_textbook/<int:textbook_id>')
 @login_required
 @admin_required
@@ -1566,6 +1646,37 @@ def input_studies_bulk_delete_questions():
         current_app.logger.error(f"問題一括削除エラー: {e}")
         return jsonify({'error': '問題の削除に失敗しました'}), 500
 
+def import_input_units_csv(file, textbook_id, progress=None):
+    """単元CSV（単元名,章番号,説明）を取り込んで結果を返す"""
+    # CSVファイルを少しずつ読み込みながらバッチで書き込む
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            importer = CsvImporter(cur, 'input_units', ('textbook_id', 'name', 'chapter_number', 'description'))
+            for row_num, row in iter_csv_rows(file):
+                if progress:
+                    progress(row_num)
+                try:
+                    if not any(cell.strip() for cell in row):
+                        continue
+                    if len(row) < 2:
+                        raise RowError('列数が不足しています（単元名,章番号 が必要です）')
+                    name = row[0].strip()
+                    unit_number = row[1].strip()
+                    description = row[2].strip() if len(row) > 2 else ''
+                    if not name or not unit_number:
+                        raise RowError('単元名と章番号は必須です')
+                    try:
+                        unit_number = int(unit_number)
+                    except ValueError:
+                        raise RowError(f'章番号が数値ではありません: {unit_number}')
+                    importer.add(row_num, (textbook_id, name, unit_number, description))
+                except RowError as e:
+                    importer.error(row_num, e)
+            
+            report = importer.finish()
+            conn.commit()
+    return report
+
 @admin_bp.route('/input_studies/admin/upload_csv', methods=['POST'])
 @login_required
 @admin_required
@@ -1586,42 +1697,62 @@ def input_studies_upload_csv():
         if not textbook_id:
             return jsonify({'error': '教材IDが指定されていません'}), 400
         
-        # CSVファイルを処理
-        import csv
-        import io
-        
-        # ファイルの内容を読み込み、BOMを除去してUTF-8でデコード
-        content = file.read()
-        if content.startswith(b'\xef\xbb\xbf'):
-            content = content[3:]  # BOMを除去
-        content = content.decode('utf-8')
-        csv_reader = csv.reader(io.StringIO(content))
+        if wants_background_job():
+            return start_csv_import_job('units', file, textbook_id=textbook_id)
         
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
-                for row in csv_reader:
-                    if len(row) >= 2:
-                        name = row[0].strip()
-                        unit_number = row[1].strip()
-                        description = row[2].strip() if len(row) > 2 else ''
-                        
-                        if name and unit_number:
-                            try:
-                                unit_number = int(unit_number)
-                                cur.execute('''
-                                    INSERT INTO input_units (textbook_id, name, chapter_number, description)
-                                    VALUES (?, ?, ?, ?)
-                                ''', (textbook_id, name, unit_number, description))
-                            except ValueError:
-                                continue
-                
-                conn.commit()
-                return jsonify({'message': 'CSVファイルをアップロードしました'})
+        report = import_input_units_csv(file, textbook_id)
+        return jsonify({'message': 'CSVファイルをアップロードしました', **report})
                 
+    except UnicodeDecodeError:
+        return jsonify({'error': 'CSVファイルはUTF-8で保存してください'}), 400
     except Exception as e:
         current_app.logger.error(f"CSVアップロードエラー: {e}")
         return jsonify({'error': 'CSVアップロードに失敗しました'}), 500
 
+def import_input_numbered_units_csv(file, textbook_id, progress=None):
+    """単元CSV（章番号,単元名,説明）を取り込んで結果を返す（章番号が空の行は自動採番）"""
+    # CSVファイルを少しずつ読み込みながらバッチで書き込む
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            # 章番号の自動割り当て用に現在の最大値を1回だけ取得
+            placeholder = get_placeholder()
+            cur.execute(f'''
+                SELECT COALESCE(MAX(chapter_number), 0) + 1 
+                FROM input_units 
+                WHERE textbook_id = {placeholder}
+            ''', (textbook_id,))
+            next_number = cur.fetchone()[0]
+            
+            importer = CsvImporter(cur, 'input_units', ('textbook_id', 'name', 'chapter_number', 'description'))
+            for row_num, row in iter_csv_rows(file):
+                if progress:
+                    progress(row_num)
+                try:
+                    if not any(cell.strip() for cell in row):
+                        continue
+                    if len(row) < 2:
+                        raise RowError('列数が不足しています（章番号,単元名 が必要です）')
+                    unit_number = row[0].strip()
+                    name = row[1].strip()
+                    description = row[2].strip() if len(row) > 2 else ''
+                    if not name:  # 単元名のみ必須
+                        raise RowError('単元名は必須です')
+                    
+                    # 章番号が空・数値でない場合は自動的に次の番号を割り当て
+                    try:
+                        unit_number_int = int(unit_number)
+                    except ValueError:
+                        unit_number_int = next_number
+                    next_number = max(next_number, unit_number_int + 1)
+                    
+                    importer.add(row_num, (textbook_id, name, unit_number_int, description))
+                except RowError as e:
+                    importer.error(row_num, e)
+            
+            report = importer.finish()
+            conn.commit()
+    return report
+
 @admin_bp.route('/input_studies/admin/upload_units_csv', methods=['POST'])
 @login_required
 @admin_required
@@ -1642,59 +1773,91 @@ def input_studies_upload_units_csv():
         if not textbook_id:
             return jsonify({'error': '教材IDが指定されていません'}), 400
         
-        # CSVファイルを処理
-        import csv
-        import io
-        
-        # ファイルの内容を読み込み、BOMを除去してUTF-8でデコード
-        content = file.read()
-        if content.startswith(b'\xef\xbb\xbf'):
-            content = content[3:]  # BOMを除去
-        content = content.decode('utf-8')
-        csv_reader = csv.reader(io.StringIO(content))
+        if wants_background_job():
+            return start_csv_import_job('numbered_units', file, textbook_id=textbook_id)
         
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
-                for row in csv_reader:
-                    if len(row) >= 2:
-                        unit_number = row[0].strip()
-                        name = row[1].strip()
-                        description = row[2].strip() if len(row) > 2 else ''
-                        
-                        if name:  # 単元名のみ必須
-                            # 章番号が空の場合は自動的に次の番号を割り当て
-                            if unit_number:
-                                try:
-                                    unit_number_int = int(unit_number)
-                                except ValueError:
-                                    # 章番号が数値でない場合は自動割り当て
-                                    cur.execute('''
-                                        SELECT COALESCE(MAX(chapter_number), 0) + 1 
-                                        FROM input_units 
-                                        WHERE textbook_id = ?
-                                    ''', (textbook_id,))
-                                    unit_number_int = cur.fetchone()[0]
-                            else:
-                                # 章番号が空の場合は自動割り当て
-                                cur.execute('''
-                                    SELECT COALESCE(MAX(chapter_number), 0) + 1 
-                                    FROM input_units 
-                                    WHERE textbook_id = ?
-                                ''', (textbook_id,))
-                                unit_number_int = cur.fetchone()[0]
-                            
-                            cur.execute('''
-                                INSERT INTO input_units (textbook_id, name, chapter_number, description)
-                                VALUES (?, ?, ?, ?)
-                            ''', (textbook_id, name, unit_number_int, description))
-                
-                conn.commit()
-                return jsonify({'message': '単元CSVファイルをアップロードしました'})
+        report = import_input_numbered_units_csv(file, textbook_id)
+        return jsonify({'message': '単元CSVファイルをアップロードしました', **report})
                 
+    except UnicodeDecodeError:
+        return jsonify({'error': 'CSVファイルはUTF-8で保存してください'}), 400
     except Exception as e:
         current_app.logger.error(f"単元CSVアップロードエラー: {e}")
         return jsonify({'error': '単元CSVアップロードに失敗しました'}), 500
 
+def get_input_unit_info(unit_id):
+    """問題CSVの取り込みに使う単元情報（教材ID・教科など）を取得"""
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            placeholder = get_placeholder()
+            cur.execute(f'''
+                SELECT u.textbook_id, t.subject, t.name as textbook_name, u.name as unit_name
+                FROM input_units u
+                JOIN input_textbooks t ON u.textbook_id = t.id
+                WHERE u.id = {placeholder}
+            ''', (unit_id,))
+            return cur.fetchone()
+
+def import_input_questions_csv(file, unit_id, progress=None):
+    """問題CSVを取り込んで結果を返す（単元が存在しない場合は ValueError）"""
+    unit_info = get_input_unit_info(unit_id)
+    if not unit_info:
+        raise ValueError('単元情報が見つかりません')
+    
+    textbook_id = unit_info[0]
+    subject = unit_info[1]
+    
+    # CSVファイルを少しずつ読み込みながらバッチで書き込む
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            # created_at は列のデフォルト値（CURRENT_TIMESTAMP）を使う
+            importer = CsvImporter(cur, 'input_questions', (
+                'unit_id', 'textbook_id', 'subject', 'question', 'correct_answer', 'acceptable_answers',
+                'answer_suffix', 'explanation', 'difficulty_level', 'image_path', 'question_number'
+            ))
+            for row_num, row in iter_csv_rows(file):
+                if progress:
+                    progress(row_num)
+                if row_num == 1:  # ヘッダー行をスキップ
+                    continue
+                try:
+                    if not any(cell.strip() for cell in row):
+                        continue
+                    if len(row) < 2:  # 最低限必要な列数（問題番号,問題文）
+                        raise RowError('列数が不足しています（問題番号,問題文 が必要です）')
+                    
+                    # CSVの列: 問題番号,問題文,正解,難易度,許容回答,解答欄の補足,解説,画像パス
+                    question_number = row[0].strip()
+                    question = row[1].strip()  # 問題文
+                    answer = row[2].strip() if len(row) > 2 else ''    # 正解
+                    difficulty = row[3].strip() if len(row) > 3 else ''
+                    acceptable_answers = row[4].strip() if len(row) > 4 else ''
+                    answer_suffix = row[5].strip() if len(row) > 5 else ''
+                    explanation = row[6].strip() if len(row) > 6 else ''
+                    image_path = row[7].strip() if len(row) > 7 else ''
+                    
+                    if not question or not answer:  # 問題文と正解が存在する場合のみ処理
+                        raise RowError('問題文と正解は必須です')
+                    
+                    # 問題番号を数値に変換（空の場合はNone）
+                    try:
+                        question_number_int = int(question_number) if question_number else None
+                    except ValueError:
+                        question_number_int = None
+                    
+                    # 難易度の検証（空の場合はそのまま）
+                    if difficulty and difficulty not in ['basic', 'intermediate', 'advanced']:
+                        difficulty = ''
+                    
+                    importer.add(row_num, (unit_id, textbook_id, subject, question, answer, acceptable_answers,
+                                           answer_suffix, explanation, difficulty, image_path, question_number_int))
+                except RowError as e:
+                    importer.error(row_num, e)
+            
+            report = importer.finish()
+            conn.commit()
+    return report
+
 @admin_bp.route('/input_studies/admin/upload_questions_csv', methods=['POST'])
 @login_required
 @admin_required
@@ -1715,89 +1878,20 @@ def input_studies_upload_questions_csv():
         if not unit_id:
             return jsonify({'error': '単元IDが指定されていません'}), 400
         
-        # CSVファイルを処理
-        import csv
-        import io
-        
-        # ファイルの内容を読み込み、BOMを除去してUTF-8でデコード
-        content = file.read()
-        if content.startswith(b'\xef\xbb\xbf'):
-            content = content[3:]  # BOMを除去
-        content = content.decode('utf-8')
-        csv_reader = csv.reader(io.StringIO(content))
+        if not get_input_unit_info(unit_id):
+            return jsonify({'error': '単元情報が見つかりません'}), 400
         
-        success_count = 0
-        error_count = 0
+        if wants_background_job():
+            return start_csv_import_job('questions', file, unit_id=unit_id)
         
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
-                # 単元情報を取得
-                placeholder = get_placeholder()
-                cur.execute(f'''
-                    SELECT u.textbook_id, t.subject, t.name as textbook_name, u.name as unit_name
-                    FROM input_units u
-                    JOIN input_textbooks t ON u.textbook_id = t.id
-                    WHERE u.id = {placeholder}
-                ''', (unit_id,))
-                unit_info = cur.fetchone()
-                
-                if not unit_info:
-                    return jsonify({'error': '単元情報が見つかりません'}), 400
-                
-                textbook_id = unit_info[0]
-                subject = unit_info[1]
-                textbook_name = unit_info[2]
-                unit_name = unit_info[3]
-                
-                for row_num, row in enumerate(csv_reader, 1):
-                    if row_num == 1:  # ヘッダー行をスキップ
-                        continue
-                    
-                    if len(row) >= 2:  # 最低限必要な列数（問題番号,問題文）
-                        # CSVの列: 問題番号,問題文,正解,難易度,許容回答,解答欄の補足,解説,画像パス
-                        question_number = row[0].strip() if len(row) > 0 else ''
-                        question = row[1].strip() if len(row) > 1 else ''  # 問題文
-                        answer = row[2].strip() if len(row) > 2 else ''    # 正解
-                        difficulty = row[3].strip() if len(row) > 3 else ''
-                        acceptable_answers = row[4].strip() if len(row) > 4 else ''
-                        answer_suffix = row[5].strip() if len(row) > 5 else ''
-                        explanation = row[6].strip() if len(row) > 6 else ''
-                        image_path = row[7].strip() if len(row) > 7 else ''
-                        
-                        if question and answer:  # 問題文と正解が存在する場合のみ処理
-                            # 教材と単元のIDを取得（固定値として使用）
-                            textbook_id_to_use = textbook_id
-                            unit_id_to_use = unit_id
-                            
-                            # 問題番号を数値に変換（空の場合はNone）
-                            try:
-                                question_number_int = int(question_number) if question_number else None
-                            except ValueError:
-                                question_number_int = None
-                            
-                            # 難易度の検証（空の場合はそのまま）
-                            if difficulty and difficulty not in ['basic', 'intermediate', 'advanced']:
-                                difficulty = ''
-                            
-                            cur.execute('''
-                                INSERT INTO input_questions 
-                                (unit_id, textbook_id, subject, question, correct_answer, acceptable_answers, 
-                                 answer_suffix, explanation, difficulty_level, image_path, question_number, created_at)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                            ''', (unit_id_to_use, textbook_id_to_use, subject, question, answer, acceptable_answers,
-                                  answer_suffix, explanation, difficulty, image_path, question_number_int))
-                            
-                            success_count += 1
-                        else:
-                            error_count += 1
-                
-                conn.commit()
-                return jsonify({
-                    'message': f'問題CSVファイルをアップロードしました（成功: {success_count}件、失敗: {error_count}件）',
-                    'success_count': success_count,
-                    'error_count': error_count
-                })
+        report = import_input_questions_csv(file, unit_id)
+        return jsonify({
+            'message': f'問題CSVファイルをアップロードしました（成功: {report["success_count"]}件、失敗: {report["error_count"]}件）',
+            **report
+        })
                 
+    except UnicodeDecodeError:
+        return jsonify({'error': 'CSVファイルはUTF-8で保存してください'}), 400
     except Exception as e:
         current_app.logger.error(f"問題CSVアップロードエラー: {e}")
         return jsonify({'error': '問題CSVアップロードに失敗しました'}), 500
@@ -1807,42 +1901,13 @@ def input_studies_upload_questions_csv():
 @admin_required
 def input_studies_download_csv_template():
     """CSVテンプレートダウンロード"""
-    try:
-        import csv
-        import io
-        
-        # CSVデータを作成（BOM付きUTF-8で文字化けを防ぐ）
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # ヘッダー行
-        writer.writerow(['問題番号', '問題文', '正解', '難易度', '許容回答', '解答欄の補足', '解説', '画像パス'])
-        
-        # サンプルデータ
-        writer.writerow(['1', '日本の首都は？', '東京', 'basic', '東京都,Tokyo', '', '日本の首都は東京です', '/static/images/1.jpg'])
-        writer.writerow(['2', '日本で最も高い山は？', '富士山', 'intermediate', '富士山,ふじさん', '山', '富士山は日本一高い山です', 'https://example.com/fuji.jpg'])
-        
-        # BOM付きUTF-8でエンコード
-        csv_content = output.getvalue()
-        output_bytes = io.BytesIO()
-        output_bytes.write(b'\xef\xbb\xbf')  # BOM
-        output_bytes.write(csv_content.encode('utf-8'))
-        output_bytes.seek(0)
-        
-        from flask import Response
-        return Response(
-            output_bytes.getvalue(),
-            mimetype='text/csv; charset=utf-8',
-            headers={
-                'Content-Disposition': 'attachment; filename=input_studies_questions_template.csv',
-                'Content-Type': 'text/csv; charset=utf-8'
-            }
-        )
-        
-    except Exception as e:
-        current_app.logger.error(f"CSVテンプレートダウンロードエラー: {e}")
-        flash('CSVテンプレートダウンロードに失敗しました', 'error')
-        return redirect(url_for('admin.input_studies_admin_questions'))
+    return streaming_download(stream_csv(
+        QUESTION_CSV_HEADER,
+        [
+            ['1', '日本の首都は？', '東京', 'basic', '東京都,Tokyo', '', '日本の首都は東京です', '/static/images/1.jpg'],
+            ['2', '日本で最も高い山は？', '富士山', 'intermediate', '富士山,ふじさん', '山', '富士山は日本一高い山です', 'https://example.com/fuji.jpg']
+        ]
+    ), 'input_studies_questions_template.csv')
 
 @admin_bp.route('/input_studies/admin/question/<int:question_id>')
 @login_required
@@ -2153,12 +2218,25 @@ def input_studies_update_image_path(textbook_id, unit_id):
 @login_required
 @admin_required
 def textbook_assignments():
-    """教材割り当て管理画面"""
+    """教材割り当て管理画面（?unit_id=&unit_type= で単元を含む割り当てに絞り込み）"""
+    unit_id = request.args.get('unit_id', type=int)
+    unit_type = get_unit_type(request.args.get('unit_type', 'input'))
+    placeholder = get_placeholder()
     try:
         with get_db_connection() as conn:
             with get_db_cursor(conn) as cur:
+                # 単元での絞り込みは assignment_details のインデックスで引く
+                unit_filter = None
+                params = ()
+                if unit_id is not None:
+                    unit_filter = f'''{unit_type_condition(unit_type)} AND EXISTS (
+                        SELECT 1 FROM assignment_details ad_filter
+                        WHERE ad_filter.assignment_id = ta.id AND ad_filter.unit_id = {placeholder}
+                    )'''
+                    params = (unit_id,)
+                
                 # 割り当て一覧を取得
-                cur.execute('''
+                cur.execute(f'''
                     SELECT ta.id, ta.user_id, ta.textbook_id, ta.assignment_type, 
                            ta.is_active, ta.assigned_at, ta.expires_at,
                            u.username, u.full_name,
@@ -2170,16 +2248,23 @@ def textbook_assignments():
                     JOIN users u ON ta.user_id = u.id
                     LEFT JOIN input_textbooks it ON ta.textbook_id = it.id AND ta.assignment_type = 'input'
                     LEFT JOIN choice_textbooks ct ON ta.textbook_id = ct.id AND ta.assignment_type = 'choice'
+                    {f'WHERE {unit_filter}' if unit_filter else ''}
                     ORDER BY ta.assigned_at DESC
-                ''')
+                ''', params)
                 assignments = cur.fetchall()
                 
+                # 割り当ての単元を種類ごとに1回のJOINで取得
+                units = {}
+                for assignment_unit_type in {get_unit_type(assignment['assignment_type']) for assignment in assignments}:
+                    units.update(fetch_assignment_units(cur, assignment_unit_type, unit_filter, params))
+                
                 # 日時データを適切に処理
                 processed_assignments = []
                 for assignment in assignments:
                     assignment_dict = dict(assignment)
                     assignment_dict['assigned_at'] = parse_datetime(assignment['assigned_at'])
                     assignment_dict['expires_at'] = parse_datetime(assignment['expires_at'])
+                    assignment_dict['unit_details'] = units.get(assignment['id'], [])
                     processed_assignments.append(assignment_dict)
                 
                 # ユーザー一覧を取得
@@ -2195,6 +2280,7 @@ def textbook_assignments():
                 
                 return render_template('admin_textbook_assignments.html',
                                      assignments=processed_assignments,
+                                     unit_filter={'unit_id': unit_id, 'unit_type': unit_type} if unit_id is not None else None,
                                      users=users,
                                      input_textbooks=input_textbooks,
                                      choice_textbooks=choice_textbooks)
@@ -2242,7 +2328,7 @@ def create_textbook_assignment_post():
         user_id = request.form.get('user_id')
         textbook_id = request.form.get('textbook_id')
         assignment_type = request.form.get('assignment_type')
-        units = request.form.getlist('units')
+        units = normalize_unit_ids(request.form.getlist('units'))
         chunks = request.form.get('chunks')
         expires_at = request.form.get('expires_at')
         
@@ -2270,16 +2356,11 @@ def create_textbook_assignment_post():
                 
                 assignment_id = cur.lastrowid
                 
-                # 詳細情報を保存
-                if units:
-                    for unit_id in units:
-                        cur.execute('''
-                            INSERT INTO assignment_details 
-                            (assignment_id, unit_id)
-                            VALUES (?, ?)
-                        ''', (assignment_id, unit_id))
+                # 単元を assignment_details にも書き込む（JOINで引けるように）
+                sync_assignment_units(cur, assignment_id, units)
                 
                 conn.commit()
+                invalidate_assignment_cache(user_id)
                 flash('教材割り当てが完了しました', 'success')
                 
     except Exception as e:
@@ -2296,12 +2377,16 @@ def toggle_textbook_assignment(assignment_id):
     try:
         with get_db_connection() as conn:
             with get_db_cursor(conn) as cur:
+                cur.execute('SELECT user_id FROM textbook_assignments WHERE id = ?', (assignment_id,))
+                assignment = cur.fetchone()
                 cur.execute('''
                     UPDATE textbook_assignments 
                     SET is_active = NOT is_active 
                     WHERE id = ?
                 ''', (assignment_id,))
                 conn.commit()
+                if assignment:
+                    invalidate_assignment_cache(assignment[0])
                 flash('教材割り当ての状態を更新しました', 'success')
                 
     except Exception as e:
@@ -2318,11 +2403,15 @@ def delete_textbook_assignment(assignment_id):
     try:
         with get_db_connection() as conn:
             with get_db_cursor(conn) as cur:
+                cur.execute('SELECT user_id FROM textbook_assignments WHERE id = ?', (assignment_id,))
+                assignment = cur.fetchone()
                 # 詳細情報を削除
                 cur.execute('DELETE FROM assignment_details WHERE assignment_id = ?', (assignment_id,))
                 # 割り当てを削除
                 cur.execute('DELETE FROM textbook_assignments WHERE id = ?', (assignment_id,))
                 conn.commit()
+                if assignment:
+                    invalidate_assignment_cache(assignment[0])
                 flash('教材割り当てを削除しました', 'success')
                 
     except Exception as e:
@@ -2331,6 +2420,18 @@ def delete_textbook_assignment(assignment_id):
     
     return jsonify({'success': True})
 
+@admin_bp.route('/admin/textbook_assignments/units/<assignment_type>/<int:unit_id>/assignees')
+@login_required
+@admin_required
+def unit_assignees(assignment_type, unit_id):
+    """単元が割り当てられている生徒の一覧（JSON、?all=1 で無効な割り当ても含める）"""
+    try:
+        assignees = get_unit_assignees(unit_id, assignment_type, active_only=not request.args.get('all'))
+        return jsonify({'success': True, 'unit_id': unit_id, 'assignees': assignees})
+    except Exception as e:
+        current_app.logger.error(f"単元の割り当て先取得エラー: unit_id={unit_id}, error={e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @admin_bp.route('/admin/textbook_assignments/get_units/<int:textbook_id>/<assignment_type>')
 @login_required
 @admin_required
@@ -2621,11 +2722,14 @@ def create_question_post(unit_id):
                 cur.execute('''
                     INSERT INTO questions (unit_id, question_text, correct_answer, choices, 
                                          acceptable_answers, answer_suffix, explanation, 
-                                         difficulty_level, question_number, question_type)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                         difficulty_level, question_number, question_type,
+                                         correct_answer_norm, acceptable_answers_norm)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (unit_id, question_text, correct_answer, choices, acceptable_answers,
-                     answer_suffix, explanation, difficulty_level, question_number, question_type))
+                     answer_suffix, explanation, difficulty_level, question_number, question_type,
+                     normalize_question_answer(correct_answer), normalize_acceptable_answers(acceptable_answers)))
                 conn.commit()
+                invalidate_unit_distractors(unit_id)
                 flash('問題が作成されました', 'success')
                 
     except Exception as e:
@@ -2655,6 +2759,8 @@ def reset_admin_password():
                 placeholder = get_placeholder()
                 cur.execute(f'UPDATE users SET password_hash = {placeholder} WHERE username = {placeholder}', (new_hash, 'admin'))
                 conn.commit()
+                # ユーザー名で更新しているためキャッシュは全件無効化
+                invalidate_user_cache()
                 
                 current_app.logger.info(f"管理者パスワードリセット完了")
                 flash('管理者パスワードをリセットしました: admin', 'success')
@@ -2665,104 +2771,219 @@ def reset_admin_password():
     
     return redirect(url_for('admin.admin'))
 
+@register_job('debug_database')
+def debug_database_job(job):
+    """データベースの状態を収集（ジョブ、結果はジョブの result に保存される）"""
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            # ユーザー数を確認
+            cur.execute('SELECT COUNT(*) FROM users')
+            user_count = cur.fetchone()[0]
+            
+            # 最新のユーザーを取得
+            cur.execute('''
+                SELECT id, username, full_name, is_admin, created_at 
+                FROM users 
+                ORDER BY created_at DESC 
+                LIMIT 5
+            ''')
+            recent_users = cur.fetchall()
+            
+            # データベースの状態を確認
+            cur.execute("PRAGMA journal_mode")
+            journal_mode = cur.fetchone()[0]
+            
+            cur.execute("PRAGMA synchronous")
+            synchronous = cur.fetchone()[0]
+            
+            debug_info = {
+                'user_count': user_count,
+                'recent_users': [
+                    {
+                        'id': user[0],
+                        'username': user[1],
+                        'full_name': user[2],
+                        'is_admin': user[3],
+                        'created_at': user[4]
+                    } for user in recent_users
+                ],
+                'journal_mode': journal_mode,
+                'synchronous': synchronous
+            }
+            
+            current_app.logger.info(f"データベースデバッグ情報: {debug_info}")
+            return debug_info
+
 @admin_bp.route('/admin/debug_db', methods=['POST'])
 @login_required
 @admin_required
 def debug_database():
     """データベースの状態をデバッグ"""
     try:
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
-                # ユーザー数を確認
-                cur.execute('SELECT COUNT(*) FROM users')
-                user_count = cur.fetchone()[0]
-                
-                # 最新のユーザーを取得
-                cur.execute('''
-                    SELECT id, username, full_name, is_admin, created_at 
-                    FROM users 
-                    ORDER BY created_at DESC 
-                    LIMIT 5
-                ''')
-                recent_users = cur.fetchall()
-                
-                # データベースの状態を確認
-                cur.execute("PRAGMA journal_mode")
-                journal_mode = cur.fetchone()[0]
-                
-                cur.execute("PRAGMA synchronous")
-                synchronous = cur.fetchone()[0]
-                
-                debug_info = {
-                    'user_count': user_count,
-                    'recent_users': [
-                        {
-                            'id': user[0],
-                            'username': user[1],
-                            'full_name': user[2],
-                            'is_admin': user[3],
-                            'created_at': user[4]
-                        } for user in recent_users
-                    ],
-                    'journal_mode': journal_mode,
-                    'synchronous': synchronous
-                }
-                
-                current_app.logger.info(f"データベースデバッグ情報: {debug_info}")
-                flash(f'ユーザー数: {user_count}, ジャーナルモード: {journal_mode}', 'info')
-                
+        job_id = submit_job('debug_database', user_id=current_user.id)
+        flash_job_started('データベースデバッグ', job_id)
     except Exception as e:
         current_app.logger.error(f"データベースデバッグエラー: {e}")
         flash('データベースデバッグに失敗しました', 'error')
     
     return redirect(url_for('admin.admin'))
 
+@admin_bp.route('/admin/metrics')
+@login_required
+@admin_required
+def admin_metrics():
+    """パフォーマンス関連のメトリクスを取得（JSON）"""
+    log_pipeline = current_app.extensions.get('log_pipeline')
+    session_store = current_app.extensions.get('study_session_store')
+    study_cache = current_app.extensions.get('study_cache')
+    job_runner = get_job_runner()
+    snapshot_scheduler = current_app.extensions.get('snapshot_scheduler')
+    log_maintenance_scheduler = current_app.extensions.get('log_maintenance_scheduler')
+    distractor_pool = get_distractor_pool()
+    return jsonify({
+        'db_pool': get_pool_stats(),
+        'log_pipeline': log_pipeline.stats() if log_pipeline else None,
+        'study_session_store': session_store.stats() if session_store else None,
+        'user_cache': get_user_cache_stats(),
+        'study_cache': study_cache.stats() if study_cache else None,
+        'job_runner': job_runner.stats() if job_runner else None,
+        'snapshot_scheduler': snapshot_scheduler.stats() if snapshot_scheduler else None,
+        'log_maintenance': log_maintenance_scheduler.stats() if log_maintenance_scheduler else None,
+        'distractor_pool': distractor_pool.stats() if distractor_pool else None
+    })
+
+@register_job('csv_import')
+def csv_import_job(job, kind, path, **params):
+    """
+    保存済みのCSVファイルを取り込む（ジョブ）
+
+    読み込んだバイト数を進捗として報告し、キャンセル要求があればロールバックして中断する。
+    ファイル（upload_path）はジョブの終了後にジョブランナーが削除する。
+    """
+    import_func = {
+        'users': import_users_csv,
+        'units': import_input_units_csv,
+        'numbered_units': import_input_numbered_units_csv,
+        'questions': import_input_questions_csv
+    }[kind]
+    size = os.path.getsize(path)
+    with open(path, 'rb') as raw:
+        def progress(row_num):
+            if row_num % 200 == 0:
+                job.progress(raw.tell(), size, f'{row_num}行目まで処理しました')
+                job.check_cancelled()
+        if kind == 'users':
+            def hash_progress(done, total):
+                job.progress(done, total, f'パスワードをハッシュ化中（{done}/{total}）')
+                job.check_cancelled()
+            params['hash_progress'] = hash_progress
+        try:
+            report = import_func(raw, progress=progress, **params)
+        except UnicodeDecodeError:
+            raise ValueError('CSVファイルはUTF-8で保存してください')
+    job.progress(size, size, f"成功: {report['success_count']}件、失敗: {report['error_count']}件", force=True)
+    return report
+
+@admin_bp.route('/admin/jobs')
+@login_required
+@admin_required
+def admin_jobs():
+    """最近のバックグラウンドジョブ一覧を取得（JSON）"""
+    try:
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        return jsonify({'jobs': get_job_runner().list_jobs(limit)})
+    except Exception as e:
+        current_app.logger.error(f"ジョブ一覧取得エラー: {e}")
+        return jsonify({'error': 'ジョブ一覧の取得に失敗しました'}), 500
+
+@admin_bp.route('/admin/jobs/<job_id>')
+@login_required
+@admin_required
+def admin_job_status(job_id):
+    """バックグラウンドジョブの状態・進捗・結果を取得（JSON）"""
+    try:
+        job = get_job_runner().get(job_id)
+    except Exception as e:
+        current_app.logger.error(f"ジョブ状態取得エラー: {e}")
+        return jsonify({'error': 'ジョブ状態の取得に失敗しました'}), 500
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    return jsonify(job)
+
+@admin_bp.route('/admin/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+@admin_required
+def admin_cancel_job(job_id):
+    """バックグラウンドジョブのキャンセルを要求"""
+    try:
+        job = get_job_runner().cancel(job_id)
+    except Exception as e:
+        current_app.logger.error(f"ジョブキャンセルエラー: {e}")
+        return jsonify({'error': 'ジョブのキャンセルに失敗しました'}), 500
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    if job['is_finished'] and job['status'] != 'cancelled':
+        return jsonify({'error': 'ジョブは既に終了しています', 'job': job}), 409
+    return jsonify({'message': 'キャンセルを要求しました', 'job': job})
+
+@register_job('fix_database_issues')
+def fix_database_issues_job(job):
+    """データベースの問題を修正（ジョブ）"""
+    from werkzeug.security import generate_password_hash
+    
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            current_app.logger.info("データベース修正開始")
+            
+            # 1. 管理者パスワード修正
+            job.progress(0, 3, '管理者パスワード修正中', force=True)
+            current_app.logger.info("管理者パスワード修正中...")
+            new_password = 'admin'
+            new_hash = generate_password_hash(new_password, method='pbkdf2:sha256')
+            
+            placeholder = get_placeholder()
+            cur.execute(f'UPDATE users SET password_hash = {placeholder} WHERE username = {placeholder}', (new_hash, 'admin'))
+            current_app.logger.info("管理者パスワード更新完了")
+            
+            # 2. assignment_typeカラム修正
+            job.progress(1, 3, 'assignment_typeカラム修正中')
+            current_app.logger.info("assignment_typeカラム修正中...")
+            cur.execute("PRAGMA table_info(textbook_assignments)")
+            columns = cur.fetchall()
+            column_names = [col[1] for col in columns]
+            
+            assignment_type_added = False
+            if 'assignment_type' not in column_names:
+                current_app.logger.info("assignment_typeカラムを追加中...")
+                cur.execute("ALTER TABLE textbook_assignments ADD COLUMN assignment_type TEXT")
+                assignment_type_added = True
+                
+                if 'study_type' in column_names:
+                    cur.execute("UPDATE textbook_assignments SET assignment_type = study_type WHERE assignment_type IS NULL")
+                    current_app.logger.info("既存データをstudy_typeからコピーしました")
+                
+                current_app.logger.info("assignment_typeカラム追加完了")
+            else:
+                current_app.logger.info("assignment_typeカラムは既に存在します")
+            
+            # 3. データベース状態確認
+            job.progress(2, 3, 'データベース状態確認中')
+            cur.execute("SELECT COUNT(*) FROM users")
+            user_count = cur.fetchone()[0]
+            current_app.logger.info(f"ユーザー数: {user_count}")
+            
+            conn.commit()
+            invalidate_user_cache()
+            current_app.logger.info("データベース修正完了")
+            
+            return {'user_count': user_count, 'assignment_type_added': assignment_type_added}
+
 @admin_bp.route('/admin/fix_database_issues', methods=['POST'])
 def fix_database_issues():
     """データベースの問題を修正（ログイン不要）"""
     try:
-        from werkzeug.security import generate_password_hash
-        
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
-                current_app.logger.info("データベース修正開始")
-                
-                # 1. 管理者パスワード修正
-                current_app.logger.info("管理者パスワード修正中...")
-                new_password = 'admin'
-                new_hash = generate_password_hash(new_password, method='pbkdf2:sha256')
-                
-                placeholder = get_placeholder()
-                cur.execute(f'UPDATE users SET password_hash = {placeholder} WHERE username = {placeholder}', (new_hash, 'admin'))
-                current_app.logger.info("管理者パスワード更新完了")
-                
-                # 2. assignment_typeカラム修正
-                current_app.logger.info("assignment_typeカラム修正中...")
-                cur.execute("PRAGMA table_info(textbook_assignments)")
-                columns = cur.fetchall()
-                column_names = [col[1] for col in columns]
-                
-                if 'assignment_type' not in column_names:
-                    current_app.logger.info("assignment_typeカラムを追加中...")
-                    cur.execute("ALTER TABLE textbook_assignments ADD COLUMN assignment_type TEXT")
-                    
-                    if 'study_type' in column_names:
-                        cur.execute("UPDATE textbook_assignments SET assignment_type = study_type WHERE assignment_type IS NULL")
-                        current_app.logger.info("既存データをstudy_typeからコピーしました")
-                    
-                    current_app.logger.info("assignment_typeカラム追加完了")
-                else:
-                    current_app.logger.info("assignment_typeカラムは既に存在します")
-                
-                # 3. データベース状態確認
-                cur.execute("SELECT COUNT(*) FROM users")
-                user_count = cur.fetchone()[0]
-                current_app.logger.info(f"ユーザー数: {user_count}")
-                
-                conn.commit()
-                current_app.logger.info("データベース修正完了")
-                
-                flash('データベースの問題を修正しました。管理者パスワード: admin', 'success')
+        submit_job('fix_database_issues')
+        flash('データベースの修正を開始しました。完了後、管理者パスワード: admin でログインできます', 'success')
                 
     except Exception as e:
         current_app.logger.error(f"データベース修正エラー: {e}")
@@ -2776,33 +2997,110 @@ def fix_database_issues():
 @login_required
 @admin_required
 def download_database():
-    """データベースファイルをダウンロード"""
+    """
+    データベースのスナップショットをダウンロード
+
+    稼働中のファイルを直接送らず、backup API で作った一貫したコピーを送信する。
+    ?compress=gzip / zstd で圧縮しながら送信できる。
+    """
     try:
+        if os.getenv('DB_TYPE', 'sqlite') != 'sqlite':
+            flash('データベースのダウンロードはSQLiteのみ対応しています', 'error')
+            return redirect(url_for('admin.admin'))
+        
         # データベースファイルのパス
         db_path = os.getenv('DB_PATH', 'flashcards.db')
-        
-        if os.path.exists(db_path):
-            # ファイルサイズを取得
-            file_size = os.path.getsize(db_path)
-            
-            # ダウンロード用のファイル名
-            filename = f"flashcards_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-            
-            return send_file(
-                db_path,
-                as_attachment=True,
-                download_name=filename,
-                mimetype='application/octet-stream'
-            )
-        else:
+        if not os.path.exists(db_path):
             flash('データベースファイルが見つかりません', 'error')
             return redirect(url_for('admin.admin'))
+        
+        compression = request.args.get('compress', 'none')
+        if not is_compression_available(compression):
+            flash(f'利用できない圧縮形式です: {compression}', 'error')
+            return redirect(url_for('admin.admin'))
+        
+        chunks, stats = stream_snapshot(
+            db_path, compression,
+            temp_dir=current_app.config.get('BACKUP_TEMP_DIR'),
+            pages=current_app.config.get('BACKUP_PAGES_PER_STEP', 1024)
+        )
+        current_app.logger.info(
+            f"スナップショット作成: {stats['bytes']:,} bytes, {stats['seconds']}秒, "
+            f"ステップ: {stats['steps']}, やり直し: {stats['restarts']}"
+        )
+        
+        # ダウンロード用のファイル名
+        extension, mimetype = COMPRESSIONS[compression]
+        filename = f"flashcards_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db{extension}"
+        return streaming_download(chunks, filename, mimetype=mimetype)
             
     except Exception as e:
         current_app.logger.error(f"データベースダウンロードエラー: {e}")
         flash('データベースのダウンロードに失敗しました', 'error')
         return redirect(url_for('admin.admin'))
 
+# データベース全体のエクスポート対象（パスワードハッシュなど外に出さない列は除外する）
+# study_log の古い日は study_log_daily に集計されるため、集計と境界も含める
+# （SQLite で月別テーブルに移された生ログは export_database で月別テーブルごとに追加する）
+DATABASE_EXPORT_TABLES = (
+    'users', 'user_settings', 'textbooks', 'units', 'questions', 'image',
+    'study_log', 'study_log_daily', 'log_rollup_state',
+    'study_sessions', 'study_logs', 'chunk_progress', 'chunk_card_progress',
+    'textbook_assignments', 'assignment_details',
+    'input_textbooks', 'input_units', 'input_questions', 'input_study_log',
+    'choice_textbooks', 'choice_units', 'choice_questions', 'choice_study_log'
+)
+DATABASE_EXPORT_EXCLUDED_COLUMNS = {
+    'users': ('password_hash',)
+}
+
+def export_table_csv(table):
+    """テーブル全体をCSVのチャンクとして返す（テーブルが存在しない場合は None）"""
+    columns = get_table_columns(table)
+    if columns is None:
+        return None
+    excluded = DATABASE_EXPORT_EXCLUDED_COLUMNS.get(table, ())
+    columns = [column for column in columns if column not in excluded]
+    order_by = ' ORDER BY id' if 'id' in columns else ''
+    return stream_csv(columns, iter_query(f"SELECT {', '.join(columns)} FROM {table}{order_by}"))
+
+def get_study_log_month_tables():
+    """SQLite: 日別に集計済みで study_log から移された生ログの月別テーブル（PostgreSQL のパーティションは study_log に含まれる）"""
+    if os.getenv('DB_TYPE', 'sqlite') != 'sqlite':
+        return []
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            return list(get_month_tables(cur, 'study_log'))
+
+@admin_bp.route('/admin/export/<table>.csv')
+@login_required
+@admin_required
+def export_table(table):
+    """テーブル全体をCSVでエクスポート（数百万行でも一定のメモリで送信）"""
+    chunks = export_table_csv(table) if table in DATABASE_EXPORT_TABLES else None
+    if chunks is None:
+        flash('エクスポートできないテーブルです', 'error')
+        return redirect(url_for('admin.admin'))
+    filename = f"{table}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return streaming_download(chunks, filename)
+
+@admin_bp.route('/admin/export/database.zip')
+@login_required
+@admin_required
+def export_database():
+    """データベース全体をテーブルごとのCSVにしてZIPでエクスポート"""
+    def entries():
+        for table in DATABASE_EXPORT_TABLES:
+            chunks = export_table_csv(table)
+            if chunks is not None:
+                yield f'{table}.csv', chunks
+            if table == 'study_log':
+                for name in get_study_log_month_tables():
+                    yield f'{name}.csv', export_table_csv(name)
+    
+    filename = f"flashcards_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return streaming_download(stream_zip(entries()), filename, mimetype='application/zip')
+
 @admin_bp.route('/admin/units/<int:unit_id>/preview_choices', methods=['POST'])
 @login_required
 @admin_required
@@ -2828,62 +3126,24 @@ def preview_choices(unit_id):
         current_app.logger.error(f"選択肢プレビューエラー: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@admin_bp.route('/admin/units/<int:unit_id>/bulk_choices', methods=['POST'])
+@login_required
+@admin_required
+def bulk_choices(unit_id):
+    """単元のすべての問題の選択肢をまとめて生成（JSON）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        count = int(data.get('count', 4))
+        exclude = data.get('exclude', '')
+        return jsonify({'success': True, 'questions': generate_unit_choices(unit_id, count, exclude)})
+    except Exception as e:
+        current_app.logger.error(f"選択肢一括生成エラー: unit_id={unit_id}, error={e}")
+        return jsonify({'success': False, 'error': str(e)})
+
 def generate_choices_from_unit(unit_id, correct_answer, count, exclude=''):
-    """同じ単元内の他の問題から選択肢を生成"""
+    """同じ単元内の他の問題から選択肢を生成（単元の候補はメモリ上のプールから取得）"""
     try:
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
-                # 除外する問題番号を解析
-                exclude_numbers = []
-                if exclude:
-                    try:
-                        exclude_numbers = [int(x.strip()) for x in exclude.split(',') if x.strip().isdigit()]
-                    except ValueError:
-                        pass
-                
-                # 同じ単元内の他の問題の正解を取得
-                query = '''
-                    SELECT correct_answer, question_number 
-                    FROM questions 
-                    WHERE unit_id = ? AND is_active = TRUE AND correct_answer != ?
-                '''
-                params = [unit_id, correct_answer]
-                
-                if exclude_numbers:
-                    placeholders = ','.join(['?' for _ in exclude_numbers])
-                    query += f' AND question_number NOT IN ({placeholders})'
-                    params.extend(exclude_numbers)
-                
-                query += ' ORDER BY RANDOM() LIMIT ?'
-                params.append(count * 2)  # より多くの候補を取得
-                
-                cur.execute(query, params)
-                candidates = cur.fetchall()
-                
-                # 選択肢を生成
-                choices = [correct_answer]  # 正解を最初に追加
-                
-                # 他の問題の正解から選択肢を追加
-                for candidate in candidates:
-                    if len(choices) >= count:
-                        break
-                    candidate_answer = candidate[0]
-                    if candidate_answer not in choices:
-                        choices.append(candidate_answer)
-                
-                # 選択肢が足りない場合は、ダミーの選択肢を追加
-                while len(choices) < count:
-                    dummy_choice = f"選択肢{len(choices) + 1}"
-                    if dummy_choice not in choices:
-                        choices.append(dummy_choice)
-                
-                # 選択肢をシャッフル（正解は最初のまま）
-                other_choices = choices[1:]
-                random.shuffle(other_choices)
-                choices = [choices[0]] + other_choices
-                
-                return choices
-                
+        return generate_choices(unit_id, correct_answer, count, exclude)
     except Exception as e:
         current_app.logger.error(f"選択肢生成エラー: {e}")
         return None
\ No newline at end of file
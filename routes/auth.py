@@ -1,7 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
 from flask_login import login_user, logout_user, login_required
 from werkzeug.security import generate_password_hash, check_password_hash
-from models.user import User  # Userクラスはmodels/user.pyに移動予定
+from models.user import User, invalidate_user_cache  # Userクラスはmodels/user.pyに移動予定
 from utils.db import get_db_connection, get_db_cursor, get_placeholder
 
 auth_bp = Blueprint('auth', __name__)
@@ -40,6 +40,7 @@ def login():
                         placeholder = get_placeholder()
                         cur.execute(f"UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = {placeholder}", (user[0],))
                         conn.commit()
+                invalidate_user_cache(user[0])
                 
                 # 管理者の場合は管理者画面にリダイレクト
                 if user[4]:  # is_adminがTrueの場合
@@ -1,8 +1,11 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
 from flask_login import login_required, current_user
 from datetime import datetime
-import re
 from utils.db import get_db_connection, get_db_cursor
+from utils.log_writer import enqueue_log
+from utils.answer_matching import SIMILARITY_THRESHOLD, AnswerKey
+from utils.normalization import normalize_choice_answer
+from utils.session_store import save_session_data, load_session_data, discard_session_data
 
 choice_studies_bp = Blueprint('choice_studies', __name__)
 
@@ -118,41 +121,15 @@ def update_choice_chunk_progress(user_id, source, chapter_id, chunk_number, is_c
         return False
 
 def normalize_answer(answer):
-    """回答を正規化（空白除去、全角→半角変換など）"""
-    if not answer:
-        return ""
-    
-    # 空白を除去（日本語の場合は小文字化しない）
-    normalized = re.sub(r'\s+', '', answer)
-    
-    # 全角数字を半角に変換
-    normalized = normalized.translate(str.maketrans('０１２３４５６７８９', '0123456789'))
-    
-    # 全角英字を半角に変換
-    fullwidth_chars = 'ＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚ'
-    halfwidth_chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
-    normalized = normalized.translate(str.maketrans(fullwidth_chars, halfwidth_chars))
-    
-    # 全角記号を半角に変換
-    fullwidth_symbols = '！＠＃＄％＾＆＊（）＿＋－＝｛｝｜：；＂＇＜＞？、。・～'
-    halfwidth_symbols = '!@#$%^&*()_+-={}|:;"\'<>?,./~'
-    normalized = normalized.translate(str.maketrans(fullwidth_symbols, halfwidth_symbols))
-    
-    # 全角スペースを半角スペースに変換
-    normalized = normalized.replace('　', ' ')
-    
-    # 連続するスペースを単一のスペースに変換
-    normalized = re.sub(r'\s+', ' ', normalized)
-    
-    # 前後のスペースを除去
-    normalized = normalized.strip()
-    
-    return normalized
+    """回答を正規化（空白除去、全角→半角、カタカナ→ひらがななど）"""
+    return normalize_choice_answer(answer)
 
-def check_answer(user_answer, correct_answer, acceptable_answers=None):
-    """回答をチェックする"""
+def check_answer(user_answer, correct_answer, acceptable_answers=None, answer_key=None):
+    """回答をチェックする（answer_key に正規化済みの AnswerKey を渡すと正解側の正規化を省略）"""
     user_norm = normalize_answer(user_answer)
-    correct_norm = normalize_answer(correct_answer)
+    if answer_key is None:
+        answer_key = AnswerKey(correct_answer, acceptable_answers, normalize_answer)
+    correct_norm = answer_key.correct
     
     current_app.logger.info(f"採点: ユーザー回答='{user_answer}' -> 正規化='{user_norm}', 正解='{correct_answer}' -> 正規化='{correct_norm}'")
     
@@ -162,14 +139,9 @@ def check_answer(user_answer, correct_answer, acceptable_answers=None):
         return True, "完全一致"
     
     # 許容回答のチェック
-    if acceptable_answers:
-        current_app.logger.info(f"許容回答チェック: {acceptable_answers}")
-        for acceptable in acceptable_answers:
-            acceptable_norm = normalize_answer(acceptable)
-            current_app.logger.info(f"許容回答比較: '{acceptable}' -> '{acceptable_norm}' vs '{user_norm}'")
-            if user_norm == acceptable_norm:
-                current_app.logger.info("許容回答で正解")
-                return True, "許容回答"
+    if answer_key.is_acceptable(user_norm):
+        current_app.logger.info("許容回答で正解")
+        return True, "許容回答"
     
     # 数字のみの場合は数値として比較
     if user_norm.isdigit() and correct_norm.isdigit():
@@ -185,51 +157,21 @@ def check_answer(user_answer, correct_answer, acceptable_answers=None):
         if match_ratio >= 0.7:  # 70%以上のキーワードが一致
             return True, f"部分一致 ({match_ratio:.1%})"
     
-    # 文字列の類似度チェック（編集距離ベース）
-    if len(correct_norm) > 0:
-        similarity = calculate_similarity(user_norm, correct_norm)
-        if similarity >= 0.8:  # 80%以上の類似度
-            return True, f"類似一致 ({similarity:.1%})"
+    # 文字列の類似度チェック（80%以上、距離が閾値を超えた時点で打ち切る）
+    similarity = answer_key.similarity(user_norm, SIMILARITY_THRESHOLD)
+    if similarity is not None:
+        return True, f"類似一致 ({similarity:.1%})"
     
     return False, "不正解"
 
-def calculate_similarity(str1, str2):
-    """文字列の類似度を計算（編集距離ベース）"""
-    if not str1 or not str2:
-        return 0.0
-    
-    # 短い方の文字列を基準にする
-    if len(str1) > len(str2):
-        str1, str2 = str2, str1
-    
-    # 編集距離を計算
-    distance = levenshtein_distance(str1, str2)
-    max_len = max(len(str1), len(str2))
-    
-    if max_len == 0:
-        return 1.0
-    
-    return 1.0 - (distance / max_len)
-
-def levenshtein_distance(str1, str2):
-    """レーベンシュタイン距離を計算"""
-    if len(str1) < len(str2):
-        return levenshtein_distance(str2, str1)
-    
-    if len(str2) == 0:
-        return len(str1)
-    
-    previous_row = list(range(len(str2) + 1))
-    for i, c1 in enumerate(str1):
-        current_row = [i + 1]
-        for j, c2 in enumerate(str2):
-            insertions = previous_row[j + 1] + 1
-            deletions = current_row[j] + 1
-            substitutions = previous_row[j] + (c1 != c2)
-            current_row.append(min(insertions, deletions, substitutions))
-        previous_row = current_row
-    
-    return previous_row[-1]
+def get_session_words(session_data):
+    """クッキーのセッション情報からサーバー側に保存した単語リストを取得"""
+    if not session_data:
+        return None
+    stored = load_session_data(session_data.get('store_id'))
+    if not stored:
+        return None
+    return stored['words']
 
 # ========== 選択問題関連のルート ==========
 
@@ -252,10 +194,8 @@ def choice_studies_home():
                     GROUP BY t.source
                 ''', (str(current_user.id),))
                 vocabulary_sources = cur.fetchall()
-        
-        # 各セットの総単語数も取得
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
+                
+                # 各セットの総単語数も取得（同じ接続を使い回す）
                 cur.execute('''
                     SELECT t.source, COUNT(*) as total_available
                     FROM choice_questions q
@@ -380,23 +320,11 @@ def choice_studies_start(source, chapter_id, chunk_number, mode=None):
         if mode is None:
             mode = 'test'
         
-        # 学習セッション情報をセッションに保存
-        session['vocabulary_session'] = {
-            'source': source,
-            'chapter_id': chapter_id,
-            'chunk_number': chunk_number,
-            'mode': mode,
-            'current_word_index': 0,
-            'total_words': 0,
-            'correct_count': 0,
-            'start_time': datetime.now().isoformat()
-        }
-        
         # 単語データを取得
         with get_db_connection() as conn:
             with get_db_cursor(conn) as cur:
                 cur.execute('''
-                    SELECT q.id, q.question, q.correct_answer, q.choices
+                    SELECT q.id, q.question, q.correct_answer, q.choices, q.correct_answer_norm
                     FROM choice_questions q
                     JOIN choice_units u ON q.unit_id = u.id
                     JOIN choice_textbooks t ON u.textbook_id = t.id
@@ -409,17 +337,34 @@ def choice_studies_start(source, chapter_id, chunk_number, mode=None):
             flash("問題が見つかりませんでした")
             return redirect(url_for('choice_studies.choice_studies_chunks', source=source, chapter_id=chapter_id))
         
-        # セッション情報を更新
-        session['vocabulary_session']['total_words'] = len(words)
-        session['vocabulary_session']['words'] = [
-            {
-                'id': word[0],
-                'question': word[1],
-                'correct_answer': word[2],
-                'choices': word[3]
-            }
-            for word in words
-        ]
+        # 単語リストはサーバー側に保存し、クッキーにはIDと現在位置だけを持たせる
+        store_id = save_session_data({
+            'words': [
+                {
+                    'id': word[0],
+                    'question': word[1],
+                    'correct_answer': word[2],
+                    # 登録時に正規化した正解（未設定の行はここで正規化）
+                    'correct_norm': word[4] if word[4] is not None else normalize_answer(word[2]),
+                    'choices': word[3]
+                }
+                for word in words
+            ]
+        })
+        discard_session_data((session.get('vocabulary_session') or {}).get('store_id'))
+        
+        # 学習セッション情報をセッションに保存
+        session['vocabulary_session'] = {
+            'source': source,
+            'chapter_id': chapter_id,
+            'chunk_number': chunk_number,
+            'mode': mode,
+            'store_id': store_id,
+            'current_word_index': 0,
+            'total_words': len(words),
+            'correct_count': 0,
+            'start_time': datetime.now().isoformat()
+        }
         
         return redirect(url_for('choice_studies.choice_studies_study', source=source))
         
@@ -435,12 +380,12 @@ def choice_studies_study(source):
     try:
         # セッション情報を取得
         session_data = session.get('vocabulary_session')
-        if not session_data or session_data['source'] != source:
+        words = get_session_words(session_data)
+        if not words or session_data['source'] != source:
             flash("学習セッションが見つかりません")
             return redirect(url_for('choice_studies.choice_studies_home'))
         
         current_index = session_data['current_word_index']
-        words = session_data['words']
         
         if current_index >= len(words):
             # 学習完了
@@ -467,13 +412,13 @@ def choice_studies_answer():
     try:
         # セッション情報を取得
         session_data = session.get('vocabulary_session')
-        if not session_data:
+        words = get_session_words(session_data)
+        if not words:
             flash("学習セッションが見つかりません")
             return redirect(url_for('choice_studies.choice_studies_home'))
         
         user_answer = request.form.get('answer', '').strip()
         current_index = session_data['current_word_index']
-        words = session_data['words']
         
         if current_index >= len(words):
             flash("学習が完了しています")
@@ -482,29 +427,20 @@ def choice_studies_answer():
         current_word = words[current_index]
         
         # 回答をチェック
-        is_correct, result_type = check_answer(user_answer, current_word['correct_answer'])
-        
-        # 結果をログに記録
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
-                cur.execute('''
-                    INSERT INTO choice_study_log
-                    (user_id, source, chapter_id, chunk_number, question_id, user_answer, 
-                     correct_answer, is_correct, result_type, answered_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    current_user.id,
-                    session_data['source'],
-                    session_data['chapter_id'],
-                    session_data['chunk_number'],
-                    current_word['id'],
-                    user_answer,
-                    current_word['correct_answer'],
-                    is_correct,
-                    result_type,
-                    datetime.now()
-                ))
-                conn.commit()
+        answer_key = None
+        if 'correct_norm' in current_word:
+            answer_key = AnswerKey(current_word['correct_norm'], normalized=True)
+        is_correct, result_type = check_answer(user_answer, current_word['correct_answer'], answer_key=answer_key)
+        
+        # 結果をログに記録（非同期パイプライン経由、choice_study_log にある列だけ）
+        enqueue_log('choice_study_log', {
+            'user_id': current_user.id,
+            'question_id': current_word['id'],
+            'user_answer': user_answer,
+            'correct_answer': current_word['correct_answer'],
+            'is_correct': is_correct,
+            'answered_at': datetime.now()
+        })
         
         # セッション情報を更新
         if is_correct:
@@ -554,8 +490,9 @@ def choice_studies_complete():
             is_passed=is_passed
         )
         
-        # セッションをクリア
+        # セッションをクリア（サーバー側の単語リストも削除）
         session.pop('vocabulary_session', None)
+        discard_session_data(session_data.get('store_id'))
         
         return redirect(url_for('choice_studies.choice_studies_result', source=session_data['source']))
         
@@ -1,6 +1,11 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, session
 from flask_login import login_required, current_user
 from utils.db import get_db_connection, get_db_cursor
+from utils.log_writer import enqueue_log
+from utils.session_store import save_session_data, load_session_data, discard_session_data
+from utils.assignments import get_dashboard_assignments
+from utils.normalization import normalize_question_answer, normalize_acceptable_answers, parse_acceptable_answers
+from utils.log_maintenance import delete_study_log_history
 from utils.study_utils import (
     has_study_history, clear_user_cache, get_detailed_progress_for_all_stages,
     get_study_cards_fast, get_chunk_practice_cards, create_fallback_stage_info
@@ -10,6 +15,10 @@ from datetime import datetime
 
 study_bp = Blueprint('study', __name__)
 
+def row_value(row, key, default=None):
+    """行から列の値を取得（列がない古いスキーマでは default）"""
+    return row[key] if key in row.keys() else default
+
 def parse_datetime(datetime_str):
     """文字列の日時をdatetimeオブジェクトに変換"""
     if not datetime_str:
@@ -32,70 +41,34 @@ def parse_datetime(datetime_str):
     except Exception:
         return None
 
+def get_session_questions(session_data):
+    """クッキーのセッション情報からサーバー側に保存した問題リストを取得"""
+    if not session_data:
+        return None
+    stored = load_session_data(session_data.get('store_id'))
+    if not stored:
+        return None
+    return stored['questions']
+
 @study_bp.route('/dashboard')
 @login_required
 def dashboard():
     """生徒のダッシュボード - 割り当てられた教材を表示"""
     try:
-        user_id = str(current_user.id)
+        # 割り当てと単元はまとめて取得してキャッシュする（割り当て変更時に無効化）
+        assignments = get_dashboard_assignments(current_user.id)
         
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
-                # 割り当てられた教材を取得
-                cur.execute('''
-                    SELECT ta.id, ta.textbook_id, ta.assignment_type, ta.units, ta.chunks,
-                           ta.assigned_at, ta.expires_at,
-                           CASE 
-                               WHEN ta.assignment_type = 'input' THEN it.name
-                               WHEN ta.assignment_type = 'choice' THEN ct.source
-                           END as textbook_name,
-                           CASE 
-                               WHEN ta.assignment_type = 'input' THEN it.subject
-                               WHEN ta.assignment_type = 'choice' THEN '選択問題'
-                           END as subject
-                    FROM textbook_assignments ta
-                    LEFT JOIN input_textbooks it ON ta.textbook_id = it.id AND ta.assignment_type = 'input'
-                    LEFT JOIN choice_textbooks ct ON ta.textbook_id = ct.id AND ta.assignment_type = 'choice'
-                    WHERE ta.user_id = ? AND ta.is_active = TRUE
-                    ORDER BY ta.assigned_at DESC
-                ''', (user_id,))
-                assignments = cur.fetchall()
-                
-                # 各割り当ての詳細情報を取得
-                processed_assignments = []
-                for assignment in assignments:
-                    assignment_dict = dict(assignment)
-                    assignment_dict['assigned_at'] = parse_datetime(assignment['assigned_at'])
-                    assignment_dict['expires_at'] = parse_datetime(assignment['expires_at'])
-                    
-                    if assignment['units']:
-                        try:
-                            unit_ids = json.loads(assignment['units'])
-                            if assignment['assignment_type'] == 'input':
-                                cur.execute('''
-                                    SELECT id, name, chapter_number, description 
-                                    FROM input_units 
-                                    WHERE id IN ({})
-                                    ORDER BY chapter_number, name
-                                '''.format(','.join(['?' for _ in unit_ids])), unit_ids)
-                            else:
-                                cur.execute('''
-                                    SELECT id, name, unit_number 
-                                    FROM choice_units 
-                                    WHERE id IN ({})
-                                    ORDER BY unit_number, name
-                                '''.format(','.join(['?' for _ in unit_ids])), unit_ids)
-                            assignment_dict['unit_details'] = cur.fetchall()
-                        except json.JSONDecodeError:
-                            assignment_dict['unit_details'] = []
-                    else:
-                        assignment_dict['unit_details'] = []
-                    
-                    processed_assignments.append(assignment_dict)
-                
-                return render_template('dashboard.html', 
-                                     assignments=processed_assignments,
-                                     now=datetime.now())
+        processed_assignments = []
+        for assignment in assignments:
+            # キャッシュ上のdictは書き換えずにコピーして日時を変換する
+            assignment_dict = dict(assignment)
+            assignment_dict['assigned_at'] = parse_datetime(assignment['assigned_at'])
+            assignment_dict['expires_at'] = parse_datetime(assignment['expires_at'])
+            processed_assignments.append(assignment_dict)
+        
+        return render_template('dashboard.html', 
+                             assignments=processed_assignments,
+                             now=datetime.now())
                 
     except Exception as e:
         current_app.logger.error(f"ダッシュボードエラー: {e}")
@@ -278,24 +251,31 @@ def start_input_study(session_id):
                     flash('問題が見つかりません', 'error')
                     return redirect(url_for('study.dashboard'))
                 
-                # セッション情報をセッションに保存
-                session['input_study_session'] = {
-                    'session_id': session_id,
-                    'textbook_name': session_info['textbook_name'],
-                    'subject': session_info['subject'],
+                # 問題リストはサーバー側に保存し、クッキーにはIDと現在位置だけを持たせる
+                store_id = save_session_data({
                     'questions': [
                         {
                             'id': q['id'],
                             'question': q['question_text'],
                             'correct_answer': q['correct_answer'],
                             'acceptable_answers': q['acceptable_answers'],
+                            # 登録時に正規化した正解・許容回答（採点では回答だけを正規化する）
+                            'correct_norm': row_value(q, 'correct_answer_norm'),
+                            'acceptable_norms': row_value(q, 'acceptable_answers_norm'),
                             'answer_suffix': q['answer_suffix'],
                             'explanation': q['explanation'],
                             'image_url': q['image_url'],
                             'unit_name': q['unit_name']
                         }
                         for q in questions
-                    ],
+                    ]
+                })
+                discard_session_data((session.get('input_study_session') or {}).get('store_id'))
+                session['input_study_session'] = {
+                    'session_id': session_id,
+                    'store_id': store_id,
+                    'textbook_name': session_info['textbook_name'],
+                    'subject': session_info['subject'],
                     'current_index': 0,
                     'total_questions': len(questions),
                     'correct_count': 0,
@@ -345,11 +325,8 @@ def start_choice_study(session_id):
                     flash('選択問題が見つかりません', 'error')
                     return redirect(url_for('study.dashboard'))
                 
-                # セッション情報をセッションに保存
-                session['choice_study_session'] = {
-                    'session_id': session_id,
-                    'textbook_name': session_info['textbook_name'],
-                    'subject': session_info['subject'],
+                # 問題リストはサーバー側に保存し、クッキーにはIDと現在位置だけを持たせる
+                store_id = save_session_data({
                     'questions': [
                         {
                             'id': q['id'],
@@ -360,7 +337,14 @@ def start_choice_study(session_id):
                             'unit_name': q['unit_name']
                         }
                         for q in questions
-                    ],
+                    ]
+                })
+                discard_session_data((session.get('choice_study_session') or {}).get('store_id'))
+                session['choice_study_session'] = {
+                    'session_id': session_id,
+                    'store_id': store_id,
+                    'textbook_name': session_info['textbook_name'],
+                    'subject': session_info['subject'],
                     'current_index': 0,
                     'total_questions': len(questions),
                     'correct_count': 0,
@@ -380,12 +364,12 @@ def input_study_question():
     """入力問題学習画面"""
     try:
         session_data = session.get('input_study_session')
-        if not session_data:
+        questions = get_session_questions(session_data)
+        if not questions:
             flash('学習セッションが見つかりません', 'error')
             return redirect(url_for('study.dashboard'))
         
         current_index = session_data['current_index']
-        questions = session_data['questions']
         
         if current_index >= len(questions):
             # 学習完了
@@ -411,12 +395,12 @@ def choice_study_question():
     """選択問題学習画面"""
     try:
         session_data = session.get('choice_study_session')
-        if not session_data:
+        questions = get_session_questions(session_data)
+        if not questions:
             flash('学習セッションが見つかりません', 'error')
             return redirect(url_for('study.dashboard'))
         
         current_index = session_data['current_index']
-        questions = session_data['questions']
         
         if current_index >= len(questions):
             # 学習完了
@@ -425,7 +409,6 @@ def choice_study_question():
         current_question = questions[current_index]
         
         # 選択肢をJSONからパース
-        import json
         choices = json.loads(current_question['choices']) if current_question['choices'] else []
         
         return render_template('study/choice_question.html',
@@ -453,13 +436,17 @@ def submit_answer():
         
         if study_type == 'input':
             session_data = session.get('input_study_session')
-            if not session_data:
+            questions = get_session_questions(session_data)
+            if not questions:
                 return jsonify({'error': 'セッションが見つかりません'}), 400
             
-            current_question = session_data['questions'][session_data['current_index']]
+            current_question = questions[session_data['current_index']]
             
             # 正解判定
-            is_correct = check_input_answer(answer, current_question['correct_answer'], current_question['acceptable_answers'])
+            is_correct = check_input_answer(
+                answer, current_question['correct_answer'], current_question['acceptable_answers'],
+                current_question.get('correct_norm'), current_question.get('acceptable_norms')
+            )
             
             # 学習ログを記録
             log_study_result(session_data['session_id'], question_id, answer, 
@@ -475,15 +462,16 @@ def submit_answer():
                 'is_correct': is_correct,
                 'correct_answer': current_question['correct_answer'],
                 'explanation': current_question['explanation'],
-                'is_complete': session_data['current_index'] >= len(session_data['questions'])
+                'is_complete': session_data['current_index'] >= len(questions)
             })
             
         elif study_type == 'choice':
             session_data = session.get('choice_study_session')
-            if not session_data:
+            questions = get_session_questions(session_data)
+            if not questions:
                 return jsonify({'error': 'セッションが見つかりません'}), 400
             
-            current_question = session_data['questions'][session_data['current_index']]
+            current_question = questions[session_data['current_index']]
             
             # 正解判定
             is_correct = answer == current_question['correct_answer']
@@ -502,7 +490,7 @@ def submit_answer():
                 'is_correct': is_correct,
                 'correct_answer': current_question['correct_answer'],
                 'explanation': current_question['explanation'],
-                'is_complete': session_data['current_index'] >= len(session_data['questions'])
+                'is_complete': session_data['current_index'] >= len(questions)
             })
         
         else:
@@ -512,33 +500,35 @@ def submit_answer():
         current_app.logger.error(f"回答提出エラー: {e}")
         return jsonify({'error': 'エラーが発生しました'}), 500
 
-def check_input_answer(user_answer, correct_answer, acceptable_answers):
-    """入力問題の正解判定"""
-    if user_answer.lower() == correct_answer.lower():
+def check_input_answer(user_answer, correct_answer, acceptable_answers, correct_norm=None, acceptable_norms=None):
+    """
+    入力問題の正解判定（正規化済みの正解があればそれと比較し、回答だけを正規化する）
+
+    大文字小文字だけを無視して比較する。空の回答は正解にしない。
+    """
+    user_norm = normalize_question_answer(user_answer)
+    if not user_norm:
+        return False
+    if correct_norm is None:
+        correct_norm = normalize_question_answer(correct_answer)
+    if user_norm == correct_norm:
         return True
     
-    if acceptable_answers:
-        import json
-        try:
-            acceptable_list = json.loads(acceptable_answers)
-            for acceptable in acceptable_list:
-                if user_answer.lower() == acceptable.lower():
-                    return True
-        except:
-            pass
-    
-    return False
+    if acceptable_norms is None:
+        acceptable_norms = normalize_acceptable_answers(acceptable_answers)
+    return user_norm in parse_acceptable_answers(acceptable_norms)
 
 def log_study_result(session_id, question_id, user_answer, correct_answer, is_correct, study_type):
-    """学習結果をログに記録"""
+    """学習結果をログに記録（非同期パイプライン経由）"""
     try:
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
-                cur.execute('''
-                    INSERT INTO study_logs (session_id, question_id, user_answer, correct_answer, is_correct, study_type)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (session_id, question_id, user_answer, correct_answer, is_correct, study_type))
-                conn.commit()
+        enqueue_log('study_logs', {
+            'session_id': session_id,
+            'question_id': question_id,
+            'user_answer': user_answer,
+            'correct_answer': correct_answer,
+            'is_correct': is_correct,
+            'study_type': study_type
+        })
     except Exception as e:
         current_app.logger.error(f"学習ログ記録エラー: {e}")
 
@@ -581,9 +571,11 @@ def complete_study(session_id):
                 ''', (session_id,))
                 conn.commit()
                 
-                # セッション情報をクリア
-                session.pop('input_study_session', None)
-                session.pop('choice_study_session', None)
+                # セッション情報をクリア（サーバー側の問題リストも削除）
+                for key in ('input_study_session', 'choice_study_session'):
+                    session_data = session.pop(key, None)
+                    if session_data:
+                        discard_session_data(session_data.get('store_id'))
                 
                 return render_template('study/complete.html',
                                      textbook_name=session_info['textbook_name'],
@@ -691,6 +683,15 @@ def reset_history(source):
                     deleted_chunk_progress = cur.rowcount
                     current_app.logger.info(f"削除されたchunk_progressレコード数: {deleted_chunk_progress}")
                     
+                    # チャンク進捗の集計テーブルからも削除
+                    cur.execute("""
+                        DELETE FROM chunk_card_progress 
+                        WHERE user_id = ? AND source = ?
+                    """, (current_user.id, source))
+                    
+                    # 日別に集計済みの学習履歴からも削除
+                    deleted_study_logs += delete_study_log_history(cur, current_user.id, source)
+                    
                     # user_settingsテーブルからも削除
                     cur.execute("""
                         DELETE FROM user_settings 
@@ -886,7 +887,6 @@ def log_result():
         data = request.get_json()
         card_id = data.get('card_id')
         result = data.get('result')  # 'correct' or 'incorrect'
-        answer_time = data.get('answer_time', 0)
         
         if not card_id or not result:
             return jsonify({'error': '必要なデータが不足しています'}), 400
@@ -899,16 +899,28 @@ def log_result():
         if not user_id:
             return jsonify({'error': 'ユーザーが認証されていません'}), 401
         
-        # 学習結果を記録
-        with get_db_connection() as conn:
-            with get_db_cursor(conn) as cur:
-                cur.execute('''
-                    INSERT INTO study_log (user_id, card_id, result, answer_time, stage, mode)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (user_id, card_id, result, answer_time, 
-                     study_session.get('stage', 'unknown'), 
-                     study_session.get('mode', 'unknown')))
-                conn.commit()
+        # 練習セッションはステージ1の間違えたカードが対象
+        stage = study_session.get('stage')
+        if not isinstance(stage, int):
+            stage = 1
+        
+        # 学習結果を記録（キューに積むだけで、書き込みはバックグラウンドで行う）
+        # chunk_number は study_log の列ではなく、チャンク学習の行として集計テーブルを更新する目印に使う
+        # （集計のチャンク番号はカードの並び順から求める）
+        enqueue_log('study_log', {
+            'user_id': user_id,
+            'card_id': card_id,
+            'source': study_session.get('source'),
+            'stage': stage,
+            'mode': study_session.get('mode', 'test'),
+            'result': result,
+            'page_range': study_session.get('page_range') or '',
+            'difficulty': study_session.get('difficulty') or '',
+            'chunk_number': study_session.get('chunk_number')
+        })
+        
+        # 学習履歴・進捗のキャッシュを無効化
+        clear_user_cache(user_id, study_session.get('source'))
         
         # セッションの現在インデックスを更新
         study_session['current_index'] += 1
@@ -0,0 +1,46 @@
+"""CsvImporter のトランザクションの扱いのテスト"""
+
+import sqlite3
+
+import pytest
+
+from utils.csv_import import CsvImporter
+
+class ImportAborted(Exception):
+    pass
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_TYPE', 'sqlite')
+    conn = sqlite3.connect(str(tmp_path / 'import.db'))
+    conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT NOT NULL)')
+    conn.commit()
+    yield conn
+    conn.close()
+
+def count_items(conn):
+    return conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+def test_abort_after_batches_rolls_back_everything(conn):
+    cur = conn.cursor()
+    importer = CsvImporter(cur, 'items', ('id', 'name'), batch_size=10)
+    with pytest.raises(ImportAborted):
+        for row_num in range(1, 100):
+            importer.add(row_num, (row_num, f'item{row_num}'))
+            if importer.success_count >= 20:
+                # 2バッチ書き込んだ後に中断（デコードエラー・キャンセルなど）
+                raise ImportAborted()
+    assert importer.success_count == 20
+    conn.rollback()
+    assert count_items(conn) == 0
+
+def test_finish_leaves_commit_to_caller(conn):
+    cur = conn.cursor()
+    importer = CsvImporter(cur, 'items', ('id', 'name'), batch_size=10)
+    for row_num in range(1, 26):
+        importer.add(row_num, (row_num, f'item{row_num}'))
+    report = importer.finish()
+    assert report['success_count'] == 25
+    assert conn.in_transaction
+    conn.commit()
+    assert count_items(conn) == 25
@@ -0,0 +1,131 @@
+"""JobRunner のキャンセル・失敗・中断されたジョブの回収のテスト"""
+
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from utils.db import close_sqlite_pools, get_db_connection, get_db_cursor
+from utils.jobs import JOB_HANDLERS, JobRunner
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_TYPE', 'sqlite')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'jobs.db'))
+    app = Flask(__name__)
+    yield app
+    close_sqlite_pools()
+
+@pytest.fixture
+def runner(app, tmp_path):
+    runner = JobRunner(app, max_workers=1, progress_interval=0, upload_dir=str(tmp_path / 'uploads'))
+    yield runner
+    runner.shutdown()
+
+def register(monkeypatch, job_type, handler):
+    monkeypatch.setitem(JOB_HANDLERS, job_type, handler)
+
+def wait_finished(runner, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = runner.get(job_id)
+        if job['is_finished']:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'ジョブが終了しません: {runner.get(job_id)}')
+
+def make_upload(tmp_path, name='job.upload'):
+    path = tmp_path / name
+    path.write_text('username,password\n')
+    return str(path)
+
+def test_cancel_queued_job_skips_handler(app, runner, tmp_path, monkeypatch):
+    release = threading.Event()
+    calls = []
+    register(monkeypatch, 'test_block', lambda job: release.wait(5))
+    register(monkeypatch, 'test_record', lambda job: calls.append('run'))
+    upload = make_upload(tmp_path)
+    with app.app_context():
+        # ワーカーが1つなので、2つ目のジョブは1つ目が終わるまでキュー待ちになる
+        blocking_id = runner.submit('test_block')
+        queued_id = runner.submit('test_record', upload_path=upload)
+        job = runner.cancel(queued_id)
+        assert job['status'] == 'cancelled'
+        release.set()
+        wait_finished(runner, blocking_id)
+        job = wait_finished(runner, queued_id)
+    assert job['status'] == 'cancelled'
+    assert calls == []
+    assert not (tmp_path / 'job.upload').exists()
+
+def test_cancel_running_job_stops_at_check_cancelled(app, runner, monkeypatch):
+    started = threading.Event()
+    steps = []
+
+    def handler(job):
+        started.set()
+        for step in range(500):
+            job.progress(step, 500)
+            job.check_cancelled()
+            steps.append(step)
+            time.sleep(0.01)
+        return {'steps': len(steps)}
+
+    register(monkeypatch, 'test_loop', handler)
+    with app.app_context():
+        job_id = runner.submit('test_loop')
+        assert started.wait(5)
+        runner.cancel(job_id)
+        job = wait_finished(runner, job_id)
+    assert job['status'] == 'cancelled'
+    assert job['cancel_requested']
+    assert job['result'] is None
+    assert len(steps) < 500
+
+def test_failed_job_records_error(app, runner, tmp_path, monkeypatch):
+    def handler(job, name):
+        raise ValueError(f'{name} の取り込みに失敗しました')
+
+    register(monkeypatch, 'test_fail', handler)
+    upload = make_upload(tmp_path)
+    with app.app_context():
+        job_id = runner.submit('test_fail', {'name': 'users.csv'}, upload_path=upload)
+        job = wait_finished(runner, job_id)
+    assert job['status'] == 'failed'
+    assert job['error'] == 'users.csv の取り込みに失敗しました'
+    assert runner.stats()['failed'] == 1
+    assert not (tmp_path / 'job.upload').exists()
+
+def insert_job(job_id, status, pid, host, upload_path=None):
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            cur.execute('''
+                INSERT INTO background_jobs (id, job_type, status, worker_pid, worker_host, upload_path)
+                VALUES (?, 'csv_import', ?, ?, ?, ?)
+            ''', (job_id, status, pid, host, upload_path))
+        conn.commit()
+
+def test_recover_interrupted_fails_jobs_of_dead_process(app, runner, tmp_path):
+    # 終了済みのプロセスのPID
+    finished = subprocess.Popen([sys.executable, '-c', 'pass'])
+    finished.wait()
+    # 稼働中の別プロセス
+    alive = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+    upload = make_upload(tmp_path)
+    try:
+        with app.app_context():
+            runner._ensure_table()
+            insert_job('dead', 'running', finished.pid, runner.hostname, upload)
+            insert_job('alive', 'running', alive.pid, runner.hostname)
+            assert runner.recover_interrupted() == 1
+            dead, live = runner.get('dead'), runner.get('alive')
+    finally:
+        alive.kill()
+        alive.wait()
+    assert dead['status'] == 'failed'
+    assert dead['error'] == 'プロセスの終了により中断されました'
+    assert live['status'] == 'running'
+    assert not (tmp_path / 'job.upload').exists()
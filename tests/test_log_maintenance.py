@@ -0,0 +1,111 @@
+"""学習ログの日別集計と月別テーブルへの移動（SQLite）のテスト"""
+
+from datetime import date
+
+import pytest
+from flask import Flask
+
+from utils.db import close_sqlite_pools, get_db_connection, get_db_cursor
+from utils.log_maintenance import count_study_log_rows, delete_study_log_history, get_month_tables, run_log_maintenance
+from utils.migrations import run_migrations
+from utils.progress import rebuild_chunk_card_progress
+from utils.study_utils import get_detailed_progress_for_all_stages, get_stage_completion, has_study_history
+
+SOURCE = 'テスト教材'
+TODAY = date(2025, 6, 15)
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_TYPE', 'sqlite')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'logs.db'))
+    app = Flask(__name__)
+    with app.app_context():
+        with get_db_connection() as conn:
+            run_migrations(conn)
+            seed(conn)
+        yield app
+    close_sqlite_pools()
+
+def seed(conn):
+    cur = conn.cursor()
+    cur.executemany(
+        'INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+        [(1, 'student1', 'x'), (2, 'student2', 'x')]
+    )
+    cur.executemany(
+        'INSERT INTO image (id, source, page_number, level) VALUES (?, ?, ?, ?)',
+        [(card_id, SOURCE, card_id, 'A') for card_id in range(1, 13)]
+    )
+    rows = []
+    # 集計の境界（TODAY の90日前）より前の2か月と、境界以降の最近の日
+    for user_id in (1, 2):
+        for card_id in range(1, 13):
+            rows.append((user_id, card_id, 1, 'unknown', '2025-01-10 09:00:00'))
+            rows.append((user_id, card_id, 1, 'known' if card_id % 2 else 'unknown', '2025-02-20 09:00:00'))
+            if card_id <= 6:
+                rows.append((user_id, card_id, 2, 'known', '2025-06-10 09:00:00'))
+    cur.executemany('''
+        INSERT INTO study_log (user_id, card_id, source, stage, mode, result, page_range, difficulty, created_at)
+        VALUES (?, ?, ?, ?, 'test', ?, '', '', ?)
+    ''', [(user_id, card_id, SOURCE, stage, result, created_at) for user_id, card_id, stage, result, created_at in rows])
+    conn.commit()
+
+def snapshot(user_id):
+    rebuild_chunk_card_progress(user_id)
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            total = count_study_log_rows(cur)
+            cur.execute('''
+                SELECT stage, mode, chunk_number, card_id, correct_count, wrong_count, last_result
+                FROM chunk_card_progress WHERE user_id = ? ORDER BY stage, mode, card_id
+            ''', (user_id,))
+            card_progress = cur.fetchall()
+    return {
+        'completion': get_stage_completion(user_id, SOURCE, '', ''),
+        'progress': get_detailed_progress_for_all_stages(user_id, SOURCE, '', ''),
+        'card_progress': card_progress,
+        'history': has_study_history(user_id, SOURCE),
+        'total': total
+    }
+
+def count_rows(cur, table, user_id=None):
+    condition = ' WHERE user_id = ?' if user_id is not None else ''
+    cur.execute(f'SELECT COUNT(*) FROM {table}{condition}', (user_id,) if user_id is not None else ())
+    return cur.fetchone()[0]
+
+def test_rollup_keeps_progress_and_history(app):
+    before = {user_id: snapshot(user_id) for user_id in (1, 2)}
+    assert before[1]['total'] == 60
+    assert before[1]['completion']['known_cards'] == 9
+    assert len(before[1]['card_progress']) == 18
+
+    with get_db_connection() as conn:
+        stats = run_log_maintenance(conn, rollup_after_days=90, today=TODAY)
+        with get_db_cursor(conn) as cur:
+            month_tables = list(get_month_tables(cur, 'study_log'))
+            raw_rows = count_rows(cur, 'study_log')
+    assert stats['rolled_up_before'] == '2025-03-17'
+    assert stats['rolled_up_rows'] == 48
+    assert stats['moved_rows'] == 48
+    assert month_tables == ['study_log_p202501', 'study_log_p202502']
+    assert raw_rows == 12
+
+    after = {user_id: snapshot(user_id) for user_id in (1, 2)}
+    assert after == before
+
+def test_delete_history_removes_rollups_and_month_tables(app):
+    with get_db_connection() as conn:
+        run_log_maintenance(conn, rollup_after_days=90, today=TODAY)
+        with get_db_cursor(conn) as cur:
+            deleted = delete_study_log_history(cur, 1)
+            cur.execute('DELETE FROM study_log WHERE user_id = ?', (1,))
+            conn.commit()
+            assert deleted == 24
+            assert count_rows(cur, 'study_log_daily', 1) == 0
+            for name in get_month_tables(cur, 'study_log'):
+                assert count_rows(cur, name, 1) == 0
+                assert count_rows(cur, name, 2) == 12
+            assert count_rows(cur, 'study_log_daily', 2) > 0
+            assert count_study_log_rows(cur) == 30
+    assert not has_study_history(1, SOURCE)
+    assert has_study_history(2, SOURCE)
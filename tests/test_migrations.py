@@ -0,0 +1,47 @@
+"""スキーマのマイグレーション（SQLite）のテスト"""
+
+import pytest
+from flask import Flask
+
+from utils.db import close_sqlite_pools, get_db_connection, get_db_cursor
+from utils.migrations import MIGRATIONS, plan_migrations, run_migrations
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_TYPE', 'sqlite')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'schema.db'))
+    app = Flask(__name__)
+    with app.app_context():
+        yield app
+    close_sqlite_pools()
+
+def get_schema_versions():
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            cur.execute('SELECT version, name FROM schema_version ORDER BY version')
+            return [tuple(row) for row in cur.fetchall()]
+
+def test_fresh_database_applies_all_migrations(app):
+    with get_db_connection() as conn:
+        assert [migration.version for migration, _ in plan_migrations(conn)] == [m.version for m in MIGRATIONS]
+        applied = run_migrations(conn)
+    assert [migration.version for migration in applied] == [migration.version for migration in MIGRATIONS]
+    assert get_schema_versions() == [(migration.version, migration.name) for migration in MIGRATIONS]
+
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            cur.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")
+            names = {row[0] for row in cur.fetchall()}
+    # 初期状態の後のマイグレーションで作成するもの
+    assert {'chunk_card_progress', 'background_jobs', 'study_log_daily', 'log_rollup_state'} <= names
+    assert {'idx_study_log_user_card', 'idx_assignment_details_assignment'} <= names
+
+def test_rerun_has_nothing_pending(app):
+    with get_db_connection() as conn:
+        run_migrations(conn)
+    versions = get_schema_versions()
+
+    with get_db_connection() as conn:
+        assert plan_migrations(conn) == []
+        assert run_migrations(conn) == []
+    assert get_schema_versions() == versions
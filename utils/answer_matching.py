@@ -0,0 +1,141 @@
+"""
+回答の採点用の文字列比較（編集距離・類似度）
+
+表全体を作るDPの代わりに、ビット並列（Myers / Hyyrö）のレーベンシュタイン距離を使う。
+採点では「類似度が閾値以上か」だけが分かればよいため、許容できる距離を超えた時点で
+計算を打ち切る。
+"""
+
+# 採点で類似一致とみなす類似度
+SIMILARITY_THRESHOLD = 0.8
+
+def _pattern_masks(pattern):
+    """文字ごとに pattern 中の出現位置のビットを立てた表"""
+    masks = {}
+    for i, char in enumerate(pattern):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    return masks
+
+def _myers_distance(pattern, text, masks, max_distance):
+    """
+    pattern（ビット列側）と text のレーベンシュタイン距離（Hyyrö による Myers の大域版）
+
+    DP表の1列を pattern の長さのビット列（縦方向の差分 +1 / -1）で表し、text の1文字ごとに
+    列全体をまとめて更新する。列 j の最下段の値 score から、残りの文字数だけ減っても
+    max_distance を超える場合はその時点で max_distance + 1 を返す。
+    """
+    m = len(pattern)
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv = full, 0
+    score = m
+    remaining = len(text)
+    for char in text:
+        remaining -= 1
+        eq = masks.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        if max_distance is not None and score - remaining > max_distance:
+            return max_distance + 1
+        # 大域距離では0行目が 0, 1, 2, ... と増えるため、最上段に +1 を入れる
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv & full
+    return score
+
+def edit_distance(str1, str2, max_distance=None):
+    """
+    レーベンシュタイン距離
+
+    max_distance を指定した場合、距離がそれを超えることが分かった時点で打ち切り、
+    max_distance + 1 を返す（それ以下の場合は正確な距離）。
+    """
+    if str1 == str2:
+        return 0
+    # 短い方をビット列側にする
+    if len(str1) > len(str2):
+        str1, str2 = str2, str1
+    if max_distance is not None and len(str2) - len(str1) > max_distance:
+        return max_distance + 1
+    if not str1:
+        return len(str2)
+    return _myers_distance(str1, str2, _pattern_masks(str1), max_distance)
+
+def similarity(str1, str2):
+    """編集距離ベースの類似度（0.0〜1.0、どちらかが空の場合は 0.0）"""
+    if not str1 or not str2:
+        return 0.0
+    max_length = max(len(str1), len(str2))
+    return max(0.0, 1.0 - edit_distance(str1, str2) / max_length)
+
+def max_distance_for(length, threshold=SIMILARITY_THRESHOLD):
+    """長さ length の文字列で類似度 threshold 以上になる最大の距離（類似度の計算と同じ浮動小数点で判定）"""
+    distance = int(length * (1.0 - threshold))
+    while distance > 0 and 1.0 - distance / length < threshold:
+        distance -= 1
+    while distance < length and 1.0 - (distance + 1) / length >= threshold:
+        distance += 1
+    return distance
+
+def bounded_similarity(str1, str2, threshold=SIMILARITY_THRESHOLD):
+    """類似度が threshold 以上ならその値、満たさない場合は None（距離の計算は途中で打ち切る）"""
+    if not str1 or not str2:
+        return None
+    max_length = max(len(str1), len(str2))
+    limit = max_distance_for(max_length, threshold)
+    distance = edit_distance(str1, str2, limit)
+    if distance > limit:
+        return None
+    return 1.0 - distance / max_length
+
+class AnswerKey:
+    """
+    1問分の正解・許容回答を正規化済みの形で持つ採点キー
+
+    正規化とビット列の表は作成時に一度だけ計算し、回答ごとには利用者の入力だけを
+    正規化して比較する。
+    """
+
+    __slots__ = ('correct', 'acceptable', '_masks')
+
+    def __init__(self, correct_answer, acceptable_answers=None, normalize=None, normalized=False):
+        if normalized:
+            self.correct = correct_answer or ''
+            self.acceptable = frozenset(acceptable_answers or ())
+        else:
+            normalize = normalize or (lambda answer: answer or '')
+            self.correct = normalize(correct_answer)
+            self.acceptable = frozenset(normalize(answer) for answer in acceptable_answers or ())
+        self._masks = _pattern_masks(self.correct)
+
+    def is_exact(self, user_norm):
+        """正解と完全一致"""
+        return user_norm == self.correct
+
+    def is_acceptable(self, user_norm):
+        """許容回答のいずれかと一致"""
+        return user_norm in self.acceptable
+
+    def similarity(self, user_norm, threshold=SIMILARITY_THRESHOLD):
+        """正解との類似度が threshold 以上ならその値、満たさない場合は None"""
+        correct = self.correct
+        if not correct or not user_norm:
+            return None
+        max_length = max(len(correct), len(user_norm))
+        limit = max_distance_for(max_length, threshold)
+        if abs(len(correct) - len(user_norm)) > limit:
+            return None
+        if len(correct) <= len(user_norm):
+            distance = _myers_distance(correct, user_norm, self._masks, limit)
+        else:
+            distance = edit_distance(correct, user_norm, limit)
+        if distance > limit:
+            return None
+        return 1.0 - distance / max_length
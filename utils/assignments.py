@@ -0,0 +1,214 @@
+"""
+教材割り当て（textbook_assignments）関連のユーティリティ
+"""
+
+import json
+from datetime import date, datetime
+from utils.db import get_db_connection, get_db_cursor, get_placeholder
+from utils.study_utils import simple_cache, clear_user_cache
+
+# 割り当ての種類ごとの単元テーブル（列とダッシュボードでの並び順）
+UNIT_QUERIES = {
+    'input': ('input_units', 'id, name, chapter_number, description', 'chapter_number, name, id'),
+    'choice': ('choice_units', 'id, name, unit_number', 'unit_number, name, id')
+}
+
+# 割り当てと単元の対応（assignment_details）を引くためのインデックス
+ASSIGNMENT_INDEX_SQL = [
+    "CREATE INDEX IF NOT EXISTS idx_textbook_assignments_user ON textbook_assignments(user_id, is_active, assigned_at);",
+    "CREATE INDEX IF NOT EXISTS idx_assignment_details_assignment ON assignment_details(assignment_id, unit_id);",
+    "CREATE INDEX IF NOT EXISTS idx_assignment_details_unit ON assignment_details(unit_id, assignment_id);"
+]
+
+def normalize_unit_ids(unit_ids):
+    """単元IDを整数にし、数値でないものと重複を除く（順序は保つ）"""
+    parsed = []
+    for unit_id in unit_ids:
+        try:
+            parsed.append(int(unit_id))
+        except (TypeError, ValueError):
+            continue
+    return list(dict.fromkeys(parsed))
+
+def parse_unit_ids(units):
+    """units 列（単元IDのJSON配列）をIDのリストに変換（壊れている場合は空）"""
+    if not units:
+        return []
+    try:
+        unit_ids = json.loads(units)
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(unit_ids, list):
+        return []
+    return normalize_unit_ids(unit_ids)
+
+def get_unit_type(assignment_type):
+    """割り当ての種類から単元テーブルの種類を決める（input 以外は choice_units を参照）"""
+    return 'input' if assignment_type == 'input' else 'choice'
+
+def unit_type_condition(unit_type):
+    """textbook_assignments（別名 ta）を単元の種類で絞り込む条件"""
+    return "ta.assignment_type = 'input'" if unit_type == 'input' else "ta.assignment_type <> 'input'"
+
+def create_assignment_indexes(cur):
+    """割り当て関連のインデックスを作成"""
+    for index_sql in ASSIGNMENT_INDEX_SQL:
+        cur.execute(index_sql)
+
+def sync_assignment_units(cur, assignment_id, unit_ids):
+    """
+    割り当ての単元を assignment_details に書き込む（units 列と二重書き込みする）
+
+    既存の単元行を置き換えるため、同じ割り当てに何度呼んでも重複しない。
+    chunk_start などの単元以外の行には触れない。
+    """
+    placeholder = get_placeholder()
+    unit_ids = normalize_unit_ids(unit_ids or [])
+    cur.execute(
+        f'DELETE FROM assignment_details WHERE assignment_id = {placeholder} AND unit_id IS NOT NULL',
+        (assignment_id,)
+    )
+    if unit_ids:
+        cur.executemany(
+            f'INSERT INTO assignment_details (assignment_id, unit_id) VALUES ({placeholder}, {placeholder})',
+            [(assignment_id, unit_id) for unit_id in unit_ids]
+        )
+    return len(unit_ids)
+
+def backfill_assignment_details(cur, batch_size=500):
+    """
+    units 列（JSON）にしか単元がない既存の割り当てを assignment_details に移す
+
+    単元行が1つもない割り当てだけを対象にするため、何度実行してもよい。
+    戻り値: {'assignments': 移行した割り当て数, 'units': 追加した単元行数}
+    """
+    cur.execute('''
+        SELECT ta.id, ta.units
+        FROM textbook_assignments ta
+        WHERE ta.units IS NOT NULL AND ta.units <> ''
+          AND NOT EXISTS (
+              SELECT 1 FROM assignment_details ad
+              WHERE ad.assignment_id = ta.id AND ad.unit_id IS NOT NULL
+          )
+        ORDER BY ta.id
+    ''')
+    pending = [(row[0], parse_unit_ids(row[1])) for row in cur.fetchall()]
+
+    placeholder = get_placeholder()
+    rows = [
+        (assignment_id, unit_id)
+        for assignment_id, unit_ids in pending
+        for unit_id in unit_ids
+    ]
+    for i in range(0, len(rows), batch_size):
+        cur.executemany(
+            f'INSERT INTO assignment_details (assignment_id, unit_id) VALUES ({placeholder}, {placeholder})',
+            rows[i:i + batch_size]
+        )
+    return {'assignments': sum(1 for _, unit_ids in pending if unit_ids), 'units': len(rows)}
+
+def to_cacheable(value):
+    """日時はキャッシュ（SQLiteバックエンドはJSON）に載せられるよう文字列にする"""
+    if isinstance(value, (datetime, date)):
+        return str(value)
+    return value
+
+def fetch_assignment_units(cur, unit_type, where=None, params=()):
+    """
+    assignment_details と単元テーブルを結合して {割り当てID: [単元dict, ...]} を返す
+
+    where は textbook_assignments（別名 ta）に対する追加の条件で、割り当ての種類ごとに
+    1回のクエリで対象の割り当てすべての単元を表示順に取得する。
+    """
+    conditions = [unit_type_condition(unit_type)] + ([where] if where else [])
+    table, columns, order_by = UNIT_QUERIES[unit_type]
+    unit_columns = ', '.join(f'u.{column.strip()}' for column in columns.split(','))
+    unit_order = ', '.join(f'u.{column.strip()}' for column in order_by.split(','))
+    cur.execute(f'''
+        SELECT ad.assignment_id, {unit_columns}
+        FROM textbook_assignments ta
+        JOIN assignment_details ad ON ad.assignment_id = ta.id
+        JOIN {table} u ON u.id = ad.unit_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY ad.assignment_id, {unit_order}
+    ''', params)
+    names = [column[0] for column in cur.description][1:]
+    units_by_assignment = {}
+    for row in cur.fetchall():
+        unit = {name: to_cacheable(value) for name, value in zip(names, row[1:])}
+        units_by_assignment.setdefault(row[0], []).append(unit)
+    return units_by_assignment
+
+@simple_cache(expire_time=300)
+def get_dashboard_assignments(user_id):
+    """
+    ダッシュボードに表示する有効な割り当てと単元の一覧を取得
+
+    割り当て1回 + 単元の種類ごとに1回（assignment_details との結合）のクエリで組み立てる。
+    結果は利用者ごとにキャッシュし、割り当ての変更時に invalidate_assignment_cache で無効化する。
+    日時は文字列のまま返す。
+    """
+    placeholder = get_placeholder()
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            # 割り当てられた教材を取得
+            cur.execute(f'''
+                SELECT ta.id, ta.textbook_id, ta.assignment_type, ta.chunks,
+                       ta.assigned_at, ta.expires_at,
+                       CASE
+                           WHEN ta.assignment_type = 'input' THEN it.name
+                           WHEN ta.assignment_type = 'choice' THEN ct.source
+                       END as textbook_name,
+                       CASE
+                           WHEN ta.assignment_type = 'input' THEN it.subject
+                           WHEN ta.assignment_type = 'choice' THEN '選択問題'
+                       END as subject
+                FROM textbook_assignments ta
+                LEFT JOIN input_textbooks it ON ta.textbook_id = it.id AND ta.assignment_type = 'input'
+                LEFT JOIN choice_textbooks ct ON ta.textbook_id = ct.id AND ta.assignment_type = 'choice'
+                WHERE ta.user_id = {placeholder} AND ta.is_active = TRUE
+                ORDER BY ta.assigned_at DESC
+            ''', (str(user_id),))
+            names = [column[0] for column in cur.description]
+            assignments = [{name: to_cacheable(value) for name, value in zip(names, row)} for row in cur.fetchall()]
+
+            unit_types = {get_unit_type(assignment['assignment_type']) for assignment in assignments}
+            units = {}
+            for unit_type in unit_types:
+                units.update(fetch_assignment_units(
+                    cur, unit_type,
+                    f'ta.user_id = {placeholder} AND ta.is_active = TRUE', (str(user_id),)
+                ))
+
+    for assignment in assignments:
+        assignment['unit_details'] = units.get(assignment['id'], [])
+    return assignments
+
+def get_unit_assignees(unit_id, assignment_type='input', active_only=True):
+    """
+    単元が割り当てられている生徒の一覧を取得
+
+    assignment_details(unit_id, assignment_id) のインデックスから引くため、割り当て全体を走査しない。
+    """
+    placeholder = get_placeholder()
+    conditions = [f'ad.unit_id = {placeholder}', unit_type_condition(get_unit_type(assignment_type))]
+    if active_only:
+        conditions.append('ta.is_active = TRUE')
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            cur.execute(f'''
+                SELECT ta.id as assignment_id, ta.user_id, u.username, u.full_name, u.grade,
+                       ta.textbook_id, ta.assignment_type, ta.is_active, ta.assigned_at, ta.expires_at
+                FROM assignment_details ad
+                JOIN textbook_assignments ta ON ta.id = ad.assignment_id
+                JOIN users u ON u.id = ta.user_id
+                WHERE {' AND '.join(conditions)}
+                ORDER BY u.username, ta.id
+            ''', (unit_id,))
+            names = [column[0] for column in cur.description]
+            return [{name: to_cacheable(value) for name, value in zip(names, row)} for row in cur.fetchall()]
+
+def invalidate_assignment_cache(user_id):
+    """割り当ての変更時にダッシュボード（と利用者の学習キャッシュ）を無効化"""
+    if user_id is not None:
+        clear_user_cache(user_id)
@@ -0,0 +1,265 @@
+"""
+SQLiteデータベースのオンラインバックアップ（スナップショット）ユーティリティ
+
+稼働中のDBファイルをそのままコピーするとWALの内容が反映されない・書き込み途中の
+ページが混ざるなどで壊れたコピーになりうるため、sqlite3 の backup API で一貫した
+スナップショットを作ってから送信・保存する。
+"""
+
+import glob
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 圧縮方式 -> (拡張子, MIMEタイプ)
+COMPRESSIONS = {
+    'none': ('', 'application/octet-stream'),
+    'gzip': ('.gz', 'application/gzip'),
+    'zstd': ('.zst', 'application/zstd')
+}
+
+class _TooManyRestarts(Exception):
+    pass
+
+def is_compression_available(compression):
+    """圧縮方式が使えるか（zstd は zstandard パッケージが必要）"""
+    if compression not in COMPRESSIONS:
+        return False
+    return compression != 'zstd' or zstandard is not None
+
+def create_snapshot(db_path, dest_path, pages=1024, sleep=0.005, max_restarts=3):
+    """
+    稼働中のDBから一貫したスナップショットを dest_path に作成
+
+    pages ページずつコピーし、ステップの間はロックを手放すため書き込みを止めない。
+    コピー中に他の接続から書き込まれるとバックアップは最初からやり直しになるため、
+    max_restarts 回やり直した場合は残りを1ステップでコピーする
+    （WALモードでは読み取りトランザクションとして扱われるので、この場合も書き込みは止まらない）。
+    戻り値: {'pages', 'steps', 'restarts', 'bytes', 'seconds'}
+    """
+    stats = {'pages': 0, 'steps': 0, 'restarts': 0}
+    started = time.perf_counter()
+    last_remaining = [None]
+
+    def progress(status, remaining, total):
+        stats['steps'] += 1
+        stats['pages'] = total
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            stats['restarts'] += 1
+            if stats['restarts'] > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining[0] = remaining
+
+    source = sqlite3.connect(db_path, timeout=30)
+    try:
+        dest = sqlite3.connect(dest_path)
+        try:
+            try:
+                source.backup(dest, pages=pages, progress=progress, sleep=sleep)
+            except _TooManyRestarts:
+                source.backup(dest, pages=-1)
+        finally:
+            dest.close()
+    finally:
+        source.close()
+
+    stats['bytes'] = os.path.getsize(dest_path)
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    return stats
+
+def iter_compressed(path, compression='none', chunk_size=1024 * 1024):
+    """ファイルを chunk_size ずつ読みながら圧縮して返す（全体をメモリに置かない）"""
+    if compression == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip形式
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd圧縮には zstandard パッケージが必要です')
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    else:
+        compressor = None
+
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            data = compressor.compress(chunk) if compressor else chunk
+            if data:
+                yield data
+    if compressor:
+        data = compressor.flush()
+        if data:
+            yield data
+
+def stream_snapshot(db_path, compression='none', temp_dir=None, **options):
+    """
+    スナップショットを一時ファイルに作成し、(圧縮しながら返すイテレーター, 統計) を返す
+
+    スナップショットの作成はこの関数の中で終えるため、失敗した場合は送信前に例外になる。
+    一時ファイルは送信が終わるか中断された時点で削除する。
+    """
+    fd, temp_path = tempfile.mkstemp(prefix='snapshot_', suffix='.db', dir=temp_dir)
+    os.close(fd)
+    try:
+        stats = create_snapshot(db_path, temp_path, **options)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    def generate():
+        try:
+            yield from iter_compressed(temp_path, compression)
+        finally:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+
+    return generate(), stats
+
+def snapshot_prefix(db_path):
+    """スナップショットのファイル名の接頭辞（例: flashcards_）"""
+    return os.path.splitext(os.path.basename(db_path))[0] + '_'
+
+def list_snapshots(db_path, backup_dir):
+    """保存済みのスナップショットを古い順に取得"""
+    pattern = os.path.join(backup_dir, snapshot_prefix(db_path) + '*.db*')
+    return sorted(path for path in glob.glob(pattern) if not path.endswith('.partial'))
+
+def rotate_snapshots(db_path, backup_dir, keep):
+    """新しいものから keep 個を残して古いスナップショットを削除し、削除したパスを返す"""
+    snapshots = list_snapshots(db_path, backup_dir)
+    removed = snapshots[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+def write_snapshot(db_path, backup_dir, compression='gzip', keep=7, **options):
+    """
+    スナップショットを backup_dir に保存してローテーションする
+
+    書き込み途中のファイルは .partial として置き、完成してから名前を変える。
+    戻り値: 統計（保存先のパス・削除した古いスナップショットを含む）
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    extension = COMPRESSIONS[compression][0]
+    filename = f"{snapshot_prefix(db_path)}{datetime.now().strftime('%Y%m%d_%H%M%S')}.db{extension}"
+    path = os.path.join(backup_dir, filename)
+    partial_path = path + '.partial'
+
+    chunks, stats = stream_snapshot(db_path, compression, temp_dir=backup_dir, **options)
+    try:
+        with open(partial_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial_path, path)
+    except Exception:
+        chunks.close()
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    stats['path'] = path
+    stats['compressed_bytes'] = os.path.getsize(path)
+    stats['removed'] = rotate_snapshots(db_path, backup_dir, keep)
+    return stats
+
+class SnapshotScheduler:
+    """
+    一定間隔でスナップショットを保存してローテーションするバックグラウンドスレッド
+
+    複数のワーカープロセスで起動しても、ロックファイルと最新スナップショットの時刻を
+    確認するため、間隔ごとに1つだけ作成される。
+    """
+
+    def __init__(self, app, db_path, backup_dir, interval, keep=7, compression='gzip', check_interval=60.0):
+        self.app = app
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.keep = keep
+        self.compression = compression
+        self.check_interval = min(check_interval, interval)
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'snapshots': 0, 'failures': 0, 'last_path': None, 'last_seconds': None, 'last_error': None}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='snapshot-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                self.run_if_due()
+            except Exception as e:
+                with self._lock:
+                    self._stats['failures'] += 1
+                    self._stats['last_error'] = str(e)
+                self.app.logger.error(f"定期スナップショットの作成エラー: {e}")
+
+    def _is_due(self):
+        snapshots = list_snapshots(self.db_path, self.backup_dir)
+        if not snapshots:
+            return True
+        return time.time() - os.path.getmtime(snapshots[-1]) >= self.interval
+
+    def run_if_due(self):
+        """前回のスナップショットから interval 秒以上経っていれば作成（作成した場合は統計を返す）"""
+        if not self._is_due():
+            return None
+        os.makedirs(self.backup_dir, exist_ok=True)
+        with open(os.path.join(self.backup_dir, '.snapshot.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None  # 他のプロセスが作成中
+            # ロック待ちの間に他のプロセスが作成した場合
+            if not self._is_due():
+                return None
+            stats = write_snapshot(self.db_path, self.backup_dir, self.compression, self.keep)
+        with self._lock:
+            self._stats['snapshots'] += 1
+            self._stats['last_path'] = stats['path']
+            self._stats['last_seconds'] = stats['seconds']
+            self._stats['last_error'] = None
+        self.app.logger.info(
+            f"スナップショットを保存しました: {stats['path']} ({stats['compressed_bytes']:,} bytes, "
+            f"{stats['seconds']}秒, 削除: {len(stats['removed'])}件)"
+        )
+        return stats
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['interval_seconds'] = self.interval
+        stats['keep'] = self.keep
+        stats['compression'] = self.compression
+        stats['backup_dir'] = self.backup_dir
+        return stats
@@ -0,0 +1,269 @@
+"""
+キャッシュ関連のユーティリティ
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class MemoryCache:
+    """
+    プロセス内のTTL付きLRUキャッシュ（タグによる一括無効化に対応）
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (期限, 値, タグ)
+        self._tags = {}  # tag -> set(key)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            for tag in entry[2]:
+                keys = self._tags.get(tag)
+                if keys:
+                    keys.discard(key)
+                    if not keys:
+                        del self._tags[tag]
+
+    def get(self, key):
+        """値を取得（ない場合は _MISSING）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return _MISSING
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def set(self, key, value, ttl, tags=()):
+        """値を保存（上限を超えた場合は最も古く使われたものから削除）"""
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_tag(self, tag):
+        """タグに紐づくエントリを全て削除"""
+        with self._lock:
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            self._stats['invalidations'] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        stats['backend'] = 'memory'
+        stats['max_entries'] = self.max_entries
+        return stats
+
+
+class SQLiteCache:
+    """
+    ローカルのSQLiteファイルを使った共有キャッシュ（複数ワーカー間で共有・無効化できる）
+
+    値はJSONで保存するため、JSONにできない値はキャッシュしない。
+    """
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_tags (
+                tag TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (tag, key)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_tags_key ON cache_tags(key)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_entries_access ON cache_entries(last_access)')
+        conn.commit()
+
+    def _conn(self):
+        """スレッドごとの接続を取得（fork後は作り直す）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def get(self, key):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute('SELECT value, expires_at FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self._count('misses')
+            return _MISSING
+        if row[1] <= now:
+            self.delete(key)
+            self._count('expirations')
+            self._count('misses')
+            return _MISSING
+        conn.execute('UPDATE cache_entries SET last_access = ? WHERE key = ?', (now, key))
+        conn.commit()
+        self._count('hits')
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl, tags=()):
+        try:
+            encoded = json.dumps(value, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)',
+                (key, encoded, now + ttl, now)
+            )
+            conn.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+            conn.executemany('INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)', [(tag, key) for tag in tags])
+            # 上限を超えた分は最終アクセスが古い順に削除（LRU）
+            evicted = conn.execute('''
+                DELETE FROM cache_entries WHERE key IN (
+                    SELECT key FROM cache_entries ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,)).rowcount
+            if evicted > 0:
+                conn.execute('DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache_entries)')
+                self._count('evictions', evicted)
+
+    def delete(self, key):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+            conn.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+
+    def invalidate_tag(self, tag):
+        conn = self._conn()
+        with conn:
+            removed = conn.execute(
+                'DELETE FROM cache_entries WHERE key IN (SELECT key FROM cache_tags WHERE tag = ?)', (tag,)
+            ).rowcount
+            conn.execute('DELETE FROM cache_tags WHERE tag = ?', (tag,))
+        self._count('invalidations', max(removed, 0))
+        return removed
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM cache_entries')
+            conn.execute('DELETE FROM cache_tags')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['size'] = self._conn().execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        stats['backend'] = 'sqlite'
+        stats['max_entries'] = self.max_entries
+        return stats
+
+
+class SharedInvalidations:
+    """
+    プロセス内キャッシュを複数ワーカーで無効化するための共有の記録（ローカルのSQLiteファイル）
+
+    キーごとに無効化した時刻を記録し、各ワーカーはキャッシュした時刻より後に
+    無効化されたエントリを使わない（同じホストのワーカー間でのみ共有される）。
+    keep 秒より古い記録は、それより前にキャッシュしたエントリが期限切れのため削除する。
+    """
+
+    ALL = '*'
+
+    def __init__(self, path, keep=3600):
+        self.path = path
+        self.keep = keep
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_invalidations (
+                key TEXT PRIMARY KEY,
+                invalidated_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+
+    def _conn(self):
+        """スレッドごとの接続を取得（fork後は作り直す）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def invalidate(self, key=None):
+        """key（None の場合は全件）を無効化したことを記録"""
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_invalidations (key, invalidated_at) VALUES (?, ?)',
+                (self.ALL if key is None else key, now)
+            )
+            conn.execute('DELETE FROM cache_invalidations WHERE invalidated_at < ?', (now - self.keep,))
+
+    def is_valid(self, key, cached_at):
+        """cached_at（time.time()）にキャッシュしたエントリが、その後に無効化されていないか"""
+        row = self._conn().execute(
+            'SELECT MAX(invalidated_at) FROM cache_invalidations WHERE key IN (?, ?)', (key, self.ALL)
+        ).fetchone()
+        return row[0] is None or row[0] < cached_at
+
+
+def create_cache(backend='memory', path=None, max_entries=1000):
+    """設定に応じたキャッシュを作成"""
+    if backend == 'sqlite':
+        return SQLiteCache(path or 'cache.db', max_entries=max_entries)
+    return MemoryCache(max_entries=max_entries)
@@ -2,10 +2,11 @@
 語彙関連のユーティリティ関数
 """
 
-import re
 from datetime import datetime
 from flask import current_app
 from utils.db import get_db_connection, get_db_cursor
+from utils.normalization import normalize_input_answer
+from utils.answer_matching import SIMILARITY_THRESHOLD, AnswerKey, edit_distance, similarity
 
 def get_vocabulary_chunk_progress(user_id, source, chapter_id, chunk_number):
     """英単語チャンクの進捗状況を取得"""
@@ -48,81 +49,29 @@ def update_vocabulary_chunk_progress(user_id, source, chapter_id, chunk_number,
         raise
 
 def normalize_answer(answer):
-    """回答を正規化"""
-    if not answer:
-        return ""
-    
-    # 小文字に変換
-    normalized = answer.lower()
-    
-    # 余分な空白を削除
-    normalized = re.sub(r'\s+', ' ', normalized).strip()
-    
-    # 句読点を削除
-    normalized = re.sub(r'[、。，．]', '', normalized)
-    
-    # 括弧とその中身を削除
-    normalized = re.sub(r'[（(].*?[）)]', '', normalized)
-    
-    return normalized
+    """回答を正規化（入力問題の規則）"""
+    return normalize_input_answer(answer)
 
-def check_answer(user_answer, correct_answer, acceptable_answers=None):
-    """回答をチェック"""
+def check_answer(user_answer, correct_answer, acceptable_answers=None, answer_key=None):
+    """回答をチェック（answer_key に正規化済みの AnswerKey を渡すと正解側の正規化を省略）"""
     normalized_user = normalize_answer(user_answer)
-    normalized_correct = normalize_answer(correct_answer)
+    if answer_key is None:
+        answer_key = AnswerKey(correct_answer, acceptable_answers, normalize_answer)
     
-    # 完全一致
-    if normalized_user == normalized_correct:
+    # 完全一致・許容回答
+    if answer_key.is_exact(normalized_user) or answer_key.is_acceptable(normalized_user):
         return True, 1.0
     
-    # 許容回答がある場合
-    if acceptable_answers:
-        for acceptable in acceptable_answers:
-            normalized_acceptable = normalize_answer(acceptable)
-            if normalized_user == normalized_acceptable:
-                return True, 1.0
-    
-    # 類似度を計算
-    similarity = calculate_similarity(normalized_user, normalized_correct)
-    
-    # 80%以上の類似度で正解とする
-    return similarity >= 0.8, similarity
+    # 80%以上の類似度で正解とする（距離が閾値を超えた時点で打ち切る）
+    similarity = answer_key.similarity(normalized_user, SIMILARITY_THRESHOLD)
+    if similarity is not None:
+        return True, similarity
+    return False, calculate_similarity(normalized_user, answer_key.correct)
 
 def calculate_similarity(str1, str2):
     """文字列の類似度を計算（レーベンシュタイン距離ベース）"""
-    if not str1 or not str2:
-        return 0.0
-    
-    # レーベンシュタイン距離を計算
-    distance = levenshtein_distance(str1, str2)
-    
-    # 類似度を計算（距離が小さいほど類似度が高い）
-    max_length = max(len(str1), len(str2))
-    if max_length == 0:
-        return 1.0
-    
-    similarity = 1.0 - (distance / max_length)
-    return max(0.0, similarity)
+    return similarity(str1, str2)
 
 def levenshtein_distance(str1, str2):
     """レーベンシュタイン距離を計算"""
-    len1, len2 = len(str1), len(str2)
-    
-    # 動的計画法で距離を計算
-    dp = [[0] * (len2 + 1) for _ in range(len1 + 1)]
-    
-    # 初期化
-    for i in range(len1 + 1):
-        dp[i][0] = i
-    for j in range(len2 + 1):
-        dp[0][j] = j
-    
-    # 距離を計算
-    for i in range(1, len1 + 1):
-        for j in range(1, len2 + 1):
-            if str1[i-1] == str2[j-1]:
-                dp[i][j] = dp[i-1][j-1]
-            else:
-                dp[i][j] = min(dp[i-1][j], dp[i][j-1], dp[i-1][j-1]) + 1
-    
-    return dp[len1][len2] 
\ No newline at end of file
+    return edit_distance(str1, str2)
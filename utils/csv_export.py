@@ -0,0 +1,131 @@
+"""
+CSVエクスポート用のユーティリティ
+
+クエリ結果を少しずつ読み出してCSVのチャンクとして返すため、
+行数に関係なく一定のメモリでダウンロードできる。
+"""
+
+import csv
+import io
+import os
+import uuid
+import zipfile
+from flask import Response, current_app, stream_with_context
+from utils.db import get_db_connection, get_db_cursor
+
+CSV_BOM = b'\xef\xbb\xbf'
+
+def iter_query(sql, params=(), batch_size=2000):
+    """
+    読み取りクエリの結果を1行ずつ返す
+
+    PostgreSQLでは名前付き（サーバーサイド）カーソルで batch_size 行ずつ取り寄せ、
+    SQLiteでは fetchmany で少しずつ読み出す。ジェネレーターが閉じられた時点で接続を返却する。
+    """
+    with get_db_connection() as conn:
+        if os.getenv('DB_TYPE', 'sqlite') == 'sqlite':
+            cur = conn.cursor()
+        else:
+            cur = conn.cursor(name=f'csv_export_{uuid.uuid4().hex}')
+            cur.itersize = batch_size
+        try:
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cur.close()
+            # 名前付きカーソルのトランザクションを閉じてからプールに返す
+            conn.rollback()
+
+def get_table_columns(table):
+    """テーブルの列名を取得（存在しない場合は None）"""
+    try:
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                cur.execute(f'SELECT * FROM {table} LIMIT 0')
+                return [column[0] for column in cur.description]
+    except Exception:
+        return None
+
+def stream_csv(header, rows, bom=True, chunk_size=64 * 1024):
+    """ヘッダーと行からCSVのバイト列を chunk_size 程度ずつ返す（BOM付きUTF-8で文字化けを防ぐ）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if bom:
+        yield CSV_BOM
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+class _ZipSink:
+    """ZipFile の書き込み先（シークできないストリームとして書き込まれた分を溜める）"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_zip(entries):
+    """
+    (ファイル名, バイト列のイテレーター) のリストからZIPファイルを少しずつ返す
+
+    各ファイルの中身も圧縮しながら順に流すため、全体をメモリやディスクに置かない。
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, chunks in entries:
+            with archive.open(name, 'w', force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+    # 残りのデータとセントラルディレクトリ
+    data = sink.drain()
+    if data:
+        yield data
+
+def streaming_download(chunks, filename, mimetype='text/csv; charset=utf-8'):
+    """
+    チャンクのイテレーターをダウンロード用のレスポンスとして返す
+
+    送信途中でエラーになった場合はステータスを変えられないため、ログを残して接続を切る。
+    """
+    def generate():
+        try:
+            for chunk in chunks:
+                if chunk:
+                    yield chunk
+        except Exception as e:
+            current_app.logger.error(f"エクスポートの送信エラー: {filename}, error={e}")
+            raise
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}',
+            # リバースプロキシでバッファリングせずにそのまま流す
+            'X-Accel-Buffering': 'no'
+        }
+    )
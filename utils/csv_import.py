@@ -0,0 +1,142 @@
+"""
+CSV一括インポート用のユーティリティ
+"""
+
+import csv
+import io
+import os
+from flask import current_app
+from utils.db import get_placeholder
+
+class RowError(ValueError):
+    """CSVの1行が取り込めない場合のエラー（エラーレポートに行番号付きで記録する）"""
+    pass
+
+def open_csv_stream(file):
+    """
+    アップロードファイルをテキストストリームとして開く
+
+    全体を read() せずに少しずつデコードする（utf-8-sig で先頭のBOMも除去される）。
+    アップロードファイル（FileStorage）のほか、バイナリモードで開いたファイルも受け付ける。
+    """
+    return io.TextIOWrapper(getattr(file, 'stream', file), encoding='utf-8-sig', newline='')
+
+def iter_csv_rows(file):
+    """CSVの行を (行番号, 列のリスト) として順に返す（行番号は1始まり、ヘッダー行を含む）"""
+    for row_num, row in enumerate(csv.reader(open_csv_stream(file)), 1):
+        yield row_num, row
+
+def iter_csv_dicts(file):
+    """ヘッダー付きCSVの行を (行番号, dict) として順に返す（データ行は2行目から）"""
+    for row_num, row in enumerate(csv.DictReader(open_csv_stream(file)), 2):
+        yield row_num, row
+
+class CsvImporter:
+    """
+    検証済みの行をバッチでまとめて書き込むインポーター
+
+    SQLiteでは executemany、PostgreSQLでは COPY FROM STDIN で書き込む。
+    バッチ単位でセーブポイントを切り、失敗したバッチは1行ずつ書き直して
+    エラーになった行だけをエラーレポートに残す。コミットは呼び出し元で行う。
+
+    SQLite はトランザクションの外で SAVEPOINT を切るとそれがトランザクションになり、
+    RELEASE でコミットされてしまうため、最初のバッチの前に BEGIN でトランザクションを開始する
+    （途中で失敗・キャンセルした場合に呼び出し元のロールバックで全体が取り消されるようにする）。
+    """
+
+    def __init__(self, cur, table, columns, batch_size=1000, max_errors=200):
+        self.cur = cur
+        self.table = table
+        self.columns = tuple(columns)
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.use_copy = os.getenv('DB_TYPE', 'sqlite') != 'sqlite'
+        self.success_count = 0
+        self.error_count = 0
+        self.errors = []
+        self._batch = []
+
+    def add(self, row_num, values):
+        """書き込む行（列順のタプル）を追加"""
+        self._batch.append((row_num, tuple(values)))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def error(self, row_num, message):
+        """取り込めなかった行を記録（レポートは max_errors 件まで）"""
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row_num, 'error': str(message)})
+
+    def flush(self):
+        """溜まっている行を書き込む"""
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        self._begin()
+        self.cur.execute('SAVEPOINT csv_import_batch')
+        try:
+            self._write([values for _, values in batch])
+            self.cur.execute('RELEASE SAVEPOINT csv_import_batch')
+            self.success_count += len(batch)
+        except Exception as e:
+            self.cur.execute('ROLLBACK TO SAVEPOINT csv_import_batch')
+            self.cur.execute('RELEASE SAVEPOINT csv_import_batch')
+            current_app.logger.warning(f"CSV一括書き込みに失敗したため1行ずつ再試行します: table={self.table}, rows={len(batch)}, error={e}")
+            self._write_one_by_one(batch)
+
+    def _begin(self):
+        """SQLite: トランザクションが始まっていなければ開始する（PostgreSQL は常にトランザクション内）"""
+        if not self.use_copy and not self.cur.connection.in_transaction:
+            self.cur.execute('BEGIN')
+
+    def _write_one_by_one(self, batch):
+        """失敗したバッチを1行ずつ書き込み、エラー行を特定する"""
+        for row_num, values in batch:
+            self.cur.execute('SAVEPOINT csv_import_row')
+            try:
+                self._write([values])
+                self.cur.execute('RELEASE SAVEPOINT csv_import_row')
+                self.success_count += 1
+            except Exception as e:
+                self.cur.execute('ROLLBACK TO SAVEPOINT csv_import_row')
+                self.cur.execute('RELEASE SAVEPOINT csv_import_row')
+                self.error(row_num, e)
+
+    def _write(self, rows):
+        if self.use_copy:
+            self._copy(rows)
+        else:
+            placeholder = get_placeholder()
+            self.cur.executemany(
+                f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES ({', '.join([placeholder] * len(self.columns))})",
+                rows
+            )
+
+    def _copy(self, rows):
+        """COPY FROM STDIN（CSV形式）で書き込む。NULLは \\N で表し、空文字と区別する"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([
+                '\\N' if value is None else ('true' if value is True else 'false' if value is False else value)
+                for value in row
+            ])
+        buffer.seek(0)
+        self.cur.copy_expert(
+            f"COPY {self.table} ({', '.join(self.columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+
+    def finish(self):
+        """残りを書き込んで結果（件数とエラーレポート）を返す"""
+        self.flush()
+        return self.report()
+
+    def report(self):
+        return {
+            'success_count': self.success_count,
+            'error_count': self.error_count,
+            'errors': sorted(self.errors, key=lambda error: error['row']),
+            'errors_truncated': self.error_count > len(self.errors)
+        }
@@ -1,10 +1,344 @@
 import sqlite3
 # PostgreSQL関連のインポート
 import psycopg2
+import psycopg2.pool
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
 from contextlib import contextmanager
 from flask import current_app
 import os
+import threading
+import time
+
+
+class PostgresConnectionPool:
+    """
+    プロセス共通のPostgreSQL接続プール
+
+    psycopg2.pool.ThreadedConnectionPoolをラップし、以下を追加する
+    - 最大接続数に達した場合は acquire_timeout 秒まで空きを待つ
+    - 貸し出し時のヘルスチェック（一定時間アイドルだった接続のみ SELECT 1）
+    - 壊れた接続の破棄と再接続
+    - プール枯渇などのメトリクス
+    """
+
+    def __init__(self, minconn, maxconn, acquire_timeout=10.0, healthcheck_interval=30.0, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._connect_kwargs = connect_kwargs
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._stats = {
+            'borrowed': 0,
+            'returned': 0,
+            'in_use': 0,
+            'peak_in_use': 0,
+            'exhausted': 0,
+            'wait_count': 0,
+            'wait_time_total': 0.0,
+            'healthcheck_failures': 0,
+            'reconnects': 0,
+        }
+
+    def _is_healthy(self, conn):
+        """接続が使用可能かチェック（アイドル時間が短い接続はチェックを省略）"""
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """プールから接続を借りる"""
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['wait_count'] += 1
+            if not self._slots.acquire(timeout=self.acquire_timeout):
+                with self._lock:
+                    self._stats['exhausted'] += 1
+                raise psycopg2.pool.PoolError(
+                    f"接続プールが枯渇しました（max={self.maxconn}, timeout={self.acquire_timeout}s）"
+                )
+            with self._lock:
+                self._stats['wait_time_total'] += time.monotonic() - started
+
+        try:
+            conn = self._pool.getconn()
+            if not self._is_healthy(conn):
+                # 壊れた接続は破棄して新しい接続を作り直す
+                with self._lock:
+                    self._stats['healthcheck_failures'] += 1
+                self._discard(conn)
+                conn = self._pool.getconn()
+                with self._lock:
+                    self._stats['reconnects'] += 1
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats['borrowed'] += 1
+            self._stats['in_use'] += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._stats['in_use'])
+        return conn
+
+    def _discard(self, conn):
+        """接続をプールから取り除いて閉じる"""
+        self._last_used.pop(id(conn), None)
+        try:
+            self._pool.putconn(conn, close=True)
+        except Exception:
+            pass
+
+    def putconn(self, conn, close=False):
+        """接続をプールに返却（未完了のトランザクションはロールバックする）"""
+        try:
+            if not close and not conn.closed:
+                try:
+                    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except Exception:
+                    close = True
+            if close or conn.closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self._stats['returned'] += 1
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+    def closeall(self):
+        """全ての接続を閉じる"""
+        self._last_used.clear()
+        self._pool.closeall()
+
+    def stats(self):
+        """プールのメトリクスを取得"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['minconn'] = self.minconn
+        stats['maxconn'] = self.maxconn
+        stats['idle'] = len(self._pool._pool)
+        return stats
+
+
+class SQLiteConnectionPool:
+    """
+    プロセス共通のSQLite接続キャッシュ
+
+    PRAGMAの設定は接続作成時に1回だけ行い、使い終わった接続はLIFOで再利用する
+    （直前に使われた接続ほどページキャッシュが温まっている）。
+    ネストしたget_db_connection()には別の接続を渡すため、従来と同じ分離性を保つ。
+    """
+
+    def __init__(self, db_path, max_idle=8, timeout=30.0, cache_size=10000, mmap_size=268435456):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._stats = {
+            'borrowed': 0,
+            'in_use': 0,
+            'peak_in_use': 0,
+            'connects': 0,
+            'reused': 0,
+            'discarded': 0,
+        }
+
+    def _connect(self):
+        """新しい接続を作成してPRAGMAを設定"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # 辞書形式でアクセス可能にする
+        # WALモードを有効にして同時アクセスを改善
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # ページキャッシュ（正: ページ数、負: KiB）とメモリマップI/O
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        # 外部キー制約を有効にする
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def getconn(self):
+        """キャッシュから接続を借りる（なければ新規作成）"""
+        conn = None
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork後は親プロセスの接続を使わない
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                conn = self._idle.pop()
+                self._stats['reused'] += 1
+        if conn is None:
+            conn = self._connect()
+            with self._lock:
+                self._stats['connects'] += 1
+        with self._lock:
+            self._stats['borrowed'] += 1
+            self._stats['in_use'] += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._stats['in_use'])
+        return conn
+
+    def putconn(self, conn, close=False):
+        """接続を返却（未完了のトランザクションはロールバックする）"""
+        try:
+            if not close:
+                try:
+                    if conn.in_transaction:
+                        conn.rollback()
+                except sqlite3.Error:
+                    close = True
+            with self._lock:
+                if not close and len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    conn = None
+                else:
+                    self._stats['discarded'] += 1
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+
+    def closeall(self):
+        """キャッシュ中の接続を全て閉じる"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        """キャッシュのメトリクスを取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        stats['max_idle'] = self.max_idle
+        stats['cache_size'] = self.cache_size
+        stats['mmap_size'] = self.mmap_size
+        return stats
+
+
+_sqlite_pools = {}
+_sqlite_pools_lock = threading.Lock()
+
+def get_sqlite_pool(db_path):
+    """
+    SQLite接続キャッシュを取得（DBファイルごとに1つ）
+    """
+    pool = _sqlite_pools.get(db_path)
+    if pool is None:
+        with _sqlite_pools_lock:
+            pool = _sqlite_pools.get(db_path)
+            if pool is None:
+                pool = SQLiteConnectionPool(
+                    db_path,
+                    max_idle=int(os.getenv('SQLITE_POOL_MAX_IDLE', 8)),
+                    timeout=float(os.getenv('SQLITE_BUSY_TIMEOUT', 30.0)),
+                    cache_size=int(os.getenv('SQLITE_CACHE_SIZE', 10000)),
+                    mmap_size=int(os.getenv('SQLITE_MMAP_SIZE', 268435456)),
+                )
+                _sqlite_pools[db_path] = pool
+    return pool
+
+def close_sqlite_pools():
+    """全てのSQLite接続キャッシュを閉じる（DBファイルの置き換え前などに使用）"""
+    with _sqlite_pools_lock:
+        pools = list(_sqlite_pools.values())
+        _sqlite_pools.clear()
+    for pool in pools:
+        pool.closeall()
+
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+
+def get_pg_pool():
+    """
+    PostgreSQL接続プールを取得（初回呼び出し時にアプリ設定から作成）
+    """
+    global _pg_pool
+    if _pg_pool is None:
+        with _pg_pool_lock:
+            if _pg_pool is None:
+                config = current_app.config
+                _pg_pool = PostgresConnectionPool(
+                    minconn=int(config.get('DB_POOL_MIN_SIZE', 1)),
+                    maxconn=int(config.get('DB_POOL_MAX_SIZE', 10)),
+                    acquire_timeout=float(config.get('DB_POOL_ACQUIRE_TIMEOUT', 10.0)),
+                    healthcheck_interval=float(config.get('DB_POOL_HEALTHCHECK_INTERVAL', 30.0)),
+                    host=config.get('DB_HOST'),
+                    port=config.get('DB_PORT'),
+                    database=config.get('DB_NAME'),
+                    user=config.get('DB_USER'),
+                    password=config.get('DB_PASSWORD'),
+                    connect_timeout=int(config.get('DB_CONNECT_TIMEOUT', 10)),
+                )
+                current_app.logger.info(
+                    f"PostgreSQL接続プール作成: min={_pg_pool.minconn}, max={_pg_pool.maxconn}"
+                )
+    return _pg_pool
+
+def close_pg_pool():
+    """PostgreSQL接続プールを閉じる"""
+    global _pg_pool
+    with _pg_pool_lock:
+        if _pg_pool is not None:
+            _pg_pool.closeall()
+            _pg_pool = None
+
+# fork（gunicorn の preload など）で親プロセスから引き継いだ接続は子プロセスでは使わない。
+# 閉じると同じソケットを使う親の接続まで切断されるため、参照だけ残して子プロセスでは作り直す
+_inherited_pools = []
+
+def _reset_pools_after_fork():
+    global _pg_pool, _pg_pool_lock, _sqlite_pools_lock
+    if _pg_pool is not None:
+        _inherited_pools.append(_pg_pool)
+    _inherited_pools.extend(_sqlite_pools.values())
+    _pg_pool = None
+    _sqlite_pools.clear()
+    # fork 時に他のスレッドが持っていたロックは子プロセスで解放されないため作り直す
+    _pg_pool_lock = threading.Lock()
+    _sqlite_pools_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+def get_pool_stats():
+    """接続プールのメトリクスを取得（プール未作成の場合はNone）"""
+    if os.getenv('DB_TYPE', 'sqlite') == 'sqlite':
+        pool = _sqlite_pools.get(os.path.abspath(os.getenv('DB_PATH', 'flashcards.db')))
+    else:
+        pool = _pg_pool
+    if pool is None:
+        return None
+    return pool.stats()
 
 @contextmanager
 def get_db_connection():
@@ -14,60 +348,46 @@ def get_db_connection():
     db_type = os.getenv('DB_TYPE', 'sqlite')
     
     if db_type == 'sqlite':
-        # SQLite接続
+        # SQLite接続（PRAGMA設定済みの接続をキャッシュから借りる）
         db_path = os.path.abspath(os.getenv('DB_PATH', 'flashcards.db'))
+        pool = get_sqlite_pool(db_path)
         conn = None
+        broken = False
         try:
-            conn = sqlite3.connect(db_path, timeout=30.0)  # タイムアウトを30秒に設定
-            conn.row_factory = sqlite3.Row  # 辞書形式でアクセス可能にする
-            # WALモードを有効にして同時アクセスを改善
-            conn.execute("PRAGMA journal_mode=WAL")
-            conn.execute("PRAGMA synchronous=NORMAL")
-            conn.execute("PRAGMA cache_size=10000")
-            conn.execute("PRAGMA temp_store=MEMORY")
-            # 外部キー制約を有効にする
-            conn.execute("PRAGMA foreign_keys=ON")
+            conn = pool.getconn()
             yield conn
         except Exception as e:
             if conn:
                 try:
                     conn.rollback()
                 except:
-                    pass
+                    broken = True
             current_app.logger.error(f"SQLite接続エラー: {e}")
             raise
         finally:
             if conn:
-                try:
-                    conn.close()
-                except:
-                    pass
+                pool.putconn(conn, close=broken)
     else:
-        # PostgreSQL接続
-        DB_HOST = current_app.config.get('DB_HOST')
-        DB_PORT = current_app.config.get('DB_PORT')
-        DB_NAME = current_app.config.get('DB_NAME')
-        DB_USER = current_app.config.get('DB_USER')
-        DB_PASSWORD = current_app.config.get('DB_PASSWORD')
-        
+        # PostgreSQL接続（プールから借りる）
+        pool = get_pg_pool()
         conn = None
+        broken = False
         try:
-            conn = psycopg2.connect(
-                host=DB_HOST, port=DB_PORT, database=DB_NAME,
-                user=DB_USER, password=DB_PASSWORD
-            )
+            conn = pool.getconn()
             yield conn
         except Exception as e:
             if conn:
+                # 接続断の場合は返却時に破棄して次回再接続させる
+                broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
                 try:
                     conn.rollback()
                 except:
-                    pass
+                    broken = True
             current_app.logger.error(f"PostgreSQL接続エラー: {e}")
             raise
         finally:
             if conn:
-                conn.close() 
+                pool.putconn(conn, close=broken)
 
 @contextmanager
 def get_db_cursor(conn, cursor_factory=None):
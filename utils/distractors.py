@@ -0,0 +1,205 @@
+"""
+選択問題の誤答選択肢（ディストラクター）の生成
+
+単元ごとに他の問題の正解を一度だけ読み込んでメモリに持ち、選択肢を作るたびに
+単元全体を ORDER BY RANDOM() で並べ替えないようにする。
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from utils.db import get_db_connection, get_db_cursor, get_placeholder
+from utils.choice_utils import normalize_answer, calculate_similarity
+
+# この類似度以上の候補は正解と紛らわしい（採点で正解扱いになる）ため選択肢にしない
+SIMILARITY_THRESHOLD = 0.8
+
+def parse_exclude_numbers(exclude):
+    """除外する問題番号（カンマ区切り）を解析"""
+    if not exclude:
+        return set()
+    return {int(x.strip()) for x in str(exclude).split(',') if x.strip().isdigit()}
+
+class UnitDistractors:
+    """1単元分の候補（重複を除いた正解の一覧）"""
+
+    def __init__(self, unit_id, questions):
+        self.unit_id = unit_id
+        self.questions = questions
+        self.built_at = time.monotonic()
+        numbers_by_answer = OrderedDict()
+        normalized_by_answer = {}
+        for question in questions:
+            answer = question['correct_answer']
+            if answer:
+                numbers_by_answer.setdefault(answer, set()).add(question['question_number'])
+                if question.get('correct_answer_norm') is not None:
+                    normalized_by_answer[answer] = question['correct_answer_norm']
+        # (正解, 正規化した正解, 問題番号の集合)。登録時に正規化した値があればそれを使う
+        self.entries = [
+            (answer, normalized_by_answer.get(answer) or normalize_answer(answer), numbers)
+            for answer, numbers in numbers_by_answer.items()
+        ]
+
+    def _is_candidate(self, entry, normalized_correct, exclude_numbers, chosen):
+        answer, normalized, numbers = entry
+        if answer in chosen:
+            return False
+        # 同じ正解の問題がすべて除外されている場合のみ除く
+        if exclude_numbers and numbers <= exclude_numbers:
+            return False
+        return calculate_similarity(normalized, normalized_correct) < SIMILARITY_THRESHOLD
+
+    def sample(self, correct_answer, k, exclude_numbers=None, rng=random):
+        """
+        正解と紛らわしくない候補を最大 k 個選ぶ
+
+        ランダムな位置の候補を試して採用する方式のため、条件を満たす候補が多い通常の単元では
+        単元の大きさに関係なく O(k) で済む。試行回数の上限に達した場合のみ全候補から選ぶ。
+        """
+        exclude_numbers = exclude_numbers or set()
+        normalized_correct = normalize_answer(correct_answer)
+        chosen = {correct_answer}
+        picked = []
+        tried = set()
+        size = len(self.entries)
+        attempts = 4 * k + 8
+        while len(picked) < k and len(tried) < size and attempts > 0:
+            attempts -= 1
+            index = rng.randrange(size)
+            if index in tried:
+                continue
+            tried.add(index)
+            entry = self.entries[index]
+            if self._is_candidate(entry, normalized_correct, exclude_numbers, chosen):
+                chosen.add(entry[0])
+                picked.append(entry[0])
+
+        if len(picked) < k and len(tried) < size:
+            rest = [
+                self.entries[index] for index in range(size)
+                if index not in tried
+            ]
+            rng.shuffle(rest)
+            for entry in rest:
+                if len(picked) >= k:
+                    break
+                if self._is_candidate(entry, normalized_correct, exclude_numbers, chosen):
+                    chosen.add(entry[0])
+                    picked.append(entry[0])
+        return picked
+
+    def choices_for(self, correct_answer, count, exclude_numbers=None, rng=random):
+        """正解を先頭にした選択肢（誤答はシャッフル済み）。候補が1つもない場合は None"""
+        distractors = self.sample(correct_answer, count - 1, exclude_numbers, rng)
+        if not distractors:
+            return None
+        rng.shuffle(distractors)
+        return [correct_answer] + distractors
+
+class DistractorPool:
+    """
+    単元ごとの候補をプロセス内に保持するキャッシュ
+
+    問題を追加・変更した場合は invalidate で破棄する。他のワーカープロセスでの変更は
+    ttl 秒で読み直されて反映される。
+    """
+
+    def __init__(self, ttl=600, max_units=200):
+        self.ttl = ttl
+        self.max_units = max_units
+        self._units = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'builds': 0, 'invalidations': 0}
+
+    def _load(self, unit_id):
+        placeholder = get_placeholder()
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                cur.execute(f'''
+                    SELECT id, correct_answer, question_number, correct_answer_norm
+                    FROM questions
+                    WHERE unit_id = {placeholder} AND is_active = TRUE
+                    ORDER BY question_number, id
+                ''', (unit_id,))
+                questions = [
+                    {'id': row[0], 'correct_answer': row[1], 'question_number': row[2], 'correct_answer_norm': row[3]}
+                    for row in cur.fetchall()
+                ]
+        return UnitDistractors(unit_id, questions)
+
+    def get(self, unit_id):
+        """単元の候補を取得（なければ読み込む）"""
+        with self._lock:
+            unit = self._units.get(unit_id)
+            if unit and time.monotonic() - unit.built_at < self.ttl:
+                self._units.move_to_end(unit_id)
+                self._stats['hits'] += 1
+                return unit
+
+        # 読み込みはロックの外で行う（同時に読み込んだ場合は後から来た方で上書きする）
+        unit = self._load(unit_id)
+        with self._lock:
+            self._units[unit_id] = unit
+            self._units.move_to_end(unit_id)
+            self._stats['builds'] += 1
+            while len(self._units) > self.max_units:
+                self._units.popitem(last=False)
+        return unit
+
+    def invalidate(self, unit_id=None):
+        """単元の候補を破棄（unit_id を省略すると全単元）"""
+        with self._lock:
+            if unit_id is None:
+                self._units.clear()
+            else:
+                self._units.pop(unit_id, None)
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['units'] = len(self._units)
+            stats['entries'] = sum(len(unit.entries) for unit in self._units.values())
+        stats['ttl'] = self.ttl
+        stats['max_units'] = self.max_units
+        return stats
+
+def get_distractor_pool():
+    """アプリに登録された候補キャッシュを取得"""
+    return current_app.extensions.get('distractor_pool')
+
+def _get_unit(unit_id):
+    pool = get_distractor_pool()
+    if pool is None:
+        # キャッシュ未登録（スクリプトなど）の場合はその場で読み込む
+        return DistractorPool()._load(unit_id)
+    return pool.get(unit_id)
+
+def generate_choices(unit_id, correct_answer, count, exclude=''):
+    """同じ単元の他の問題の正解から選択肢を生成（正解が先頭）"""
+    unit = _get_unit(unit_id)
+    return unit.choices_for(correct_answer, count, parse_exclude_numbers(exclude))
+
+def generate_unit_choices(unit_id, count, exclude=''):
+    """単元のすべての問題について選択肢をまとめて生成（候補の読み込みは1回）"""
+    unit = _get_unit(unit_id)
+    exclude_numbers = parse_exclude_numbers(exclude)
+    return [
+        {
+            'question_id': question['id'],
+            'question_number': question['question_number'],
+            'correct_answer': question['correct_answer'],
+            'choices': unit.choices_for(question['correct_answer'], count, exclude_numbers)
+        }
+        for question in unit.questions
+        if question['correct_answer']
+    ]
+
+def invalidate_unit_distractors(unit_id=None):
+    """問題の変更時に単元の候補を破棄"""
+    pool = get_distractor_pool()
+    if pool is not None:
+        pool.invalidate(unit_id)
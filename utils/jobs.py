@@ -0,0 +1,544 @@
+"""
+管理画面の重い処理（CSV取り込み・データ復元・整合性チェックなど）を
+バックグラウンドで実行するジョブランナー
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from utils.db import get_db_connection, get_db_cursor, get_placeholder
+from utils.normalization import get_column_names
+
+BACKGROUND_JOBS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS background_jobs (
+        id TEXT PRIMARY KEY,
+        job_type TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        params TEXT,
+        progress_current INTEGER NOT NULL DEFAULT 0,
+        progress_total INTEGER,
+        message TEXT,
+        result TEXT,
+        error TEXT,
+        cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+        created_by INTEGER,
+        worker_pid INTEGER,
+        worker_host TEXT,
+        upload_path TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+BACKGROUND_JOBS_INDEX_SQL = (
+    'CREATE INDEX IF NOT EXISTS idx_background_jobs_status '
+    'ON background_jobs(status, created_at)'
+)
+
+# ジョブの状態（queued → running → succeeded / failed / cancelled）
+ACTIVE_STATUSES = ('queued', 'running')
+
+# ジョブの種類ごとの処理（register_job で登録）
+JOB_HANDLERS = {}
+
+def create_jobs_table(cur):
+    """ジョブ管理テーブルとインデックスを作成（後から追加した列がない既存のテーブルには列を追加）"""
+    cur.execute(BACKGROUND_JOBS_TABLE_SQL)
+    cur.execute(BACKGROUND_JOBS_INDEX_SQL)
+    existing = get_column_names(cur, 'background_jobs')
+    for column in ('worker_host', 'upload_path'):
+        if column not in existing:
+            cur.execute(f'ALTER TABLE background_jobs ADD COLUMN {column} TEXT')
+
+def discard_upload(path):
+    """ジョブ用のアップロードファイルを削除（既に削除済みの場合は何もしない）"""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def register_job(job_type):
+    """
+    ジョブの処理を登録するデコレータ
+
+    処理は handler(job, **params) の形で呼ばれ、戻り値（JSONにできる値）が結果として保存される。
+    job は JobContext で、進捗の報告とキャンセルの確認に使う。
+    """
+    def decorator(func):
+        JOB_HANDLERS[job_type] = func
+        return func
+    return decorator
+
+class JobCancelled(Exception):
+    """ジョブがキャンセルされた（処理中に check_cancelled() から送出される）"""
+    pass
+
+class JobContext:
+    """
+    実行中のジョブから進捗の報告とキャンセルの確認を行うためのオブジェクト
+
+    進捗のDB書き込みとキャンセルフラグの読み込みは progress_interval 秒に1回までに間引く。
+    """
+
+    def __init__(self, runner, job_id, cancel_event):
+        self.runner = runner
+        self.job_id = job_id
+        self._cancel_event = cancel_event
+        self._last_sync = 0.0
+        self.current = 0
+        self.total = None
+        self.message = None
+
+    def progress(self, current, total=None, message=None, force=False):
+        """進捗を報告（current / total、メッセージは任意）"""
+        self.current = current
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+        now = time.monotonic()
+        if not force and now - self._last_sync < self.runner.progress_interval:
+            return
+        self._last_sync = now
+        if self.runner._sync_progress(self.job_id, self.current, self.total, self.message):
+            self._cancel_event.set()
+
+    def is_cancelled(self):
+        """キャンセルが要求されているか（他のワーカープロセスからの要求もDB経由で検知する）"""
+        if self._cancel_event.is_set():
+            return True
+        now = time.monotonic()
+        if now - self._last_sync >= self.runner.progress_interval:
+            self._last_sync = now
+            if self.runner._sync_progress(self.job_id, self.current, self.total, self.message):
+                self._cancel_event.set()
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """キャンセルが要求されていれば JobCancelled を送出（DBの変更は呼び出し元でロールバックされる）"""
+        if self.is_cancelled():
+            raise JobCancelled()
+
+class JobRunner:
+    """
+    スレッドプールでジョブを実行し、状態を background_jobs テーブルに記録する
+
+    リクエストは submit() でジョブを登録してすぐにレスポンスを返し、
+    状態は /admin/jobs/<id> から確認する。ジョブの処理はアプリケーションコンテキスト内で実行される。
+    プロセスが終了して途中で止まったジョブは、次回起動時に失敗として記録し直す。
+    受け持ちのジョブは heartbeat_interval 秒ごとに updated_at を更新する。同じホストのジョブは
+    プロセスの有無で、他のホスト（同じPostgreSQLを使う別のコンテナなど）のジョブは
+    updated_at が stale_after 秒より古いかどうかで中断されたと判断する。
+    submit() の upload_path に渡したファイル（save_upload で保存したCSVなど）は、ジョブが終了・キャンセル
+    された時、キュー待ちのままプロセスが終了した時、中断として回収された時にランナーが削除する。
+    """
+
+    def __init__(self, app, max_workers=2, progress_interval=0.5, upload_dir='job_uploads',
+                 heartbeat_interval=60.0, stale_after=600.0):
+        self.app = app
+        self.max_workers = max_workers
+        self.progress_interval = progress_interval
+        self.upload_dir = upload_dir
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = max(stale_after, heartbeat_interval * 3)
+        self.hostname = socket.gethostname()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job-runner')
+        self._cancel_events = {}
+        self._futures = {}
+        self._uploads = {}
+        self._lock = threading.Lock()
+        self._heartbeat_thread = None
+        self._stop_event = threading.Event()
+        self._table_ready = False
+        self._stats = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'cancelled': 0, 'recovered': 0}
+
+    def _ensure_table(self):
+        """初回利用時にテーブルを作成し、中断されたジョブを回収する"""
+        if self._table_ready:
+            return
+        with self._lock:
+            if self._table_ready:
+                return
+            with get_db_connection() as conn:
+                with get_db_cursor(conn) as cur:
+                    create_jobs_table(cur)
+                conn.commit()
+            self._table_ready = True
+        self.recover_interrupted()
+
+    def submit(self, job_type, params=None, user_id=None, upload_path=None):
+        """ジョブを登録して実行キューに積み、ジョブIDを返す（upload_path はジョブの終了後に削除する）"""
+        if job_type not in JOB_HANDLERS:
+            raise KeyError(f'未登録のジョブです: {job_type}')
+        self._ensure_table()
+        params = dict(params or {})
+        job_id = uuid.uuid4().hex
+        placeholder = get_placeholder()
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                cur.execute(f'''
+                    INSERT INTO background_jobs
+                        (id, job_type, status, params, created_by, worker_pid, worker_host, upload_path)
+                    VALUES ({placeholder}, {placeholder}, 'queued', {placeholder}, {placeholder}, {placeholder},
+                            {placeholder}, {placeholder})
+                ''', (job_id, job_type, json.dumps(params, ensure_ascii=False, default=str), user_id,
+                      os.getpid(), self.hostname, upload_path))
+            conn.commit()
+
+        cancel_event = threading.Event()
+        with self._lock:
+            self._cancel_events[job_id] = cancel_event
+            if upload_path:
+                self._uploads[job_id] = upload_path
+            self._stats['submitted'] += 1
+        self._start_heartbeat()
+        future = self._executor.submit(self._run, job_id, job_type, params, cancel_event)
+        with self._lock:
+            if not future.done():
+                self._futures[job_id] = future
+        self.app.logger.info(f"ジョブを登録しました: id={job_id}, type={job_type}")
+        return job_id
+
+    def _run(self, job_id, job_type, params, cancel_event):
+        with self.app.app_context():
+            try:
+                outcome = self._execute(job_id, job_type, params, cancel_event)
+            except Exception as e:
+                # 状態の記録自体に失敗した場合（DB停止など）はログだけ残す
+                self.app.logger.error(f"ジョブの状態更新エラー: id={job_id}, error={e}")
+                outcome = 'failed'
+            finally:
+                with self._lock:
+                    self._cancel_events.pop(job_id, None)
+                    self._futures.pop(job_id, None)
+                    upload_path = self._uploads.pop(job_id, None)
+                # 成功・失敗・キャンセル（キュー待ちの間の取り消しを含む）のいずれでも削除する
+                discard_upload(upload_path)
+            if outcome:
+                with self._lock:
+                    self._stats[outcome] += 1
+
+    def _execute(self, job_id, job_type, params, cancel_event):
+        placeholder = get_placeholder()
+        # キャンセル済み（キュー待ちの間に取り消された）なら開始しない
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                cur.execute(f'''
+                    UPDATE background_jobs
+                    SET status = 'running', started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = {placeholder} AND status = 'queued'
+                ''', (job_id,))
+                started = cur.rowcount > 0
+            conn.commit()
+        if not started:
+            return None
+
+        job = JobContext(self, job_id, cancel_event)
+        started_at = time.perf_counter()
+        try:
+            result = JOB_HANDLERS[job_type](job, **params)
+        except JobCancelled:
+            self._finish(job_id, 'cancelled', job, message='キャンセルされました')
+            self.app.logger.info(f"ジョブがキャンセルされました: id={job_id}, type={job_type}")
+            return 'cancelled'
+        except Exception as e:
+            self._finish(job_id, 'failed', job, error=str(e))
+            self.app.logger.error(f"ジョブ実行エラー: id={job_id}, type={job_type}, error={e}")
+            return 'failed'
+
+        if job.total is not None:
+            job.current = job.total
+        self._finish(job_id, 'succeeded', job, result=result)
+        self.app.logger.info(f"ジョブ完了: id={job_id}, type={job_type}, {time.perf_counter() - started_at:.2f}秒")
+        return 'succeeded'
+
+    def _finish(self, job_id, status, job, result=None, error=None, message=None):
+        placeholder = get_placeholder()
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                cur.execute(f'''
+                    UPDATE background_jobs
+                    SET status = {placeholder}, progress_current = {placeholder}, progress_total = {placeholder},
+                        message = COALESCE({placeholder}, message), result = {placeholder}, error = {placeholder},
+                        finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = {placeholder}
+                ''', (status, job.current, job.total, message,
+                      json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                      error, job_id))
+            conn.commit()
+
+    def _sync_progress(self, job_id, current, total, message):
+        """進捗を書き込み、キャンセル要求の有無を返す"""
+        placeholder = get_placeholder()
+        try:
+            with get_db_connection() as conn:
+                with get_db_cursor(conn) as cur:
+                    cur.execute(f'''
+                        UPDATE background_jobs
+                        SET progress_current = {placeholder}, progress_total = {placeholder},
+                            message = {placeholder}, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = {placeholder}
+                    ''', (current, total, message, job_id))
+                    cur.execute(f'SELECT cancel_requested FROM background_jobs WHERE id = {placeholder}', (job_id,))
+                    row = cur.fetchone()
+                conn.commit()
+        except Exception as e:
+            # 進捗の記録に失敗してもジョブ自体は続ける
+            self.app.logger.warning(f"ジョブの進捗更新エラー: id={job_id}, error={e}")
+            return False
+        return bool(row and row[0])
+
+    def cancel(self, job_id):
+        """
+        ジョブのキャンセルを要求
+
+        キュー待ちのジョブはその場で取り消す。実行中のジョブは check_cancelled() を
+        呼んだ時点で停止する（確認を行わない処理は最後まで実行される）。
+        """
+        self._ensure_table()
+        with self._lock:
+            cancel_event = self._cancel_events.get(job_id)
+        if cancel_event is not None:
+            cancel_event.set()
+
+        placeholder = get_placeholder()
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                cur.execute(f'''
+                    UPDATE background_jobs SET cancel_requested = TRUE, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = {placeholder} AND status IN ('queued', 'running')
+                ''', (job_id,))
+                cur.execute(f'''
+                    UPDATE background_jobs
+                    SET status = 'cancelled', message = 'キャンセルされました',
+                        finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = {placeholder} AND status = 'queued'
+                ''', (job_id,))
+                cancelled_queued = cur.rowcount > 0
+                upload_path = None
+                if cancelled_queued:
+                    with self._lock:
+                        self._stats['cancelled'] += 1
+                    cur.execute(f'SELECT upload_path FROM background_jobs WHERE id = {placeholder}', (job_id,))
+                    row = cur.fetchone()
+                    upload_path = row[0] if row else None
+            conn.commit()
+        # キュー待ちのまま取り消したジョブは処理が実行されないため、ここでアップロードを削除する
+        discard_upload(upload_path)
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """ジョブの状態を取得（存在しない場合は None）"""
+        self._ensure_table()
+        placeholder = get_placeholder()
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                cur.execute(f'''
+                    SELECT id, job_type, status, params, progress_current, progress_total, message,
+                           result, error, cancel_requested, created_by, created_at, started_at, finished_at, updated_at
+                    FROM background_jobs WHERE id = {placeholder}
+                ''', (job_id,))
+                row = cur.fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_jobs(self, limit=20):
+        """最近のジョブを新しい順に取得"""
+        self._ensure_table()
+        placeholder = get_placeholder()
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                cur.execute(f'''
+                    SELECT id, job_type, status, params, progress_current, progress_total, message,
+                           result, error, cancel_requested, created_by, created_at, started_at, finished_at, updated_at
+                    FROM background_jobs ORDER BY created_at DESC, id LIMIT {placeholder}
+                ''', (limit,))
+                rows = cur.fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    @staticmethod
+    def _to_dict(row):
+        def loads(value):
+            if value is None:
+                return None
+            try:
+                return json.loads(value)
+            except (TypeError, ValueError):
+                return value
+
+        current, total = row[4] or 0, row[5]
+        return {
+            'id': row[0],
+            'job_type': row[1],
+            'status': row[2],
+            'params': loads(row[3]),
+            'progress_current': current,
+            'progress_total': total,
+            'progress_percent': round(min(current / total, 1.0) * 100, 1) if total else None,
+            'message': row[6],
+            'result': loads(row[7]),
+            'error': row[8],
+            'cancel_requested': bool(row[9]),
+            'created_by': row[10],
+            'created_at': str(row[11]) if row[11] else None,
+            'started_at': str(row[12]) if row[12] else None,
+            'finished_at': str(row[13]) if row[13] else None,
+            'updated_at': str(row[14]) if row[14] else None,
+            'is_finished': row[2] not in ACTIVE_STATUSES
+        }
+
+    def _start_heartbeat(self):
+        """受け持ちのジョブの updated_at を定期的に更新するスレッドを開始（プロセスごとに1つ）"""
+        with self._lock:
+            if self._heartbeat_thread and self._heartbeat_thread.is_alive():
+                return
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+            self._heartbeat_thread.start()
+
+    def _heartbeat(self):
+        placeholder = get_placeholder()
+        while not self._stop_event.wait(self.heartbeat_interval):
+            with self._lock:
+                job_ids = list(self._cancel_events)
+            if not job_ids:
+                continue
+            try:
+                with self.app.app_context():
+                    with get_db_connection() as conn:
+                        with get_db_cursor(conn) as cur:
+                            cur.execute(f'''
+                                UPDATE background_jobs SET updated_at = CURRENT_TIMESTAMP
+                                WHERE id IN ({', '.join([placeholder] * len(job_ids))}) AND status IN ('queued', 'running')
+                            ''', job_ids)
+                        conn.commit()
+            except Exception as e:
+                self.app.logger.warning(f"ジョブのハートビート更新エラー: {e}")
+
+    def _is_interrupted(self, pid, host, stale):
+        """未完了のジョブを受け持っていたプロセスが終了しているか"""
+        if host != self.hostname:
+            # 他のホストのプロセスは確認できないため、ハートビートが途絶えているかで判断する
+            return stale
+        if pid is None or pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass  # 他ユーザーの稼働中プロセス
+        return False
+
+    def recover_interrupted(self):
+        """既に終了したプロセスが受け持っていた未完了のジョブを失敗として記録し直す"""
+        placeholder = get_placeholder()
+        if os.getenv('DB_TYPE', 'sqlite') == 'sqlite':
+            stale_before = f"datetime('now', '-{int(self.stale_after)} seconds')"
+        else:
+            stale_before = f"CURRENT_TIMESTAMP - INTERVAL '{int(self.stale_after)} seconds'"
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                cur.execute(f'''
+                    SELECT id, worker_pid, worker_host, upload_path,
+                           CASE WHEN updated_at < {stale_before} THEN 1 ELSE 0 END
+                    FROM background_jobs
+                    WHERE status IN ('queued', 'running')
+                ''')
+                interrupted = [
+                    (job_id, upload_path) for job_id, pid, host, upload_path, stale in cur.fetchall()
+                    if self._is_interrupted(pid, host, bool(stale))
+                ]
+                recovered = 0
+                uploads = []
+                for job_id, upload_path in interrupted:
+                    cur.execute(f'''
+                        UPDATE background_jobs
+                        SET status = 'failed', error = 'プロセスの終了により中断されました',
+                            finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = {placeholder} AND status IN ('queued', 'running')
+                    ''', (job_id,))
+                    if cur.rowcount > 0:
+                        recovered += cur.rowcount
+                        uploads.append(upload_path)
+            conn.commit()
+        # 中断したジョブのアップロード（このホストにあるもの）を削除する
+        for upload_path in uploads:
+            discard_upload(upload_path)
+        if recovered:
+            with self._lock:
+                self._stats['recovered'] += recovered
+            self.app.logger.warning(f"中断されたジョブを失敗として記録しました: {recovered}件")
+        return recovered
+
+    def save_upload(self, file):
+        """アップロードされたファイルをジョブ用の一時ファイルに保存してパスを返す"""
+        os.makedirs(self.upload_dir, exist_ok=True)
+        path = os.path.join(self.upload_dir, f'{uuid.uuid4().hex}.upload')
+        file.save(path)
+        return path
+
+    def shutdown(self):
+        """
+        実行中のジョブにキャンセルを通知し、キュー待ちのジョブを破棄する（atexitから呼ばれる）
+
+        破棄したジョブは失敗として記録し、アップロードを削除する。
+        """
+        self._stop_event.set()
+        with self._lock:
+            for cancel_event in self._cancel_events.values():
+                cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            dropped = [job_id for job_id, future in self._futures.items() if future.cancelled()]
+            uploads = [self._uploads.pop(job_id, None) for job_id in dropped]
+            for job_id in dropped:
+                self._futures.pop(job_id, None)
+                self._cancel_events.pop(job_id, None)
+        for upload_path in uploads:
+            discard_upload(upload_path)
+        if dropped:
+            self._mark_dropped(dropped)
+
+    def _mark_dropped(self, job_ids):
+        """キュー待ちのまま破棄したジョブを失敗として記録（記録できない場合は次回起動時に回収される）"""
+        placeholder = get_placeholder()
+        try:
+            with self.app.app_context():
+                with get_db_connection() as conn:
+                    with get_db_cursor(conn) as cur:
+                        cur.execute(f'''
+                            UPDATE background_jobs
+                            SET status = 'failed', error = 'プロセスの終了により中断されました',
+                                finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                            WHERE id IN ({', '.join([placeholder] * len(job_ids))}) AND status = 'queued'
+                        ''', job_ids)
+                    conn.commit()
+        except Exception as e:
+            self.app.logger.warning(f"破棄したジョブの記録エラー: {e}")
+
+    def stats(self):
+        """ジョブ数などのメトリクスを取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['active'] = len(self._cancel_events)
+        stats['max_workers'] = self.max_workers
+        return stats
+
+def get_job_runner():
+    """アプリに登録されたジョブランナーを取得"""
+    return current_app.extensions.get('job_runner')
+
+def submit_job(job_type, params=None, user_id=None):
+    """ジョブを登録してジョブIDを返す"""
+    runner = get_job_runner()
+    if runner is None:
+        raise RuntimeError('ジョブランナーが初期化されていません')
+    return runner.submit(job_type, params, user_id=user_id)
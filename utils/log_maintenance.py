@@ -0,0 +1,653 @@
+"""
+学習ログ（study_log / study_logs / choice_study_log）の月別パーティション・日別集計・保持期間
+
+ログは追記のみで増え続けるため、created_at の月ごとに分けて古い月をまとめて扱う。
+    PostgreSQL: created_at の RANGE パーティション（月ごと + DEFAULT）。先の月のパーティションは
+                メンテナンスで作成し、保持期間を過ぎた月はパーティションごと DROP する
+    SQLite:     日別に集計済みの月の行を study_log から月別のテーブル（study_log_p202401 など）に移し、
+                保持期間を過ぎた月はテーブルごと DROP する（study_log には最近の行だけが残る）。
+                移した生ログはデータベースのZIPエクスポートには月別テーブルのCSVとして含まれるが、
+                migrate_to_postgresql.py では移行されない（集計の study_log_daily だけが移行される）
+
+study_log の古い日の行は、ユーザー・カード・日ごとの集計（study_log_daily）にまとめる。
+集計済みの日の境界は log_rollup_state に記録し、study_log を全期間で集計する処理は
+「境界より前は study_log_daily、境界以降は study_log」を合わせて読む（RAW_STUDY_LOG_SINCE_SQL）。
+PostgreSQL では境界以降の条件でパーティションが絞り込まれ、古い月は読まれない。
+study_logs / choice_study_log は集計せず、保持期間を過ぎた月の行を削除するだけ。
+
+設定（app.config）:
+    LOG_ROLLUP_AFTER_DAYS           この日数より前の study_log を日別に集計する（既定: 0 = 集計しない）
+                                    SQLite では集計した月の生ログが study_log から月別テーブルに移る
+    LOG_RAW_RETENTION_DAYS          この日数より前の月の生ログを削除する（既定: 0 = 削除しない）
+                                    study_log は集計済みの月だけが対象
+    LOG_PARTITION_MONTHS_AHEAD      PostgreSQL で先に作成しておくパーティションの月数（既定: 3）
+    LOG_MAINTENANCE_INTERVAL_HOURS  メンテナンスの実行間隔（既定: 24、0で定期実行しない）
+
+手動での実行: flask --app app maintain-logs
+PostgreSQL の行のあるテーブルのパーティションへの変換: flask --app app partition-logs（メンテナンスの時間帯に実行）
+"""
+
+import os
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from flask import current_app
+from utils.db import get_db_connection, get_db_cursor, get_placeholder
+from utils.normalization import get_column_names
+from utils.progress import CORRECT_RESULTS
+
+LOG_TABLES = ('study_log', 'study_logs', 'choice_study_log')
+
+STUDY_LOG_DAILY_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS study_log_daily (
+        user_id INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        stage INTEGER NOT NULL,
+        mode TEXT NOT NULL,
+        page_range TEXT NOT NULL DEFAULT '',
+        difficulty TEXT NOT NULL DEFAULT '',
+        card_id INTEGER NOT NULL,
+        day DATE NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        known_count INTEGER NOT NULL DEFAULT 0,
+        unknown_count INTEGER NOT NULL DEFAULT 0,
+        correct_count INTEGER NOT NULL DEFAULT 0,
+        last_id BIGINT,
+        last_result TEXT,
+        PRIMARY KEY (user_id, source, stage, mode, page_range, difficulty, card_id, day)
+    )
+'''
+
+STUDY_LOG_DAILY_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_study_log_daily_user_card ON study_log_daily(user_id, card_id)'
+
+LOG_ROLLUP_STATE_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS log_rollup_state (
+        table_name TEXT PRIMARY KEY,
+        rolled_up_before DATE NOT NULL,
+        rolled_up_rows BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# SQLite で集計・月別テーブルへの移動の範囲を created_at で探すためのインデックス
+# （PostgreSQL はパーティションの絞り込みで足りる）
+LOG_CREATED_AT_INDEX_SQL = [
+    f'CREATE INDEX IF NOT EXISTS idx_{table}_created_at ON {table}(created_at)' for table in LOG_TABLES
+]
+
+# study_log の生の行を読む範囲の下限（これより前の日は study_log_daily に集計済み）
+RAW_STUDY_LOG_SINCE_SQL = (
+    "(SELECT COALESCE(MAX(rolled_up_before), '1970-01-01') FROM log_rollup_state WHERE table_name = 'study_log')"
+)
+
+# 複数のワーカーから同時にメンテナンスしないための PostgreSQL のアドバイザリロックのキー
+LOG_MAINTENANCE_LOCK_KEY = 727002
+
+PARTITION_NAME_PATTERN = re.compile(rf"^({'|'.join(LOG_TABLES)})_(p\d{{6}}|default)$")
+
+def utc_today():
+    """今日の日付（UTC、CURRENT_TIMESTAMP の既定値と合わせる）"""
+    return datetime.now(timezone.utc).date()
+
+def month_start(day):
+    return day.replace(day=1)
+
+def add_months(day, months):
+    """day の月から months か月後の月の初日"""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def to_date(value):
+    """DBの日付・日時（SQLite は文字列）を date に変換"""
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(str(value).strip()[:10])
+
+def partition_name(table, month):
+    """月別のパーティション（SQLite では月別のテーブル）の名前"""
+    return f'{table}_p{month:%Y%m}'
+
+def is_log_partition_name(name):
+    """ログテーブルの月別パーティション・月別テーブル・DEFAULT パーティションの名前か"""
+    return PARTITION_NAME_PATTERN.match(name) is not None
+
+def _parse_months(table, names):
+    pattern = re.compile(rf'^{table}_p(\d{{4}})(\d{{2}})$')
+    months = {}
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            months[name] = date(int(match.group(1)), int(match.group(2)), 1)
+    return dict(sorted(months.items(), key=lambda item: item[1]))
+
+def is_partitioned(cur, table):
+    """PostgreSQL: パーティションテーブルかどうか"""
+    cur.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', (table,))
+    row = cur.fetchone()
+    return row is not None and row[0] == 'p'
+
+def get_month_tables(cur, table):
+    """月別のパーティション（PostgreSQL）または月別テーブル（SQLite）の名前 -> 月の初日（古い順）"""
+    if os.getenv('DB_TYPE', 'sqlite') == 'sqlite':
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?", (f'{table}_p%',))
+    else:
+        cur.execute('''
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+        ''', (table,))
+    return _parse_months(table, [row[0] for row in cur.fetchall()])
+
+def log_index_sql(table):
+    """ログテーブルのインデックス（マイグレーションで作成するインデックスのうちこのテーブルのもの）"""
+    from utils.migrations import MIGRATIONS, CreateIndex
+    return [
+        step.sql for migration in MIGRATIONS for step in migration.steps
+        if isinstance(step, CreateIndex) and step.table == table
+    ]
+
+def create_partition(cur, table, month):
+    """
+    PostgreSQL: 1か月分のパーティションを作成
+
+    DEFAULT パーティションにその月の行がある場合（メンテナンスが止まっていた間の行など）は
+    新しいパーティションに移してから ATTACH する。
+    """
+    name = partition_name(table, month)
+    start, end = month.isoformat(), add_months(month, 1).isoformat()
+    cur.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)')
+    cur.execute(f'''
+        WITH moved AS (
+            DELETE FROM {table}_default WHERE created_at >= %s AND created_at < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    ''', (start, end))
+    cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+    return name
+
+def get_default_partition_months(cur, table):
+    """PostgreSQL: DEFAULT パーティションに行がある月（古い順）"""
+    cur.execute(f"SELECT DISTINCT CAST(date_trunc('month', created_at) AS DATE) FROM {table}_default ORDER BY 1")
+    return [to_date(row[0]) for row in cur.fetchall()]
+
+def ensure_partitions(cur, table, months_ahead, today=None, since=None):
+    """
+    PostgreSQL: 今月（since を指定した場合はその月）から months_ahead か月後までのパーティションを作成
+
+    DEFAULT パーティションに行がある月（移行したデータやメンテナンスが止まっていた間の行）も
+    月別のパーティションに分け、保持期間の DROP の対象にする。
+    戻り値: 作成したパーティションの名前のリスト
+    """
+    existing = set(get_month_tables(cur, table).values())
+    this_month = month_start(today or utc_today())
+    month = min(month_start(since), this_month) if since else this_month
+    months = set()
+    while month <= add_months(this_month, months_ahead):
+        months.add(month)
+        month = add_months(month, 1)
+    months.update(get_default_partition_months(cur, table))
+    return [create_partition(cur, table, month) for month in sorted(months - existing)]
+
+def convert_to_partitioned(cur, table, months_ahead=3):
+    """
+    PostgreSQL: 既存のログテーブルを created_at の月別パーティションに変換（変換済みの場合は False）
+
+    元のテーブルの名前を変えて同じ列のパーティションテーブルを作成し、全行をコピーしてから削除する。
+    主キーはパーティションキーを含める必要があるため (id, created_at) にする（id は連番のため一意）。
+    """
+    cur.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', (table,))
+    row = cur.fetchone()
+    if row is None or row[0] == 'p':
+        return False
+
+    legacy = f'{table}_unpartitioned'
+    cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+    sequence = cur.fetchone()[0]
+    cur.execute('''
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position
+    ''', (table,))
+    columns = [row[0] for row in cur.fetchall()]
+
+    cur.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+    cur.execute(f'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)')
+    cur.execute(f'ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL')
+    cur.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+    cur.execute(f'SELECT MIN(created_at) FROM {legacy}')
+    ensure_partitions(cur, table, months_ahead, since=to_date(cur.fetchone()[0]))
+
+    # created_at が NULL の行は DEFAULT パーティションに入れる
+    column_list = ', '.join(columns)
+    select_list = ', '.join(
+        "COALESCE(created_at, TIMESTAMP '1970-01-01')" if column == 'created_at' else column for column in columns
+    )
+    cur.execute(f'INSERT INTO {table} ({column_list}) SELECT {select_list} FROM {legacy}')
+    if sequence:
+        cur.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+    cur.execute(f'DROP TABLE {legacy}')
+
+    # 行のコピー後に作成する（パーティションテーブルのインデックスは各パーティションに作成される）
+    cur.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)')
+    for sql in log_index_sql(table):
+        cur.execute(sql)
+    return True
+
+def partition_log_tables(cur):
+    """
+    マイグレーション: PostgreSQL の空のログテーブルを月別パーティションに変換（SQLite では何もしない）
+
+    変換は全行のコピーとインデックスの作成の間、テーブルを ACCESS EXCLUSIVE でロックする
+    （ログの書き込みが止まる）。デプロイ時（init-db）に止めないよう、行のあるテーブルは
+    LOG_PARTITION_CONVERT=1 のときだけ変換し、それ以外はメンテナンスの時間帯に
+    flask --app app partition-logs で変換する（変換前もパーティションなしのまま動作する）。
+    """
+    if os.getenv('DB_TYPE', 'sqlite') == 'sqlite':
+        return
+    months_ahead = int(os.getenv('LOG_PARTITION_MONTHS_AHEAD', 3))
+    convert_all = os.getenv('LOG_PARTITION_CONVERT', '').lower() in ('1', 'true', 'yes')
+    for table in LOG_TABLES:
+        if is_partitioned(cur, table):
+            continue
+        cur.execute(f'SELECT EXISTS (SELECT 1 FROM {table})')
+        if cur.fetchone()[0] and not convert_all:
+            current_app.logger.warning(
+                f"{table} は行があるためパーティションに変換していません"
+                f"（書き込みが止まるため、メンテナンスの時間帯に flask --app app partition-logs で変換してください）"
+            )
+            continue
+        convert_to_partitioned(cur, table, months_ahead)
+
+def convert_log_tables(conn, months_ahead=3, log=None):
+    """
+    PostgreSQL: 行のあるログテーブルも含めて月別パーティションに変換（flask --app app partition-logs）
+
+    テーブルごとにコミットする。変換中はそのテーブルへのログの書き込みが止まるため、
+    メンテナンスの時間帯に実行する（書き込めなかったログはスプールに退避され、後で再投入される）。
+    戻り値: 変換したテーブルのリスト（他のプロセスがメンテナンス中の場合は None）
+    """
+    log = log or (lambda message: None)
+    converted = []
+    with get_db_cursor(conn) as cur:
+        cur.execute('SELECT pg_try_advisory_lock(%s)', (LOG_MAINTENANCE_LOCK_KEY,))
+        locked = cur.fetchone()[0]
+        conn.commit()
+        if not locked:
+            log("⏭️ 他のプロセスがログのメンテナンスを実行中です")
+            return None
+        try:
+            # 実行中のクエリの後ろでロックを待ち続けて書き込みを止めない
+            cur.execute("SET lock_timeout = '10s'")
+            conn.commit()
+            for table in LOG_TABLES:
+                started = time.monotonic()
+                if convert_to_partitioned(cur, table, months_ahead):
+                    conn.commit()
+                    converted.append(table)
+                    log(f"✅ {table} を月別パーティションに変換しました（{time.monotonic() - started:.1f}秒）")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            try:
+                conn.rollback()
+                cur.execute('RESET lock_timeout')
+                cur.execute('SELECT pg_advisory_unlock(%s)', (LOG_MAINTENANCE_LOCK_KEY,))
+                conn.commit()
+            except Exception:
+                pass
+    return converted
+
+def get_rollup_state(cur, table):
+    """集計済みの日の境界（この日より前を集計済み、未集計なら None）と集計した行数"""
+    placeholder = get_placeholder()
+    cur.execute(
+        f'SELECT rolled_up_before, rolled_up_rows FROM log_rollup_state WHERE table_name = {placeholder}',
+        (table,)
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None, 0
+    return to_date(row[0]), int(row[1] or 0)
+
+def save_rollup_state(cur, table, previous, rolled_up_before, rows):
+    """
+    集計済みの境界を previous から rolled_up_before に進める
+
+    他のプロセスが先に進めていた場合は False（呼び出し側でロールバックする）。
+    """
+    placeholder = get_placeholder()
+    if previous is None:
+        cur.execute(f'''
+            INSERT INTO log_rollup_state (table_name, rolled_up_before, rolled_up_rows)
+            VALUES ({placeholder}, {placeholder}, {placeholder})
+            ON CONFLICT (table_name) DO NOTHING
+        ''', (table, rolled_up_before.isoformat(), rows))
+    else:
+        cur.execute(f'''
+            UPDATE log_rollup_state
+            SET rolled_up_before = {placeholder}, rolled_up_rows = rolled_up_rows + {placeholder},
+                updated_at = CURRENT_TIMESTAMP
+            WHERE table_name = {placeholder} AND rolled_up_before = {placeholder}
+        ''', (rolled_up_before.isoformat(), rows, table, previous.isoformat()))
+    return cur.rowcount == 1
+
+def rollup_study_log_range(cur, start, end):
+    """study_log の [start, end) の行をユーザー・カード・日ごとに study_log_daily に集計（集計した行数）"""
+    placeholder = get_placeholder()
+    day_expr = 'DATE(created_at)' if os.getenv('DB_TYPE', 'sqlite') == 'sqlite' else 'CAST(created_at AS DATE)'
+    correct_list = ', '.join(f"'{result}'" for result in CORRECT_RESULTS)
+    params = (start.isoformat(), end.isoformat())
+    # 同じ日を集計し直しても同じ結果になるよう、既存の集計は置き換える
+    # （SQLite の INSERT ... SELECT ... ON CONFLICT は構文の曖昧さを避けるため WHERE が必要）
+    cur.execute(f'''
+        INSERT INTO study_log_daily
+            (user_id, source, stage, mode, page_range, difficulty, card_id, day,
+             attempts, known_count, unknown_count, correct_count, last_id, last_result)
+        SELECT g.user_id, g.source, g.stage, g.mode, g.page_range, g.difficulty, g.card_id, g.day,
+               g.attempts, g.known_count, g.unknown_count, g.correct_count, g.last_id, sl.result
+        FROM (
+            SELECT user_id, source, stage, mode,
+                   COALESCE(page_range, '') AS page_range, COALESCE(difficulty, '') AS difficulty,
+                   card_id, {day_expr} AS day,
+                   COUNT(*) AS attempts,
+                   SUM(CASE WHEN result = 'known' THEN 1 ELSE 0 END) AS known_count,
+                   SUM(CASE WHEN result = 'unknown' THEN 1 ELSE 0 END) AS unknown_count,
+                   SUM(CASE WHEN result IN ({correct_list}) THEN 1 ELSE 0 END) AS correct_count,
+                   MAX(id) AS last_id
+            FROM study_log
+            WHERE created_at >= {placeholder} AND created_at < {placeholder}
+            GROUP BY user_id, source, stage, mode, COALESCE(page_range, ''), COALESCE(difficulty, ''),
+                     card_id, {day_expr}
+        ) g
+        JOIN study_log sl ON sl.id = g.last_id
+        WHERE sl.created_at >= {placeholder} AND sl.created_at < {placeholder}
+        ON CONFLICT (user_id, source, stage, mode, page_range, difficulty, card_id, day) DO UPDATE SET
+            attempts = EXCLUDED.attempts,
+            known_count = EXCLUDED.known_count,
+            unknown_count = EXCLUDED.unknown_count,
+            correct_count = EXCLUDED.correct_count,
+            last_id = EXCLUDED.last_id,
+            last_result = EXCLUDED.last_result
+    ''', params + params)
+    cur.execute(
+        f'SELECT COUNT(*) FROM study_log WHERE created_at >= {placeholder} AND created_at < {placeholder}',
+        params
+    )
+    return int(cur.fetchone()[0])
+
+def rollup_study_log(conn, cur, before):
+    """
+    study_log の before より前の未集計の日を study_log_daily に集計（集計した行数）
+
+    1か月ずつ集計して境界を進め、そのたびにコミットする（途中で止まっても続きから再開できる）。
+    """
+    placeholder = get_placeholder()
+    start, _ = get_rollup_state(cur, 'study_log')
+    total = 0
+    while start is None or start < before:
+        condition = f'created_at < {placeholder}'
+        params = [before.isoformat()]
+        if start is not None:
+            condition += f' AND created_at >= {placeholder}'
+            params.append(start.isoformat())
+        cur.execute(f'SELECT MIN(created_at) FROM study_log WHERE {condition}', params)
+        first = to_date(cur.fetchone()[0])
+        if first is None:
+            # 集計する行がない（未集計で行もない場合は境界を作らない）
+            if start is not None and save_rollup_state(cur, 'study_log', start, before, 0):
+                conn.commit()
+            else:
+                conn.rollback()
+            break
+        end = min(add_months(month_start(first), 1), before)
+        rows = rollup_study_log_range(cur, first, end)
+        if not save_rollup_state(cur, 'study_log', start, end, rows):
+            # 他のプロセスが同じ範囲を集計した
+            conn.rollback()
+            break
+        conn.commit()
+        total += rows
+        start = end
+    return total
+
+def move_to_month_tables(conn, cur, table, before):
+    """
+    SQLite: before の月より前の月の行を月別のテーブル（{table}_p202401 など）に移す（移した行数）
+
+    study_log は集計済みの月だけを移すため、移した行は study_log_daily から読まれる。
+    """
+    boundary = month_start(before).isoformat()
+    columns = [row[1] for row in cur.execute(f'PRAGMA table_info({table})').fetchall()]
+    moved = 0
+    while True:
+        cur.execute(f'SELECT MIN(created_at) FROM {table} WHERE created_at < ?', (boundary,))
+        first = to_date(cur.fetchone()[0])
+        if first is None:
+            break
+        month = month_start(first)
+        name = partition_name(table, month)
+        start, end = month.isoformat(), add_months(month, 1).isoformat()
+        cur.execute(f'CREATE TABLE IF NOT EXISTS {name} AS SELECT * FROM {table} WHERE 0')
+        archived = get_column_names(cur, name)
+        column_list = ', '.join(column for column in columns if column in archived)
+        cur.execute(f'''
+            INSERT INTO {name} ({column_list})
+            SELECT {column_list} FROM {table} WHERE created_at >= ? AND created_at < ?
+        ''', (start, end))
+        cur.execute(f'DELETE FROM {table} WHERE created_at >= ? AND created_at < ?', (start, end))
+        count = cur.rowcount
+        conn.commit()
+        if count <= 0:
+            # 他のプロセスが先に移した、または月の範囲で比較できない created_at
+            break
+        moved += count
+    return moved
+
+def apply_retention(cur, table, cutoff):
+    """
+    cutoff の月より前の月の生ログを削除
+
+    PostgreSQL と SQLite の study_log は月別のパーティション・テーブルごと DROP する。
+    SQLite の study_logs / choice_study_log と、PostgreSQL のパーティションに変換する前のテーブルは行を削除する。
+    戻り値: (DROP した名前のリスト, 削除した行数)
+    """
+    boundary = month_start(cutoff)
+    dropped = []
+    for name, month in get_month_tables(cur, table).items():
+        if add_months(month, 1) <= boundary:
+            cur.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+    deleted = 0
+    if os.getenv('DB_TYPE', 'sqlite') == 'sqlite':
+        if table != 'study_log':
+            cur.execute(f'DELETE FROM {table} WHERE created_at < ?', (boundary.isoformat(),))
+            deleted = max(cur.rowcount, 0)
+    elif not is_partitioned(cur, table):
+        # パーティションに変換する前のテーブル（partition-logs の実行前）は行を削除する
+        cur.execute(f'DELETE FROM {table} WHERE created_at < %s', (boundary.isoformat(),))
+        deleted = max(cur.rowcount, 0)
+    return dropped, deleted
+
+def run_log_maintenance(conn, rollup_after_days=0, retention_days=0, months_ahead=3, today=None, log=None):
+    """
+    パーティションの作成・study_log の日別集計・保持期間を過ぎた生ログの削除
+
+    戻り値: 実行結果の dict（PostgreSQL で他のプロセスが実行中の場合は None）
+    """
+    db_type = os.getenv('DB_TYPE', 'sqlite')
+    today = today or utc_today()
+    log = log or (lambda message: None)
+    stats = {'partitions_created': [], 'rolled_up_rows': 0, 'moved_rows': 0, 'dropped': [], 'deleted_rows': 0}
+    with get_db_cursor(conn) as cur:
+        if db_type != 'sqlite':
+            cur.execute('SELECT pg_try_advisory_lock(%s)', (LOG_MAINTENANCE_LOCK_KEY,))
+            locked = cur.fetchone()[0]
+            conn.commit()
+            if not locked:
+                log("⏭️ 他のプロセスがログのメンテナンスを実行中です")
+                return None
+            # パーティションの作成・削除で親テーブルのロックを待ち続けない
+            cur.execute("SET lock_timeout = '10s'")
+            conn.commit()
+        try:
+            if db_type != 'sqlite':
+                for table in LOG_TABLES:
+                    if is_partitioned(cur, table):
+                        created = ensure_partitions(cur, table, months_ahead, today)
+                        conn.commit()
+                        stats['partitions_created'].extend(created)
+                if stats['partitions_created']:
+                    log(f"✅ パーティションを作成しました: {', '.join(stats['partitions_created'])}")
+
+            if rollup_after_days > 0:
+                stats['rolled_up_rows'] = rollup_study_log(conn, cur, today - timedelta(days=rollup_after_days))
+                rolled_up_before, _ = get_rollup_state(cur, 'study_log')
+                stats['rolled_up_before'] = rolled_up_before.isoformat() if rolled_up_before else None
+                if stats['rolled_up_rows']:
+                    log(f"✅ study_log の {stats['rolled_up_rows']:,}件を日別に集計しました（{stats['rolled_up_before']} より前）")
+                if db_type == 'sqlite' and rolled_up_before is not None:
+                    stats['moved_rows'] = move_to_month_tables(conn, cur, 'study_log', rolled_up_before)
+                    if stats['moved_rows']:
+                        log(f"✅ 集計済みの study_log {stats['moved_rows']:,}件を月別テーブルに移しました")
+
+            if retention_days > 0:
+                cutoff = today - timedelta(days=retention_days)
+                for table in LOG_TABLES:
+                    table_cutoff = cutoff
+                    if table == 'study_log':
+                        # 集計していない生ログは削除しない
+                        rolled_up_before, _ = get_rollup_state(cur, 'study_log')
+                        if rolled_up_before is None:
+                            continue
+                        table_cutoff = min(cutoff, rolled_up_before)
+                    dropped, deleted = apply_retention(cur, table, table_cutoff)
+                    conn.commit()
+                    stats['dropped'].extend(dropped)
+                    stats['deleted_rows'] += deleted
+                if stats['dropped'] or stats['deleted_rows']:
+                    log(f"✅ 保持期間を過ぎた生ログを削除しました: {', '.join(stats['dropped']) or '-'}（行の削除: {stats['deleted_rows']:,}件）")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if db_type != 'sqlite':
+                # プールに戻す接続なのでセッションの設定を元に戻す（接続断の場合は元の例外を優先）
+                try:
+                    conn.rollback()
+                    cur.execute('RESET lock_timeout')
+                    cur.execute('SELECT pg_advisory_unlock(%s)', (LOG_MAINTENANCE_LOCK_KEY,))
+                    conn.commit()
+                except Exception:
+                    pass
+    return stats
+
+def count_study_log_rows(cur):
+    """study_log の全期間の件数（集計済みの件数 + 境界以降の生ログの件数）"""
+    cur.execute(f'''
+        SELECT (SELECT COUNT(*) FROM study_log WHERE created_at >= {RAW_STUDY_LOG_SINCE_SQL})
+             + (SELECT COALESCE(SUM(rolled_up_rows), 0) FROM log_rollup_state WHERE table_name = 'study_log')
+    ''')
+    return int(cur.fetchone()[0])
+
+def delete_study_log_history(cur, user_id, source=None):
+    """
+    ユーザーの study_log の日別集計と月別テーブル（SQLite）の行を削除（study_log 本体は呼び出し側で削除）
+
+    戻り値: 削除した集計に含まれていた件数
+    """
+    placeholder = get_placeholder()
+    condition = f'user_id = {placeholder}'
+    params = [user_id]
+    if source is not None:
+        condition += f' AND source = {placeholder}'
+        params.append(source)
+    cur.execute(f'SELECT COALESCE(SUM(attempts), 0) FROM study_log_daily WHERE {condition}', params)
+    attempts = int(cur.fetchone()[0])
+    cur.execute(f'DELETE FROM study_log_daily WHERE {condition}', params)
+    if attempts:
+        cur.execute(
+            f"UPDATE log_rollup_state SET rolled_up_rows = rolled_up_rows - {placeholder} WHERE table_name = 'study_log'",
+            (attempts,)
+        )
+    if os.getenv('DB_TYPE', 'sqlite') == 'sqlite':
+        for name in get_month_tables(cur, 'study_log'):
+            cur.execute(f'DELETE FROM {name} WHERE {condition}', params)
+    return attempts
+
+class LogMaintenanceScheduler:
+    """
+    一定間隔でログのメンテナンス（run_log_maintenance）を実行するバックグラウンドスレッド
+
+    複数のワーカーで起動しても、PostgreSQL ではアドバイザリロック、SQLite では集計の境界の
+    条件付き更新により、同じ範囲を二重に集計しない。
+    """
+
+    def __init__(self, app, interval, rollup_after_days=0, retention_days=0, months_ahead=3, initial_delay=60.0):
+        self.app = app
+        self.interval = interval
+        self.rollup_after_days = rollup_after_days
+        self.retention_days = retention_days
+        self.months_ahead = months_ahead
+        self.initial_delay = min(initial_delay, interval)
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'runs': 0, 'failures': 0, 'last_run': None, 'last_seconds': None,
+                       'last_result': None, 'last_error': None}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='log-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self):
+        wait = self.initial_delay
+        while not self._stop_event.wait(wait):
+            wait = self.interval
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self._stats['failures'] += 1
+                    self._stats['last_error'] = str(e)
+                self.app.logger.error(f"ログのメンテナンスエラー: {e}")
+
+    def run_once(self):
+        """メンテナンスを1回実行（実行結果の dict を返す）"""
+        started = time.monotonic()
+        with self.app.app_context():
+            with get_db_connection() as conn:
+                result = run_log_maintenance(
+                    conn,
+                    rollup_after_days=self.rollup_after_days,
+                    retention_days=self.retention_days,
+                    months_ahead=self.months_ahead,
+                    log=current_app.logger.info
+                )
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['last_run'] = datetime.now().isoformat(timespec='seconds')
+            self._stats['last_seconds'] = round(time.monotonic() - started, 3)
+            self._stats['last_result'] = result
+            self._stats['last_error'] = None
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['interval_seconds'] = self.interval
+        stats['rollup_after_days'] = self.rollup_after_days
+        stats['retention_days'] = self.retention_days
+        return stats
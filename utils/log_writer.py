@@ -0,0 +1,411 @@
+"""
+学習ログのバッチ書き込みユーティリティ
+"""
+
+import glob
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from flask import current_app
+from utils.db import get_db_connection, get_db_cursor, get_placeholder
+
+def is_connection_error(error):
+    """DBに到達できない等の一時的なエラーかどうか（スキーマ違反などは含まない）"""
+    try:
+        import psycopg2
+        if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+            return True
+    except ImportError:
+        pass
+    if isinstance(error, sqlite3.OperationalError):
+        message = str(error).lower()
+        return any(keyword in message for keyword in ('locked', 'busy', 'unable to open', 'disk i/o'))
+    return False
+
+def build_insert_sql(table, columns):
+    """INSERT文を生成（DBタイプに応じたプレースホルダー）"""
+    placeholder = get_placeholder()
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(
+        table,
+        ', '.join(columns),
+        ', '.join([placeholder] * len(columns))
+    )
+
+class LogPipeline:
+    """
+    学習ログ用の非同期バッファ
+
+    各エンドポイントは submit() でキューに積むだけで即座にレスポンスを返す。
+    ワーカーは最大 batch_size 件、または最初の1件から max_delay 秒経過するまで溜めてから
+    テーブルごとに executemany（PostgreSQLでは execute_batch）+ 1回のコミットで書き込む。
+    DBに到達できない場合やキューが満杯の場合はスプールファイルに退避し、後で再投入する。
+    on_write を登録したテーブルは、同じトランザクション内で集計テーブルの更新なども行う
+    （on_write が失敗してもログ自体は書き込む）。after_commit はコミット後に呼ばれる（キャッシュの無効化など）。
+    """
+
+    def __init__(self, app, maxsize=1000, batch_size=100, max_delay=0.2,
+                 enqueue_timeout=0.05, spill_dir='log_spill', spill_retry_interval=30.0):
+        self.app = app
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.enqueue_timeout = enqueue_timeout
+        self.spill_dir = spill_dir
+        self.spill_retry_interval = spill_retry_interval
+        self._tables = {}
+        self._hooks = {}
+        self._after_commit = {}
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._next_replay = 0.0
+        self._stats = {
+            'enqueued': 0,
+            'batches': 0,
+            'rows_flushed': 0,
+            'rows_written': 0,
+            'rows_failed': 0,
+            'rows_spilled': 0,
+            'rows_replayed': 0,
+            'hook_failures': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+            'tables': {},
+        }
+
+    def register_table(self, table, columns, on_write=None, after_commit=None):
+        """
+        書き込み対象テーブルと列を登録
+
+        on_write(cur, values_list) は INSERT と同じトランザクション内で、
+        after_commit(values_list) はコミット後に呼ばれる。
+        values_list は submit() に渡されたdictのリスト（列以外のキーもそのまま含む）。
+        """
+        self._tables[table] = tuple(columns)
+        if on_write:
+            self._hooks[table] = on_write
+        if after_commit:
+            self._after_commit[table] = after_commit
+        self._stats['tables'].setdefault(table, {'rows_written': 0, 'rows_failed': 0})
+
+    def has_table(self, table):
+        """テーブルが登録済みかどうか"""
+        return table in self._tables
+
+    def start(self):
+        """ワーカースレッドを開始"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='log-pipeline', daemon=True)
+        self._thread.start()
+
+    def submit(self, table, values):
+        """ログ行（列名→値のdict）をキューに追加。満杯の場合はスプールファイルに退避する"""
+        if table not in self._tables:
+            raise KeyError(f'未登録のログテーブルです: {table}')
+        values = dict(values)
+        try:
+            self._queue.put((table, values), timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._spill([(table, values)])
+            self.app.logger.warning(f"ログキューが満杯のためスプールに退避しました: table={table}")
+            return False
+        with self._lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    # ---------- バッチ収集 ----------
+
+    def _collect_batch(self):
+        """最初の1件を待ち、batch_size件または max_delay 秒まで追加で取り出す"""
+        try:
+            first = self._queue.get(timeout=self.max_delay)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        """キューに残っている行を全て取り出す"""
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    # ---------- 書き込み ----------
+
+    def _write_table(self, table, values_list):
+        """1テーブル分の行を1回のコミットで書き込む"""
+        columns = self._tables[table]
+        sql = build_insert_sql(table, columns)
+        rows = [tuple(values.get(column) for column in columns) for values in values_list]
+        with self.app.app_context():
+            with get_db_connection() as conn:
+                with get_db_cursor(conn) as cur:
+                    if os.getenv('DB_TYPE', 'sqlite') == 'sqlite':
+                        cur.executemany(sql, rows)
+                    else:
+                        from psycopg2.extras import execute_batch
+                        execute_batch(cur, sql, rows, page_size=self.batch_size)
+                    if table in self._hooks:
+                        self._run_hook(cur, table, values_list)
+                conn.commit()
+            if table in self._after_commit:
+                try:
+                    self._after_commit[table](values_list)
+                except Exception as e:
+                    self.app.logger.error(f"ログ書き込み後処理エラー: table={table}, rows={len(values_list)}, error={e}")
+
+    def _run_hook(self, cur, table, values_list):
+        """on_write をセーブポイント内で実行（失敗した場合はその分だけ巻き戻す）"""
+        cur.execute('SAVEPOINT log_pipeline_hook')
+        try:
+            self._hooks[table](cur, values_list)
+        except Exception as e:
+            if is_connection_error(e):
+                raise
+            cur.execute('ROLLBACK TO SAVEPOINT log_pipeline_hook')
+            self.app.logger.error(f"ログ書き込み後処理エラー: table={table}, rows={len(values_list)}, error={e}")
+            with self._lock:
+                self._stats['hook_failures'] += 1
+        cur.execute('RELEASE SAVEPOINT log_pipeline_hook')
+
+    def _write_grouped(self, items):
+        """テーブルごとにまとめて書き込み、接続エラーで書けなかった行を返す"""
+        grouped = {}
+        for table, values in items:
+            grouped.setdefault(table, []).append(values)
+
+        unwritten = []
+        for table, rows in grouped.items():
+            try:
+                self._write_table(table, rows)
+                with self._lock:
+                    self._stats['rows_written'] += len(rows)
+                    self._stats['tables'][table]['rows_written'] += len(rows)
+            except Exception as e:
+                if is_connection_error(e):
+                    self.app.logger.warning(f"DBに書き込めないためスプールに退避します: table={table}, rows={len(rows)}, error={e}")
+                    unwritten.extend((table, values) for values in rows)
+                elif len(rows) == 1:
+                    self._count_failed(table, e)
+                else:
+                    self.app.logger.warning(f"ログ一括書き込みエラーのため1行ずつ再試行します: table={table}, rows={len(rows)}, error={e}")
+                    unwritten.extend(self._write_one_by_one(table, rows))
+        return unwritten
+
+    def _write_one_by_one(self, table, rows):
+        """一括で書けなかった行を1行ずつ書き込む（不正な行だけを失敗として数え、接続エラーの行を返す）"""
+        unwritten = []
+        for values in rows:
+            try:
+                self._write_table(table, [values])
+                with self._lock:
+                    self._stats['rows_written'] += 1
+                    self._stats['tables'][table]['rows_written'] += 1
+            except Exception as e:
+                if is_connection_error(e):
+                    unwritten.append((table, values))
+                    continue
+                self._count_failed(table, e)
+        return unwritten
+
+    def _count_failed(self, table, error):
+        """書き込めない行（不正な値など）を1行失敗として数える"""
+        self.app.logger.error(f"ログ書き込みエラー: table={table}, error={error}")
+        with self._lock:
+            self._stats['rows_failed'] += 1
+            self._stats['tables'][table]['rows_failed'] += 1
+
+    def flush(self, batch):
+        """バッチを書き込んでメトリクスを更新"""
+        if not batch:
+            return
+        started = time.monotonic()
+        unwritten = self._write_grouped(batch)
+        if unwritten:
+            self._spill(unwritten)
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['rows_flushed'] += len(batch)
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+            self._stats['last_flush_ms'] = elapsed_ms
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed_ms)
+            self._stats['total_flush_ms'] += elapsed_ms
+
+    # ---------- スプール（ディスク退避） ----------
+
+    def _spill_path(self, pid=None):
+        return os.path.join(self.spill_dir, f'log_spill_{pid or os.getpid()}.jsonl')
+
+    def _spill(self, items):
+        """書き込めなかった行をJSON Linesでディスクに追記（fsyncまで行う）"""
+        with self._spill_lock:
+            try:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                with open(self._spill_path(), 'a', encoding='utf-8') as f:
+                    for table, values in items:
+                        f.write(json.dumps({'table': table, 'values': values}, ensure_ascii=False, default=str) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception as e:
+                self.app.logger.error(f"ログのスプール書き込みエラー: rows={len(items)}, error={e}")
+                with self._lock:
+                    self._stats['rows_failed'] += len(items)
+                return
+        with self._lock:
+            self._stats['rows_spilled'] += len(items)
+
+    @staticmethod
+    def _is_other_live_process(pid):
+        """自プロセス以外の稼働中のプロセスか"""
+        if pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _replayable_files(self):
+        """
+        自プロセスと、既に終了したプロセスのスプールファイルを列挙
+
+        再投入中にプロセスが落ちて残った *.replaying ファイルも、
+        再投入していたプロセスが終了していれば対象にする。
+        """
+        files = []
+        for path in glob.glob(os.path.join(self.spill_dir, 'log_spill_*.jsonl')):
+            try:
+                pid = int(os.path.basename(path)[len('log_spill_'):-len('.jsonl')])
+            except ValueError:
+                continue
+            if not self._is_other_live_process(pid):
+                files.append(path)
+        for path in glob.glob(os.path.join(self.spill_dir, 'log_spill_*.jsonl.*.replaying')):
+            try:
+                pid = int(os.path.basename(path).rsplit('.', 2)[1])
+            except ValueError:
+                continue
+            # 自プロセスの *.replaying は再投入中のもの（終了したプロセスのものだけを引き取る）
+            if pid != os.getpid() and not self._is_other_live_process(pid):
+                files.append(path)
+        return files
+
+    def replay_spilled(self):
+        """スプールファイルの行をDBに再投入（接続エラーの行は再度退避）"""
+        for path in self._replayable_files():
+            original = path[:path.index('.jsonl') + len('.jsonl')]
+            replaying = f'{original}.{os.getpid()}.replaying'
+            with self._spill_lock:
+                try:
+                    os.replace(path, replaying)
+                except FileNotFoundError:
+                    continue
+            items = []
+            with open(replaying, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                        if record['table'] not in self._tables:
+                            raise KeyError(record['table'])
+                        items.append((record['table'], record['values']))
+                    except (ValueError, KeyError) as e:
+                        self.app.logger.error(f"スプール行の読み込みエラー: {e}")
+            unwritten = []
+            for i in range(0, len(items), self.batch_size):
+                unwritten.extend(self._write_grouped(items[i:i + self.batch_size]))
+            if unwritten:
+                self._spill(unwritten)
+            with self._lock:
+                self._stats['rows_replayed'] += len(items) - len(unwritten)
+            os.remove(replaying)
+
+    def _maybe_replay(self):
+        """一定間隔でスプールの再投入を試みる"""
+        now = time.monotonic()
+        if now < self._next_replay:
+            return
+        self._next_replay = now + self.spill_retry_interval
+        if os.path.isdir(self.spill_dir):
+            self.replay_spilled()
+
+    # ---------- ワーカー ----------
+
+    def _run(self):
+        """ワーカーのメインループ"""
+        while not self._stop_event.is_set():
+            try:
+                self.flush(self._collect_batch())
+                self._maybe_replay()
+            except Exception as e:
+                self.app.logger.error(f"ログワーカーエラー: {e}")
+        self._flush_remaining()
+
+    def _flush_remaining(self):
+        """キューに残っている行を全て書き込む（書けない分はスプールへ）"""
+        remaining = self._drain()
+        for i in range(0, len(remaining), self.batch_size):
+            self.flush(remaining[i:i + self.batch_size])
+
+    def stop(self, timeout=10.0):
+        """ワーカーを停止して残りのログをフラッシュ（atexitから呼ばれる）"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+        else:
+            self._flush_remaining()
+
+    def stats(self):
+        """キュー長・バッチサイズ・フラッシュ時間などのメトリクスを取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['tables'] = {table: dict(counts) for table, counts in self._stats['tables'].items()}
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_maxsize'] = self._queue.maxsize
+        stats['max_delay_ms'] = self.max_delay * 1000
+        stats['avg_batch_size'] = (stats['rows_flushed'] / stats['batches']) if stats['batches'] else 0.0
+        stats['avg_flush_ms'] = (stats['total_flush_ms'] / stats['batches']) if stats['batches'] else 0.0
+        return stats
+
+def enqueue_log(table, values):
+    """
+    学習ログをパイプラインに積む（パイプラインが無い場合はその場で書き込む）
+    """
+    pipeline = current_app.extensions.get('log_pipeline')
+    if pipeline is not None and pipeline.has_table(table):
+        return pipeline.submit(table, values)
+
+    columns = tuple(values.keys())
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            cur.execute(build_insert_sql(table, columns), tuple(values[c] for c in columns))
+        conn.commit()
+    return True
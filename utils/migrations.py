@@ -0,0 +1,283 @@
+"""
+バージョン付きのスキーマのマイグレーション
+
+適用済みの version を schema_version テーブルに記録し、未適用のものだけを順に実行する。
+各ステップは IF NOT EXISTS や列の存在確認により何度実行しても同じ結果になるため、
+途中で失敗した場合もそのまま再実行できる。PostgreSQL のインデックスはテーブルを
+ロックしないよう CREATE INDEX CONCURRENTLY で（トランザクションの外で）作成する。
+
+使い方:
+    flask --app app migrate [--dry-run] [--to VERSION]
+
+スキーマを変更する場合は MIGRATIONS の末尾に新しい version を追加する（適用済みの
+version の内容は変更しない）。
+"""
+
+import os
+import re
+from utils.db import get_db_cursor, get_placeholder
+from utils.schema import SQLITE_BASELINE_TABLES, POSTGRESQL_BASELINE_TABLES, BASELINE_INDEX_SQL
+from utils.normalization import get_column_names, backfill_answer_norms
+from utils.assignments import ASSIGNMENT_INDEX_SQL, backfill_assignment_details
+from utils.progress import CHUNK_CARD_PROGRESS_TABLE_SQL, CHUNK_CARD_PROGRESS_INDEX_SQL
+from utils.jobs import BACKGROUND_JOBS_TABLE_SQL, BACKGROUND_JOBS_INDEX_SQL
+from utils.log_maintenance import (
+    STUDY_LOG_DAILY_TABLE_SQL, STUDY_LOG_DAILY_INDEX_SQL, LOG_ROLLUP_STATE_TABLE_SQL, LOG_CREATED_AT_INDEX_SQL,
+    is_partitioned, partition_log_tables
+)
+
+def rebuild_question_answer_norms(cur):
+    """questions の正規化済みの正解を現在の規則（normalize_question_answer）で全行計算し直す"""
+    backfill_answer_norms(cur, rebuild=True, tables=('questions',))
+
+SCHEMA_VERSION_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# 複数のプロセスから同時に実行しないための PostgreSQL のアドバイザリロックのキー
+MIGRATION_LOCK_KEY = 727001
+
+INDEX_PATTERN = re.compile(r'CREATE\s+(UNIQUE\s+)?INDEX\s+IF\s+NOT\s+EXISTS\s+(\w+)\s+ON\s+(\w+)', re.IGNORECASE)
+
+class SQL:
+    """SQL文（SQLite と PostgreSQL で異なる場合はそれぞれ指定、1文または文のリスト）"""
+
+    online = False
+
+    def __init__(self, sqlite, postgresql=None):
+        self.sqlite = [sqlite] if isinstance(sqlite, str) else list(sqlite)
+        if postgresql is None:
+            self.postgresql = self.sqlite
+        else:
+            self.postgresql = [postgresql] if isinstance(postgresql, str) else list(postgresql)
+
+    def statements(self, cur, db_type):
+        return self.sqlite if db_type == 'sqlite' else self.postgresql
+
+    def apply(self, cur, db_type):
+        for sql in self.statements(cur, db_type):
+            cur.execute(sql)
+
+class CreateIndex:
+    """
+    インデックスの作成（CREATE INDEX IF NOT EXISTS ... の形式で指定）
+
+    PostgreSQL では CONCURRENTLY で作成するため、作成中も study_log などへの書き込みを止めない。
+    CONCURRENTLY が途中で失敗すると無効なインデックスが残るため、その場合は削除してから作り直す。
+    パーティションテーブル（ログテーブル）には CONCURRENTLY を使えないため通常の CREATE INDEX にする。
+    """
+
+    online = True
+
+    def __init__(self, sql):
+        match = INDEX_PATTERN.search(sql)
+        if not match:
+            raise ValueError(f"インデックスの定義を解析できません: {sql}")
+        self.sql = sql.strip().rstrip(';')
+        self.name = match.group(2)
+        self.table = match.group(3)
+
+    def statements(self, cur, db_type):
+        if db_type == 'sqlite' or (cur is not None and is_partitioned(cur, self.table)):
+            return [self.sql]
+        return [INDEX_PATTERN.sub(
+            lambda m: f"CREATE {m.group(1) or ''}INDEX CONCURRENTLY IF NOT EXISTS {m.group(2)} ON {m.group(3)}",
+            self.sql, count=1
+        )]
+
+    def apply(self, cur, db_type):
+        if db_type != 'sqlite':
+            cur.execute('''
+                SELECT i.indisvalid FROM pg_class c
+                JOIN pg_index i ON i.indexrelid = c.oid
+                WHERE c.relname = %s
+            ''', (self.name,))
+            row = cur.fetchone()
+            if row and not row[0]:
+                cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {self.name}')
+        for sql in self.statements(cur, db_type):
+            cur.execute(sql)
+
+class AddColumn:
+    """列の追加（列がある場合は何もしない）。backfill で追加した列を埋める UPDATE を指定できる"""
+
+    online = False
+
+    def __init__(self, table, column, definition, backfill=None):
+        self.table = table
+        self.column = column
+        self.definition = definition
+        self.backfill = backfill
+
+    def statements(self, cur, db_type):
+        if cur is not None and self.column in get_column_names(cur, self.table):
+            return []
+        statements = [f'ALTER TABLE {self.table} ADD COLUMN {self.column} {self.definition}']
+        if self.backfill:
+            statements.append(self.backfill)
+        return statements
+
+    def apply(self, cur, db_type):
+        for sql in self.statements(cur, db_type):
+            cur.execute(sql)
+
+class RunPython:
+    """データの移行など SQL だけでは書けない処理（func(cur) を呼ぶ。何度実行しても同じ結果になること）"""
+
+    online = False
+
+    def __init__(self, func, description):
+        self.func = func
+        self.description = description
+
+    def statements(self, cur, db_type):
+        return [f'-- {self.description}']
+
+    def apply(self, cur, db_type):
+        self.func(cur)
+
+class Migration:
+    """1つの version（steps を順に実行し、すべて成功したら schema_version に記録する）"""
+
+    def __init__(self, version, name, steps):
+        self.version = version
+        self.name = name
+        self.steps = steps
+
+MIGRATIONS = [
+    Migration(1, 'baseline_tables', [
+        SQL(sqlite=SQLITE_BASELINE_TABLES, postgresql=POSTGRESQL_BASELINE_TABLES)
+    ]),
+    Migration(2, 'baseline_indexes', [CreateIndex(sql) for sql in BASELINE_INDEX_SQL]),
+    Migration(3, 'answer_norm_columns', [
+        AddColumn('questions', 'correct_answer_norm', 'TEXT'),
+        AddColumn('questions', 'acceptable_answers_norm', 'TEXT'),
+        AddColumn('choice_questions', 'correct_answer_norm', 'TEXT'),
+        RunPython(backfill_answer_norms, '採点用の正規化済みの正解を埋める（utils/normalization.py）')
+    ]),
+    Migration(4, 'assignment_details_backfill', [
+        RunPython(backfill_assignment_details, 'units 列（JSON）にしかない割り当て単元を assignment_details に移す')
+    ]),
+    Migration(5, 'textbook_assignments_assignment_type', [
+        AddColumn('textbook_assignments', 'assignment_type', 'TEXT',
+                  backfill='UPDATE textbook_assignments SET assignment_type = study_type WHERE assignment_type IS NULL')
+    ]),
+    Migration(6, 'log_partitions_and_daily_rollups', [
+        SQL([STUDY_LOG_DAILY_TABLE_SQL, LOG_ROLLUP_STATE_TABLE_SQL]),
+        CreateIndex(STUDY_LOG_DAILY_INDEX_SQL),
+        SQL(sqlite=LOG_CREATED_AT_INDEX_SQL, postgresql=[]),
+        RunPython(partition_log_tables, 'PostgreSQL: study_log / study_logs / choice_study_log を created_at の月別パーティションに変換（utils/log_maintenance.py）')
+    ]),
+    Migration(7, 'question_answer_norms_case_only', [
+        RunPython(rebuild_question_answer_norms, '入力問題の正規化済みの正解を大文字小文字だけを無視する規則で計算し直す')
+    ]),
+    Migration(8, 'chunk_card_progress', [
+        SQL(CHUNK_CARD_PROGRESS_TABLE_SQL),
+        CreateIndex(CHUNK_CARD_PROGRESS_INDEX_SQL)
+    ]),
+    Migration(9, 'background_jobs', [
+        SQL(BACKGROUND_JOBS_TABLE_SQL),
+        AddColumn('background_jobs', 'worker_host', 'TEXT'),
+        AddColumn('background_jobs', 'upload_path', 'TEXT'),
+        CreateIndex(BACKGROUND_JOBS_INDEX_SQL)
+    ]),
+    Migration(10, 'study_log_user_card_index', [
+        CreateIndex('CREATE INDEX IF NOT EXISTS idx_study_log_user_card ON study_log(user_id, card_id, result, stage)')
+    ]),
+    Migration(11, 'assignment_indexes', [CreateIndex(sql) for sql in ASSIGNMENT_INDEX_SQL]),
+]
+
+def get_applied_versions(cur):
+    """適用済みの version -> 名前（schema_version テーブルがない場合は空）"""
+    if not get_column_names(cur, 'schema_version'):
+        return {}
+    cur.execute('SELECT version, name FROM schema_version ORDER BY version')
+    return {row[0]: row[1] for row in cur.fetchall()}
+
+def get_pending_migrations(applied, target=None):
+    """未適用のマイグレーション（target を指定した場合はその version まで）"""
+    return [
+        migration for migration in MIGRATIONS
+        if migration.version not in applied and (target is None or migration.version <= target)
+    ]
+
+def plan_migrations(conn, target=None):
+    """
+    未適用のマイグレーションと実行するSQLの一覧（dry-run 用、DBは変更しない）
+
+    戻り値: [(Migration, [SQL文, ...]), ...]
+    """
+    db_type = os.getenv('DB_TYPE', 'sqlite')
+    with get_db_cursor(conn) as cur:
+        applied = get_applied_versions(cur)
+        plan = [
+            (migration, [sql for step in migration.steps for sql in step.statements(cur, db_type)])
+            for migration in get_pending_migrations(applied, target)
+        ]
+    conn.rollback()
+    return plan
+
+def run_migrations(conn, target=None, log=None, lock_timeout='10s'):
+    """
+    未適用のマイグレーションを順に適用
+
+    version ごとにコミットする（PostgreSQL のインデックス作成はトランザクションの外で実行）。
+    PostgreSQL では lock_timeout を超えてロックを待つDDLは失敗させ、
+    実行中のクエリの後ろで他のリクエストを止め続けないようにする。
+
+    戻り値: 適用した Migration のリスト
+    """
+    db_type = os.getenv('DB_TYPE', 'sqlite')
+    placeholder = get_placeholder()
+    log = log or (lambda message: None)
+    applied_now = []
+    with get_db_cursor(conn) as cur:
+        if db_type != 'sqlite':
+            cur.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_KEY,))
+            if lock_timeout:
+                cur.execute('SET lock_timeout = %s', (lock_timeout,))
+            conn.commit()
+        try:
+            cur.execute(SCHEMA_VERSION_TABLE_SQL)
+            conn.commit()
+            pending = get_pending_migrations(get_applied_versions(cur), target)
+            if not pending:
+                log("✅ スキーマは最新です")
+            for migration in pending:
+                log(f"🔄 マイグレーション {migration.version}: {migration.name}")
+                try:
+                    for step in migration.steps:
+                        if step.online and db_type != 'sqlite':
+                            conn.commit()
+                            conn.autocommit = True
+                            try:
+                                step.apply(cur, db_type)
+                            finally:
+                                conn.autocommit = False
+                        else:
+                            step.apply(cur, db_type)
+                    cur.execute(
+                        f'INSERT INTO schema_version (version, name) VALUES ({placeholder}, {placeholder})',
+                        (migration.version, migration.name)
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                applied_now.append(migration)
+                log(f"✅ マイグレーション {migration.version} を適用しました")
+        finally:
+            if db_type != 'sqlite':
+                # プールに戻す接続なのでセッションの設定を元に戻す（接続断の場合は元の例外を優先）
+                try:
+                    conn.rollback()
+                    cur.execute('RESET lock_timeout')
+                    cur.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_KEY,))
+                    conn.commit()
+                except Exception:
+                    pass
+    return applied_now
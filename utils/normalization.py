@@ -0,0 +1,194 @@
+"""
+回答の正規化（採点用）
+
+正規表現はモジュール読み込み時に一度だけコンパイルし、文字の置き換えは str.translate の
+変換表1回で行う。正解側の正規化結果は問題の登録時に保存しておき（correct_answer_norm 列）、
+採点では利用者の入力だけを正規化する。
+"""
+
+import json
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from utils.db import get_placeholder
+
+# 全角英数字・記号（U+FF01〜U+FF5E）→ 半角、全角スペース → 半角スペース
+WIDTH_FOLD = {code: code - 0xFEE0 for code in range(0xFF01, 0xFF5F)}
+WIDTH_FOLD[0x3000] = 0x20
+
+# カタカナ（ァ〜ヶ）→ ひらがな
+KANA_FOLD = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+SPACE_PATTERN = re.compile(r'\s+')
+PARENTHESES_PATTERN = re.compile(r'[（(].*?[）)]')
+HALFWIDTH_KANA_PATTERN = re.compile(r'[｡-ﾟ]+')
+
+def _to_fullwidth_kana(match):
+    # 半角カタカナは濁点・半濁点が別の文字になっているため、NFKCで合成してから全角にする
+    return unicodedata.normalize('NFKC', match.group(0))
+
+class AnswerNormalizer:
+    """
+    回答の正規化の設定（問題の種類ごとに1つ作って使い回す）
+
+    remove: 削除する文字、replace: 個別の置き換え（{'、': ','} など）。
+    括弧の削除 → 半角カタカナの全角化 → 変換表（削除・置き換え・全角半角・カナ）→ 小文字化
+    → 空白の除去/圧縮 の順に行う（collapse_spaces=False の場合は前後の空白だけを除く）。
+    同じ文字列の結果は lru_cache で使い回す。
+    """
+
+    def __init__(self, lowercase=False, remove_spaces=False, remove_parentheses=False,
+                 remove='', replace=None, fold_width=True, fold_kana=True, collapse_spaces=True,
+                 cache_size=4096):
+        self.lowercase = lowercase
+        self.remove_spaces = remove_spaces
+        self.collapse_spaces = collapse_spaces
+        self.remove_parentheses = remove_parentheses
+        self.fold_kana = fold_kana
+        table = {}
+        if fold_width:
+            table.update(WIDTH_FOLD)
+        if fold_kana:
+            table.update(KANA_FOLD)
+        table.update(str.maketrans(replace or {}))
+        table.update({ord(char): None for char in remove})
+        self._table = table
+        self.normalize = lru_cache(maxsize=cache_size)(self._normalize)
+
+    def _normalize(self, answer):
+        if self.remove_parentheses:
+            answer = PARENTHESES_PATTERN.sub('', answer)
+        if self.fold_kana:
+            answer = HALFWIDTH_KANA_PATTERN.sub(_to_fullwidth_kana, answer)
+        answer = answer.translate(self._table)
+        if self.lowercase:
+            answer = answer.lower()
+        if self.remove_spaces:
+            return SPACE_PATTERN.sub('', answer)
+        if not self.collapse_spaces:
+            return answer.strip()
+        return SPACE_PATTERN.sub(' ', answer).strip()
+
+    def __call__(self, answer):
+        if not answer:
+            return ""
+        return self.normalize(answer)
+
+    def cache_info(self):
+        return self.normalize.cache_info()
+
+# 入力問題（questions）: 大文字小文字だけを無視する（"2(x+1)" と "2" のような括弧の有無は区別する）
+QUESTION_NORMALIZER = AnswerNormalizer(
+    lowercase=True,
+    fold_width=False,
+    fold_kana=False,
+    collapse_spaces=False
+)
+
+# 単語の入力学習（choice_utils.check_answer）: 大文字小文字・句読点・括弧書き（読みがななど）を無視する
+INPUT_NORMALIZER = AnswerNormalizer(
+    lowercase=True,
+    remove_parentheses=True,
+    remove='、。，．'
+)
+
+# 選択問題の単語学習（choice_questions）: 空白をすべて除き、全角の句読点は半角の記号として扱う
+CHOICE_NORMALIZER = AnswerNormalizer(
+    remove_spaces=True,
+    replace={'、': ',', '。': '.', '・': '/'}
+)
+
+def normalize_question_answer(answer):
+    """入力問題（questions）の回答を正規化"""
+    return QUESTION_NORMALIZER(answer)
+
+def normalize_input_answer(answer):
+    """単語の入力学習の回答を正規化"""
+    return INPUT_NORMALIZER(answer)
+
+def normalize_choice_answer(answer):
+    """選択問題（単語学習）の回答を正規化"""
+    return CHOICE_NORMALIZER(answer)
+
+def parse_acceptable_answers(acceptable_answers):
+    """許容回答（JSON配列の文字列）をリストに変換（形式が違う場合は空）"""
+    if not acceptable_answers:
+        return []
+    if isinstance(acceptable_answers, (list, tuple)):
+        return [str(answer) for answer in acceptable_answers]
+    try:
+        parsed = json.loads(acceptable_answers)
+    except (TypeError, ValueError):
+        return []
+    if not isinstance(parsed, list):
+        return []
+    return [str(answer) for answer in parsed]
+
+def normalize_acceptable_answers(acceptable_answers, normalize=normalize_question_answer):
+    """許容回答を正規化してJSON配列の文字列にする（保存用、ない場合は None）"""
+    answers = parse_acceptable_answers(acceptable_answers)
+    if not answers:
+        return None
+    return json.dumps([normalize(answer) for answer in answers], ensure_ascii=False)
+
+# 正規化済みの正解を保存する列: テーブル -> (列, 元の列, 正規化関数)
+ANSWER_NORM_COLUMNS = {
+    'questions': (
+        ('correct_answer_norm', 'correct_answer', normalize_question_answer),
+        ('acceptable_answers_norm', 'acceptable_answers', normalize_acceptable_answers)
+    ),
+    'choice_questions': (
+        ('correct_answer_norm', 'correct_answer', normalize_choice_answer),
+    )
+}
+
+def get_column_names(cur, table):
+    """テーブルの列名の集合（テーブルがない場合は空）"""
+    if os.getenv('DB_TYPE', 'sqlite') == 'sqlite':
+        cur.execute(f'PRAGMA table_info({table})')
+        return {row[1] for row in cur.fetchall()}
+    cur.execute(f'SELECT column_name FROM information_schema.columns WHERE table_name = {get_placeholder()}', (table,))
+    return {row[0] for row in cur.fetchall()}
+
+def ensure_answer_norm_columns(cur):
+    """既存のDBに正規化済みの正解の列を追加（テーブルがない場合は何もしない）"""
+    added = []
+    for table, columns in ANSWER_NORM_COLUMNS.items():
+        existing = get_column_names(cur, table)
+        if not existing:
+            continue
+        for column, _, _ in columns:
+            if column not in existing:
+                cur.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+                added.append(f'{table}.{column}')
+    return added
+
+def backfill_answer_norms(cur, rebuild=False, batch_size=500, tables=None):
+    """
+    正規化済みの正解を埋める（rebuild=True の場合は正規化の規則を変えたときのため全行を計算し直す）
+
+    tables を指定した場合はそのテーブルだけを対象にする。
+    戻り値: {テーブル名: 更新した行数}
+    """
+    placeholder = get_placeholder()
+    updated = {}
+    for table, columns in ANSWER_NORM_COLUMNS.items():
+        if tables is not None and table not in tables:
+            continue
+        existing = get_column_names(cur, table)
+        if not existing or any(column not in existing for column, _, _ in columns):
+            continue
+        sources = ', '.join(source for _, source, _ in columns)
+        where = '' if rebuild else f'WHERE {columns[0][0]} IS NULL'
+        cur.execute(f'SELECT id, {sources} FROM {table} {where} ORDER BY id')
+        rows = cur.fetchall()
+        assignments = ', '.join(f'{column} = {placeholder}' for column, _, _ in columns)
+        values = [
+            tuple(normalize(row[i + 1]) for i, (_, _, normalize) in enumerate(columns)) + (row[0],)
+            for row in rows
+        ]
+        for i in range(0, len(values), batch_size):
+            cur.executemany(f'UPDATE {table} SET {assignments} WHERE id = {placeholder}', values[i:i + batch_size])
+        updated[table] = len(values)
+    return updated
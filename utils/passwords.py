@@ -0,0 +1,56 @@
+"""
+パスワードハッシュ関連のユーティリティ（ユーザー一括登録用）
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash
+
+DEFAULT_HASH_METHOD = 'pbkdf2:sha256'
+
+def hash_password_chunk(passwords, method=DEFAULT_HASH_METHOD):
+    """パスワードのリストをまとめてハッシュ化（プロセスプールの1タスク分）"""
+    return [generate_password_hash(password, method=method) for password in passwords]
+
+def get_pool_context():
+    """
+    プロセスプールの起動方式
+
+    spawn / forkserver は子プロセスでメインモジュール（python app.py の場合は app.py）を
+    読み込み直してしまうため、使える環境では fork を使う（子プロセスはハッシュ計算しか行わない）。
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+def hash_passwords(passwords, method=DEFAULT_HASH_METHOD, workers=None, chunk_size=25, progress=None):
+    """
+    複数のパスワードをプロセスプールで並列にハッシュ化（戻り値の順序は入力と同じ）
+
+    method は werkzeug の形式（'pbkdf2:sha256:600000' や 'scrypt:32768:8:1'）で、
+    反復回数などの作業係数を含めて指定できる。workers が1以下、または1タスク分しかない場合は
+    プールを起動せずにその場で計算する。progress(done, total) はタスクが終わるたびに呼ばれ、
+    例外を送出すると未実行のタスクを破棄して中断する。
+    """
+    passwords = list(passwords)
+    workers = workers or os.cpu_count() or 1
+    chunks = [passwords[i:i + chunk_size] for i in range(0, len(passwords), chunk_size)]
+    hashes = []
+
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            hashes.extend(hash_password_chunk(chunk, method))
+            if progress:
+                progress(len(hashes), len(passwords))
+        return hashes
+
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=get_pool_context())
+    try:
+        for hashed in executor.map(hash_password_chunk, chunks, [method] * len(chunks)):
+            hashes.extend(hashed)
+            if progress:
+                progress(len(hashes), len(passwords))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return hashes
@@ -0,0 +1,250 @@
+"""
+チャンク進捗の集計テーブル（chunk_card_progress）関連のユーティリティ
+
+chunk_progress と同じ単位（ユーザー・教材・ステージ・ページ範囲・難易度・チャンク）に
+カードとモードを加えた粒度で、正解数・不正解数・最新の結果を保持する。
+study_log への書き込み時にログパイプラインから更新されるため、準備画面は study_log を
+走査せずにチャンク単位の進捗を表示できる。
+"""
+
+from flask import current_app
+from utils.db import get_db_connection, get_db_cursor, get_placeholder
+
+CHUNK_CARD_PROGRESS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS chunk_card_progress (
+        user_id INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        stage INTEGER NOT NULL,
+        mode TEXT NOT NULL,
+        page_range TEXT NOT NULL DEFAULT '',
+        difficulty TEXT NOT NULL DEFAULT '',
+        chunk_number INTEGER NOT NULL,
+        card_id INTEGER NOT NULL,
+        correct_count INTEGER NOT NULL DEFAULT 0,
+        wrong_count INTEGER NOT NULL DEFAULT 0,
+        last_result TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, source, stage, mode, page_range, difficulty, card_id)
+    )
+'''
+
+CHUNK_CARD_PROGRESS_INDEX_SQL = (
+    'CREATE INDEX IF NOT EXISTS idx_chunk_card_progress_chunk '
+    'ON chunk_card_progress(user_id, source, stage, page_range, difficulty, chunk_number)'
+)
+
+# 正解として扱う結果（study_log は known/unknown、画面からは correct/incorrect が送られる）
+CORRECT_RESULTS = ('known', 'correct')
+
+def create_progress_table(cur):
+    """集計テーブルとインデックスを作成"""
+    cur.execute(CHUNK_CARD_PROGRESS_TABLE_SQL)
+    cur.execute(CHUNK_CARD_PROGRESS_INDEX_SQL)
+
+def is_correct_result(result):
+    """正解の結果かどうか"""
+    return result in CORRECT_RESULTS
+
+def build_upsert_sql():
+    """加算型のUPSERT文を生成（SQLite 3.24+ / PostgreSQL 共通の構文）"""
+    placeholder = get_placeholder()
+    return f'''
+        INSERT INTO chunk_card_progress
+            (user_id, source, stage, mode, page_range, difficulty, chunk_number, card_id,
+             correct_count, wrong_count, last_result, updated_at)
+        VALUES ({', '.join([placeholder] * 11)}, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id, source, stage, mode, page_range, difficulty, card_id)
+        DO UPDATE SET
+            chunk_number = EXCLUDED.chunk_number,
+            correct_count = chunk_card_progress.correct_count + EXCLUDED.correct_count,
+            wrong_count = chunk_card_progress.wrong_count + EXCLUDED.wrong_count,
+            last_result = EXCLUDED.last_result,
+            updated_at = CURRENT_TIMESTAMP
+    '''
+
+def apply_study_log_progress(cur, values_list):
+    """
+    study_log に書き込んだ行を集計テーブルに反映（ログパイプラインの on_write）
+
+    バッチ内で同じカードの行をまとめてから1行ずつUPSERTする。
+    chunk_number を持たない行（チャンク外の学習）は対象外。
+    チャンク番号は rebuild_chunk_card_progress と同じく絞り込んだカードの並び順から求める
+    （練習モードのセッションの chunk_number は間違えたカードの一覧でのチャンクのため使わない）。
+    キャッシュの無効化はコミット後に clear_study_log_cache で行う。
+    """
+    from utils.study_utils import get_chunk_size_by_subject
+    chunk_size = int(get_chunk_size_by_subject(None))
+    chunk_maps = {}
+    aggregated = {}
+    for values in values_list:
+        if values.get('chunk_number') is None or values.get('source') is None:
+            continue
+        page_range, difficulty = values.get('page_range') or '', values.get('difficulty') or ''
+        map_key = (values['source'], page_range, difficulty)
+        if map_key not in chunk_maps:
+            chunk_maps[map_key] = get_card_chunk_numbers(cur, *map_key, chunk_size)
+        chunk_number = chunk_maps[map_key].get(int(values['card_id']))
+        if chunk_number is None:
+            # 現在の絞り込み条件に含まれないカード（削除済みなど）
+            continue
+        key = (
+            int(values['user_id']), values['source'], int(values['stage']), values['mode'],
+            page_range, difficulty, int(values['card_id'])
+        )
+        entry = aggregated.setdefault(key, [chunk_number, 0, 0, None])
+        if is_correct_result(values['result']):
+            entry[1] += 1
+        else:
+            entry[2] += 1
+        entry[3] = values['result']
+
+    if not aggregated:
+        return
+
+    rows = [
+        key[:6] + (chunk_number, key[6], correct, wrong, last_result)
+        for key, (chunk_number, correct, wrong, last_result) in aggregated.items()
+    ]
+    cur.executemany(build_upsert_sql(), rows)
+
+def clear_study_log_cache(values_list):
+    """
+    study_log の書き込みのコミット後に進捗のキャッシュを無効化（ログパイプラインの after_commit）
+
+    コミット前に無効化すると、その間に読まれた古い進捗がキャッシュに残るためコミット後に行う。
+    """
+    from utils.study_utils import clear_user_cache
+    for user_id, source in {(values.get('user_id'), values.get('source')) for values in values_list}:
+        if user_id is not None and source is not None:
+            clear_user_cache(user_id, source)
+
+def get_chunk_progress_summary(user_id, source, stage, page_range, difficulty):
+    """
+    チャンクごとの進捗を集計テーブルから取得
+
+    戻り値: {chunk_number: {'test_answered', 'test_correct', 'test_wrong',
+                            'practice_answered', 'practice_correct'}}
+    """
+    placeholder = get_placeholder()
+    correct_list = ', '.join(f"'{result}'" for result in CORRECT_RESULTS)
+    try:
+        with get_db_connection() as conn:
+            with get_db_cursor(conn) as cur:
+                cur.execute(f'''
+                    SELECT chunk_number,
+                           SUM(CASE WHEN mode = 'test' THEN 1 ELSE 0 END),
+                           SUM(CASE WHEN mode = 'test' AND last_result IN ({correct_list}) THEN 1 ELSE 0 END),
+                           SUM(CASE WHEN mode = 'practice' THEN 1 ELSE 0 END),
+                           SUM(CASE WHEN mode = 'practice' AND last_result IN ({correct_list}) THEN 1 ELSE 0 END)
+                    FROM chunk_card_progress
+                    WHERE user_id = {placeholder} AND source = {placeholder} AND stage = {placeholder}
+                      AND page_range = {placeholder} AND difficulty = {placeholder}
+                    GROUP BY chunk_number
+                ''', (user_id, source, stage, page_range or '', difficulty or ''))
+                rows = cur.fetchall()
+    except Exception as e:
+        current_app.logger.error(f"チャンク進捗の取得エラー: {e}")
+        return {}
+
+    summary = {}
+    for row in rows:
+        test_answered = int(row[1] or 0)
+        test_correct = int(row[2] or 0)
+        summary[int(row[0])] = {
+            'test_answered': test_answered,
+            'test_correct': test_correct,
+            'test_wrong': test_answered - test_correct,
+            'practice_answered': int(row[3] or 0),
+            'practice_correct': int(row[4] or 0)
+        }
+    return summary
+
+def get_card_chunk_numbers(cur, source, page_range, difficulty, chunk_size):
+    """ページ範囲・難易度で絞り込んだカードのチャンク番号（card_id -> chunk_number）を取得"""
+    from utils.study_utils import build_card_filter
+    where, params = build_card_filter(source, page_range, difficulty)
+    cur.execute(f'SELECT id FROM image WHERE {where} ORDER BY page_number, level, id', params)
+    return {row[0]: index // chunk_size + 1 for index, row in enumerate(cur.fetchall())}
+
+def rebuild_chunk_card_progress(user_id=None, chunk_size=None):
+    """
+    study_log から集計テーブルを作り直す（user_idを指定した場合はそのユーザーのみ）
+
+    ユーザー・教材・ページ範囲・難易度の組ごとにカードのチャンク番号を求め、
+    カード・ステージ・モード単位の正解数・不正解数と最新の結果（最大idの行）を集計する。
+    日別に集計済みの日（utils/log_maintenance.py）は study_log_daily から読む。
+    """
+    from utils.log_maintenance import RAW_STUDY_LOG_SINCE_SQL
+    from utils.study_utils import get_chunk_size_by_subject
+    chunk_size = int(chunk_size or get_chunk_size_by_subject(None))
+    placeholder = get_placeholder()
+    correct_list = ', '.join(f"'{result}'" for result in CORRECT_RESULTS)
+    user_filter = f'AND user_id = {placeholder}' if user_id is not None else ''
+    user_params = (user_id,) if user_id is not None else ()
+    stats = {'groups': 0, 'rows': 0, 'skipped_cards': 0}
+
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            create_progress_table(cur)
+            cur.execute(f'DELETE FROM chunk_card_progress WHERE 1 = 1 {user_filter}', user_params)
+            cur.execute(f'''
+                SELECT DISTINCT user_id, source, COALESCE(page_range, ''), COALESCE(difficulty, '')
+                FROM study_log WHERE created_at >= {RAW_STUDY_LOG_SINCE_SQL} {user_filter}
+                UNION
+                SELECT user_id, source, page_range, difficulty
+                FROM study_log_daily WHERE 1 = 1 {user_filter}
+            ''', user_params + user_params)
+            groups = cur.fetchall()
+
+            chunk_maps = {}
+            upsert_sql = build_upsert_sql()
+            for group_user_id, source, page_range, difficulty in groups:
+                map_key = (source, page_range, difficulty)
+                if map_key not in chunk_maps:
+                    chunk_maps[map_key] = get_card_chunk_numbers(cur, source, page_range, difficulty, chunk_size)
+                chunk_map = chunk_maps[map_key]
+
+                # 生ログの行と日別の集計を同じ形（件数・最後の行のidと結果）にそろえてから集計する
+                cur.execute(f'''
+                    WITH u AS (
+                        SELECT card_id, stage, mode,
+                               CASE WHEN result IN ({correct_list}) THEN 1 ELSE 0 END AS correct_count,
+                               CASE WHEN result IN ({correct_list}) THEN 0 ELSE 1 END AS wrong_count,
+                               id AS last_id, result AS last_result
+                        FROM study_log
+                        WHERE user_id = {placeholder} AND source = {placeholder}
+                          AND COALESCE(page_range, '') = {placeholder} AND COALESCE(difficulty, '') = {placeholder}
+                          AND created_at >= {RAW_STUDY_LOG_SINCE_SQL}
+                        UNION ALL
+                        SELECT card_id, stage, mode, correct_count, attempts - correct_count, last_id, last_result
+                        FROM study_log_daily
+                        WHERE user_id = {placeholder} AND source = {placeholder}
+                          AND page_range = {placeholder} AND difficulty = {placeholder}
+                    )
+                    SELECT g.card_id, g.stage, g.mode, g.correct_count, g.wrong_count, u.last_result
+                    FROM (
+                        SELECT card_id, stage, mode,
+                               SUM(correct_count) AS correct_count,
+                               SUM(wrong_count) AS wrong_count,
+                               MAX(last_id) AS last_id
+                        FROM u
+                        GROUP BY card_id, stage, mode
+                    ) g
+                    JOIN u ON u.last_id = g.last_id
+                ''', (group_user_id, source, page_range, difficulty) * 2)
+
+                rows = []
+                for card_id, stage, mode, correct, wrong, last_result in cur.fetchall():
+                    chunk_number = chunk_map.get(card_id)
+                    if chunk_number is None:
+                        # 現在の絞り込み条件に含まれないカード（削除済みなど）
+                        stats['skipped_cards'] += 1
+                        continue
+                    rows.append((group_user_id, source, stage, mode, page_range, difficulty,
+                                 chunk_number, card_id, correct, wrong, last_result))
+                if rows:
+                    cur.executemany(upsert_sql, rows)
+                stats['groups'] += 1
+                stats['rows'] += len(rows)
+        conn.commit()
+    return stats
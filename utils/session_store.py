@@ -0,0 +1,195 @@
+"""
+学習セッション用のサーバーサイドストア
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import current_app
+
+class StudySessionStore:
+    """
+    問題リストなどの大きな学習セッションデータをサーバー側に保存するストア
+
+    クッキーにはストアのIDと現在位置だけを持たせる。保存したデータは書き換えないため、
+    各プロセスのメモリ上のLRUキャッシュをそのまま使い、ミス時のみSQLiteファイルから読む
+    （複数ワーカーでも同じファイルを共有できる）。
+    期限はアクセスのたびに延長する。メモリのヒット時も期限を延ばし、SQLiteの期限と最終アクセスは
+    touch_interval 秒に1回だけ更新する（使用中のセッションが期限切れやLRUで削除されないようにする）。
+    """
+
+    def __init__(self, path, ttl=7200, max_entries=10000, memory_entries=256, touch_interval=60.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.touch_interval = min(touch_interval, ttl / 2)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+        self._init_backend()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_backend(self):
+        """保存用テーブルを作成"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS study_session_store (
+                    id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_study_session_store_expires ON study_session_store(expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_study_session_store_access ON study_session_store(last_access)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _remember(self, store_id, expires_at, payload, touched_at):
+        """メモリ上のLRUキャッシュに追加（touched_at はSQLiteの期限を最後に延長した時刻）"""
+        with self._lock:
+            self._memory[store_id] = (expires_at, payload, touched_at)
+            self._memory.move_to_end(store_id)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, payload):
+        """データを保存してIDを返す"""
+        store_id = uuid.uuid4().hex
+        now = time.time()
+        expires_at = now + self.ttl
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT INTO study_session_store (id, data, expires_at, last_access) VALUES (?, ?, ?, ?)',
+                (store_id, json.dumps(payload, ensure_ascii=False, default=str), expires_at, now)
+            )
+            # 期限切れを削除し、上限を超えた分は最終アクセスが古い順に削除（LRU）
+            cur = conn.execute('DELETE FROM study_session_store WHERE expires_at < ?', (now,))
+            expired = cur.rowcount
+            cur = conn.execute('''
+                DELETE FROM study_session_store WHERE id IN (
+                    SELECT id FROM study_session_store
+                    ORDER BY last_access DESC
+                    LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+            evicted = cur.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._stats['expired'] += max(expired, 0)
+            self._stats['evicted'] += max(evicted, 0)
+        self._remember(store_id, expires_at, payload, now)
+        return store_id
+
+    def get(self, store_id):
+        """データを取得（存在しない・期限切れの場合はNone）"""
+        if not store_id:
+            return None
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(store_id)
+            if cached and cached[0] >= now:
+                self._memory.move_to_end(store_id)
+                self._stats['hits'] += 1
+                _, payload, touched_at = cached
+                if now - touched_at < self.touch_interval:
+                    self._memory[store_id] = (now + self.ttl, payload, touched_at)
+                    return payload
+            else:
+                self._memory.pop(store_id, None)
+                self._stats['misses'] += 1
+                payload = None
+
+        if payload is not None:
+            return self._touch(store_id, payload, now)
+
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT data, expires_at FROM study_session_store WHERE id = ?', (store_id,)
+            ).fetchone()
+            if not row or row[1] < now:
+                return None
+            # アクセスのたびに期限を延長する
+            expires_at = now + self.ttl
+            conn.execute(
+                'UPDATE study_session_store SET last_access = ?, expires_at = ? WHERE id = ?',
+                (now, expires_at, store_id)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        payload = json.loads(row[0])
+        self._remember(store_id, expires_at, payload, now)
+        return payload
+
+    def _touch(self, store_id, payload, now):
+        """メモリのヒット時にSQLiteの期限と最終アクセスを延長（他のプロセスで削除済みの場合はNone）"""
+        expires_at = now + self.ttl
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                'UPDATE study_session_store SET last_access = ?, expires_at = ? WHERE id = ? AND expires_at >= ?',
+                (now, expires_at, store_id, now)
+            )
+            touched = cur.rowcount == 1
+            conn.commit()
+        finally:
+            conn.close()
+        if not touched:
+            with self._lock:
+                self._memory.pop(store_id, None)
+            return None
+        self._remember(store_id, expires_at, payload, now)
+        return payload
+
+    def delete(self, store_id):
+        """データを削除"""
+        if not store_id:
+            return
+        with self._lock:
+            self._memory.pop(store_id, None)
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM study_session_store WHERE id = ?', (store_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self):
+        """ヒット率などのメトリクスを取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+        stats['ttl'] = self.ttl
+        stats['max_entries'] = self.max_entries
+        return stats
+
+def save_session_data(payload):
+    """学習セッションデータをストアに保存してIDを返す"""
+    return current_app.extensions['study_session_store'].put(payload)
+
+def load_session_data(store_id):
+    """学習セッションデータをストアから取得"""
+    return current_app.extensions['study_session_store'].get(store_id)
+
+def discard_session_data(store_id):
+    """学習セッションデータをストアから削除"""
+    current_app.extensions['study_session_store'].delete(store_id)
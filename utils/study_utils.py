@@ -2,29 +2,68 @@
 学習関連のユーティリティ関数
 """
 
+import inspect
 import math
 from functools import wraps
 from flask import current_app
-from utils.db import get_db_connection, get_db_cursor
+from utils.cache import _MISSING
+from utils.db import get_db_connection, get_db_cursor, get_placeholder
+from utils.progress import get_chunk_progress_summary
+from utils.log_maintenance import RAW_STUDY_LOG_SINCE_SQL
 
 def cache_key(*args):
     """キャッシュキーを生成"""
     return ':'.join(str(arg) for arg in args)
 
+def user_cache_tags(user_id, source=None):
+    """無効化用のタグを生成（ユーザー単位・ユーザー×教材単位）"""
+    tags = [cache_key('user', user_id)]
+    if source is not None:
+        tags.append(cache_key('user', user_id, 'source', source))
+    return tags
+
+def get_study_cache():
+    """アプリに登録されたキャッシュを取得（未登録の場合はNone）"""
+    return current_app.extensions.get('study_cache')
+
 def simple_cache(expire_time=180):
-    """シンプルなキャッシュデコレータ"""
+    """
+    TTL付きのキャッシュデコレータ
+
+    引数に user_id / source を持つ関数は (user_id, source) のタグを付けて保存し、
+    clear_user_cache() でまとめて無効化できるようにする。
+    """
     def decorator(func):
+        signature = inspect.signature(func)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # キャッシュ機能は後で実装
-            return func(*args, **kwargs)
+            cache = get_study_cache()
+            if cache is None:
+                return func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = cache_key(func.__module__, func.__qualname__, *bound.arguments.values())
+            value = cache.get(key)
+            if value is not _MISSING:
+                return value
+
+            value = func(*args, **kwargs)
+            tags = []
+            if 'user_id' in bound.arguments:
+                tags = user_cache_tags(bound.arguments['user_id'], bound.arguments.get('source'))
+            cache.set(key, value, expire_time, tags)
+            return value
         return wrapper
     return decorator
 
 def clear_user_cache(user_id, source=None):
-    """ユーザーキャッシュをクリア"""
-    # キャッシュクリア処理（実装は後で追加）
-    pass
+    """ユーザーキャッシュをクリア（sourceを指定した場合はその教材分のみ）"""
+    cache = get_study_cache()
+    if cache is None:
+        return 0
+    return cache.invalidate_tag(user_cache_tags(user_id, source)[-1])
 
 @simple_cache(expire_time=300)
 def has_study_history(user_id, source):
@@ -32,11 +71,18 @@ def has_study_history(user_id, source):
     try:
         with get_db_connection() as conn:
             with get_db_cursor(conn) as cur:
-                cur.execute('''
-                    SELECT COUNT(*) FROM study_log sl
-                    JOIN image i ON sl.card_id = i.id
-                    WHERE sl.user_id = ? AND i.source = ?
-                ''', (user_id, source))
+                # 日別に集計済みの履歴と最近の生ログのどちらかにあれば履歴あり
+                cur.execute(f'''
+                    SELECT COUNT(*) FROM (
+                        SELECT 1 FROM study_log sl
+                        JOIN image i ON sl.card_id = i.id
+                        WHERE sl.user_id = ? AND i.source = ? AND sl.created_at >= {RAW_STUDY_LOG_SINCE_SQL}
+                        UNION ALL
+                        SELECT 1 FROM study_log_daily d
+                        JOIN image i ON d.card_id = i.id
+                        WHERE d.user_id = ? AND i.source = ?
+                    ) h
+                ''', (user_id, source, user_id, source))
                 count = cur.fetchone()[0]
                 return count > 0
     except Exception as e:
@@ -54,54 +100,78 @@ def get_chunk_size_by_subject(subject):
     }
     return chunk_sizes.get(subject, 10)
 
+def build_card_filter(source, page_range, difficulty, alias=''):
+    """教材・ページ範囲・難易度の絞り込み条件（WHERE句とパラメータ）を生成"""
+    placeholder = get_placeholder()
+    prefix = f'{alias}.' if alias else ''
+    conditions = [f'{prefix}source = {placeholder}']
+    params = [source]
+    
+    # ページ範囲フィルタ
+    if page_range:
+        # ページ範囲の解析（簡易版）
+        try:
+            if '-' in page_range:
+                start, end = page_range.split('-')
+                conditions.append(f'{prefix}page_number BETWEEN {placeholder} AND {placeholder}')
+                params.extend([int(start), int(end)])
+            else:
+                conditions.append(f'{prefix}page_number = {placeholder}')
+                params.append(int(page_range))
+        except ValueError:
+            current_app.logger.warning(f"ページ範囲の解析エラー: {page_range}")
+    
+    # 難易度フィルタ
+    if difficulty:
+        difficulty_list = difficulty.split(',')
+        placeholders = ','.join([placeholder for _ in difficulty_list])
+        conditions.append(f'{prefix}level IN ({placeholders})')
+        params.extend(difficulty_list)
+    
+    return ' AND '.join(conditions), params
+
+def build_chunk_limit(chunk_number, chunk_size=None):
+    """チャンク番号に対応する LIMIT/OFFSET 句とパラメータを生成"""
+    # 科目が取得できない場合の既定チャンクサイズ
+    chunk_size = int(chunk_size or get_chunk_size_by_subject(None))
+    placeholder = get_placeholder()
+    return f' LIMIT {placeholder} OFFSET {placeholder}', [chunk_size, (int(chunk_number) - 1) * chunk_size]
+
+@simple_cache(expire_time=600)
+def get_card_count(source, page_range, difficulty):
+    """
+    絞り込み条件に一致するカード数を取得（総チャンク数の計算用、キャッシュ付き）
+
+    エラー時の0をキャッシュしないよう、例外は呼び出し元で処理する。
+    """
+    where, params = build_card_filter(source, page_range, difficulty)
+    with get_db_connection() as conn:
+        with get_db_cursor(conn) as cur:
+            cur.execute(f'SELECT COUNT(*) FROM image WHERE {where}', params)
+            return cur.fetchone()[0]
+
 def get_study_cards_fast(source, stage, mode, page_range, user_id, difficulty='', chunk_number=None):
     """学習カードを高速取得"""
     try:
         with get_db_connection() as conn:
             with get_db_cursor(conn) as cur:
                 # 基本的なカード取得クエリ
-                query = '''
+                where, params = build_card_filter(source, page_range, difficulty)
+                query = f'''
                     SELECT id, source, page_number, level, subject, grade, image_path
                     FROM image 
-                    WHERE source = ?
+                    WHERE {where}
+                    ORDER BY page_number, level, id
                 '''
-                params = [source]
                 
-                # ページ範囲フィルタ
-                if page_range:
-                    # ページ範囲の解析（簡易版）
-                    try:
-                        if '-' in page_range:
-                            start, end = page_range.split('-')
-                            query += ' AND page_number BETWEEN ? AND ?'
-                            params.extend([int(start), int(end)])
-                        else:
-                            query += ' AND page_number = ?'
-                            params.append(int(page_range))
-                    except ValueError:
-                        current_app.logger.warning(f"ページ範囲の解析エラー: {page_range}")
-                
-                # 難易度フィルタ
-                if difficulty:
-                    difficulty_list = difficulty.split(',')
-                    placeholders = ','.join(['?' for _ in difficulty_list])
-                    query += f' AND level IN ({placeholders})'
-                    params.extend(difficulty_list)
-                
-                query += ' ORDER BY page_number, level'
+                # チャンク指定時は該当チャンクの行だけをDBから取得
+                if chunk_number:
+                    limit_sql, limit_params = build_chunk_limit(chunk_number)
+                    query += limit_sql
+                    params.extend(limit_params)
                 
                 cur.execute(query, params)
-                cards = cur.fetchall()
-                
-                # チャンク分割
-                if chunk_number and cards:
-                    subject = cards[0]['subject'] if hasattr(cards[0], 'subject') else 'math'
-                    chunk_size = get_chunk_size_by_subject(subject)
-                    start_idx = (chunk_number - 1) * chunk_size
-                    end_idx = start_idx + chunk_size
-                    cards = cards[start_idx:end_idx]
-                
-                return cards
+                return cur.fetchall()
                 
     except Exception as e:
         current_app.logger.error(f"学習カード取得エラー: {e}")
@@ -112,45 +182,57 @@ def get_chunk_practice_cards(user_id, source, stage, chunk_number, page_range, d
     try:
         with get_db_connection() as conn:
             with get_db_cursor(conn) as cur:
-                # 間違えた問題を取得
-                cur.execute('''
-                    SELECT DISTINCT i.id, i.source, i.page_number, i.level, i.subject, i.grade, i.image_path
+                # 間違えた問題を取得（EXISTSで重複を除き、チャンク分だけ取得する）
+                placeholder = get_placeholder()
+                query = f'''
+                    SELECT i.id, i.source, i.page_number, i.level, i.subject, i.grade, i.image_path
                     FROM image i
-                    JOIN study_log sl ON i.id = sl.card_id
-                    WHERE i.source = ? AND sl.user_id = ? AND sl.result = 'unknown'
-                ''', (source, user_id))
-                
-                wrong_cards = cur.fetchall()
-                
-                # チャンク分割
-                if chunk_number and wrong_cards:
-                    subject = wrong_cards[0]['subject'] if hasattr(wrong_cards[0], 'subject') else 'math'
-                    chunk_size = get_chunk_size_by_subject(subject)
-                    start_idx = (chunk_number - 1) * chunk_size
-                    end_idx = start_idx + chunk_size
-                    wrong_cards = wrong_cards[start_idx:end_idx]
+                    WHERE i.source = {placeholder}
+                      AND (
+                          EXISTS (
+                              SELECT 1 FROM study_log sl
+                              WHERE sl.user_id = {placeholder} AND sl.card_id = i.id AND sl.result = 'unknown'
+                                AND sl.created_at >= {RAW_STUDY_LOG_SINCE_SQL}
+                          )
+                          OR EXISTS (
+                              SELECT 1 FROM study_log_daily d
+                              WHERE d.user_id = {placeholder} AND d.card_id = i.id AND d.unknown_count > 0
+                          )
+                      )
+                    ORDER BY i.page_number, i.level, i.id
+                '''
+                params = [source, user_id, user_id]
+                if chunk_number:
+                    limit_sql, limit_params = build_chunk_limit(chunk_number)
+                    query += limit_sql
+                    params.extend(limit_params)
                 
-                return wrong_cards
+                cur.execute(query, params)
+                return cur.fetchall()
                 
     except Exception as e:
         current_app.logger.error(f"練習カード取得エラー: {e}")
         return []
 
+@simple_cache(expire_time=60)
 def get_detailed_progress_for_all_stages(user_id, source, page_range, difficulty):
     """全ステージの詳細進捗情報を取得"""
     stages_info = []
     try:
+        # 全問正解の判定はステージごとに同じ集計になるため1回だけ行う
+        completion = get_stage_completion(user_id, source, page_range, difficulty)
+        all_known = bool(completion and completion['all_known'])
         # ステージ1
         stage1_info = get_stage_detailed_progress(user_id, source, 1, page_range, difficulty)
         if stage1_info:
             stages_info.append(stage1_info)
-            if is_stage_perfect(user_id, source, 1, page_range, difficulty):
+            if all_known:
                 return stages_info
         # ステージ2
         stage2_info = get_stage_detailed_progress(user_id, source, 2, page_range, difficulty)
         if stage2_info:
             stages_info.append(stage2_info)
-            if is_stage_perfect(user_id, source, 2, page_range, difficulty):
+            if all_known:
                 return stages_info
         # ステージ3
         stage3_info = get_stage_detailed_progress(user_id, source, 3, page_range, difficulty)
@@ -164,23 +246,18 @@ def get_detailed_progress_for_all_stages(user_id, source, page_range, difficulty
 def create_fallback_stage_info(source, page_range, difficulty, user_id):
     """エラー時のフォールバック：最小限のStage 1情報"""
     try:
-        cards = get_study_cards_fast(source, 1, 'test', page_range, user_id, difficulty)
-        
-        if cards:
-            subject = cards[0]['subject'] if hasattr(cards[0], 'subject') else 'math'
-            chunk_size = get_chunk_size_by_subject(subject)
-            total_chunks = math.ceil(len(cards) / chunk_size)
-        else:
-            total_chunks = 1
+        total_cards = get_card_count(source, page_range, difficulty)
+        chunk_size = get_chunk_size_by_subject(None)
+        total_chunks = math.ceil(total_cards / chunk_size) if total_cards else 1
         
         return [{
             'stage': 1,
             'stage_name': 'ステージ 1',
-            'total_cards': len(cards) if cards else 0,
+            'total_cards': total_cards,
             'total_chunks': total_chunks,
             'chunks_progress': [{
                 'chunk_number': 1,
-                'total_cards': chunk_size if cards else 0,
+                'total_cards': min(chunk_size, total_cards),
                 'test_completed': False,
                 'test_correct': 0,
                 'test_wrong': 0,
@@ -201,45 +278,48 @@ def create_fallback_stage_info(source, page_range, difficulty, user_id):
 def get_stage_detailed_progress(user_id, source, stage, page_range, difficulty):
     """指定ステージの詳細進捗を取得"""
     try:
-        # ステージ別の対象カードを取得
-        if stage == 1:
-            target_cards = get_study_cards_fast(source, stage, 'test', page_range, user_id, difficulty)
-        else:
-            # ステージ2・3は簡易実装
-            target_cards = get_study_cards_fast(source, stage, 'test', page_range, user_id, difficulty)
+        # ステージ別の対象カード数を取得（ステージ2・3は簡易実装で全ステージ共通）
+        total_cards = get_card_count(source, page_range, difficulty)
         
-        if not target_cards:
+        if not total_cards:
             current_app.logger.debug(f"[STAGE_PROGRESS] Stage{stage}: 対象カードなし")
             return None
         
-        subject = target_cards[0]['subject'] if hasattr(target_cards[0], 'subject') else 'math'
-        chunk_size = get_chunk_size_by_subject(subject)
-        total_chunks = math.ceil(len(target_cards) / chunk_size)
+        chunk_size = get_chunk_size_by_subject(None)
+        total_chunks = math.ceil(total_cards / chunk_size)
         
-        # チャンク進捗を取得
+        # チャンク進捗を取得（study_log ではなく集計テーブルから読む）
+        summary = get_chunk_progress_summary(user_id, source, stage, page_range, difficulty)
         chunks_progress = []
         for chunk_num in range(1, total_chunks + 1):
+            chunk_total = min(chunk_size, total_cards - (chunk_num - 1) * chunk_size)
+            counts = summary.get(chunk_num, {})
+            test_correct = counts.get('test_correct', 0)
+            test_wrong = counts.get('test_wrong', 0)
+            test_completed = counts.get('test_answered', 0) >= chunk_total
+            practice_needed = test_completed and test_wrong > 0
+            practice_completed = practice_needed and counts.get('practice_correct', 0) >= test_wrong
             chunk_info = {
                 'chunk_number': chunk_num,
-                'total_cards': min(chunk_size, len(target_cards) - (chunk_num - 1) * chunk_size),
-                'test_completed': False,
-                'test_correct': 0,
-                'test_wrong': 0,
-                'practice_needed': False,
-                'practice_completed': False,
-                'chunk_completed': False,
+                'total_cards': chunk_total,
+                'test_completed': test_completed,
+                'test_correct': test_correct,
+                'test_wrong': test_wrong,
+                'practice_needed': practice_needed,
+                'practice_completed': practice_completed,
+                'chunk_completed': test_completed and (test_wrong == 0 or practice_completed),
                 'can_start_test': True,
-                'can_start_practice': False
+                'can_start_practice': practice_needed and not practice_completed
             }
             chunks_progress.append(chunk_info)
         
         return {
             'stage': stage,
             'stage_name': f'ステージ {stage}',
-            'total_cards': len(target_cards),
+            'total_cards': total_cards,
             'total_chunks': total_chunks,
             'chunks_progress': chunks_progress,
-            'stage_completed': False,
+            'stage_completed': all(chunk['chunk_completed'] for chunk in chunks_progress),
             'can_start': True
         }
         
@@ -247,29 +327,94 @@ def get_stage_detailed_progress(user_id, source, stage, page_range, difficulty):
         current_app.logger.error(f"ステージ詳細進捗エラー: {e}")
         return None
 
-def is_stage_perfect(user_id, source, stage, page_range, difficulty):
-    """指定ステージが全問正解かチェック"""
+def get_stage_completion(user_id, source, page_range, difficulty, chunk_size=None, stages=(1, 2, 3)):
+    """
+    ステージ・チャンクごとの正解状況を1回の集計クエリで取得
+
+    ユーザーの study_log（日別に集計済みの日は study_log_daily）をカードごとに集計したものを対象カードに結合し、
+    get_study_cards_fast と同じ順序で振った連番からチャンク番号を求めてチャンク単位で数える。
+    known_cards はいずれかのステージで 'known' になったカード数、
+    stages[n] はステージnで 'known' になったカード数。
+    """
+    # 科目が取得できない場合の既定チャンクサイズ（get_study_cards_fast と同じ）
+    chunk_size = int(chunk_size or get_chunk_size_by_subject(None))
+    placeholder = get_placeholder()
+    where, params = build_card_filter(source, page_range, difficulty, alias='i')
+    stages = tuple(int(stage) for stage in stages)
+    stage_sums = ''.join(
+        f",\n                       SUM(CASE WHEN sl.stage = {stage} THEN sl.known_count ELSE 0 END) AS stage{stage}_known"
+        for stage in stages
+    )
+    chunk_sums = ''.join(
+        f",\n               SUM(CASE WHEN c.stage{stage}_known > 0 THEN 1 ELSE 0 END)"
+        for stage in stages
+    )
+    # カードごとの集計を派生テーブルにすることで、結合時に card_id のインデックスが使われる
+    query = f'''
+        SELECT (c.rn - 1) / {chunk_size} + 1 AS chunk_number,
+               COUNT(*) AS total_cards,
+               SUM(CASE WHEN c.known_count > 0 THEN 1 ELSE 0 END) AS known_cards{chunk_sums}
+        FROM (
+            SELECT ROW_NUMBER() OVER (ORDER BY i.page_number, i.level, i.id) AS rn, l.*
+            FROM image i
+            LEFT JOIN (
+                SELECT sl.card_id,
+                       SUM(sl.known_count) AS known_count{stage_sums}
+                FROM (
+                    SELECT card_id, stage, CASE WHEN result = 'known' THEN 1 ELSE 0 END AS known_count
+                    FROM study_log
+                    WHERE user_id = {placeholder} AND created_at >= {RAW_STUDY_LOG_SINCE_SQL}
+                    UNION ALL
+                    SELECT card_id, stage, known_count
+                    FROM study_log_daily
+                    WHERE user_id = {placeholder}
+                ) sl
+                GROUP BY sl.card_id
+            ) l ON l.card_id = i.id
+            WHERE {where}
+        ) c
+        GROUP BY chunk_number
+        ORDER BY chunk_number
+    '''
     try:
         with get_db_connection() as conn:
             with get_db_cursor(conn) as cur:
-                # ステージの全カードを取得
-                cards = get_study_cards_fast(source, stage, 'test', page_range, user_id, difficulty)
-                if not cards:
-                    return False
-                
-                # 各カードの正解状況をチェック
-                for card in cards:
-                    cur.execute('''
-                        SELECT COUNT(*) FROM study_log 
-                        WHERE user_id = ? AND card_id = ? AND result = 'known'
-                    ''', (user_id, card['id']))
-                    correct_count = cur.fetchone()[0]
-                    
-                    if correct_count == 0:
-                        return False
-                
-                return True
-                
+                cur.execute(query, [user_id, user_id] + params)
+                rows = cur.fetchall()
     except Exception as e:
-        current_app.logger.error(f"ステージ完璧判定エラー: {e}")
-        return False 
\ No newline at end of file
+        current_app.logger.error(f"ステージ完了状況の集計エラー: {e}")
+        return None
+
+    chunks = []
+    stage_totals = {stage: 0 for stage in stages}
+    for row in rows:
+        stage_known = {stage: int(row[3 + i] or 0) for i, stage in enumerate(stages)}
+        for stage, known in stage_known.items():
+            stage_totals[stage] += known
+        chunks.append({
+            'chunk_number': int(row[0]),
+            'total_cards': int(row[1]),
+            'known_cards': int(row[2] or 0),
+            'completed': int(row[2] or 0) == int(row[1]),
+            'stages': stage_known
+        })
+
+    total_cards = sum(chunk['total_cards'] for chunk in chunks)
+    known_cards = sum(chunk['known_cards'] for chunk in chunks)
+    return {
+        'total_cards': total_cards,
+        'total_chunks': len(chunks),
+        'chunk_size': chunk_size,
+        'known_cards': known_cards,
+        'all_known': total_cards > 0 and known_cards == total_cards,
+        'chunks': chunks,
+        'stages': {
+            stage: {'known_cards': known, 'completed': total_cards > 0 and known == total_cards}
+            for stage, known in stage_totals.items()
+        }
+    }
+
+def is_stage_perfect(user_id, source, stage, page_range, difficulty):
+    """指定ステージが全問正解かチェック（いずれかの回答で 'known' になっていれば正解扱い）"""
+    completion = get_stage_completion(user_id, source, page_range, difficulty)
+    return bool(completion and completion['all_known'])
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+本番用のWSGIエントリポイント
+
+使い方:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+create_app はスレッドやDB接続を作らないため、gunicorn の preload_app で
+マスタープロセスに読み込んでからワーカーを fork しても安全。
+ログ書き込みなどのバックグラウンド処理はワーカーごとに起動する（gunicorn.conf.py を参照）。
+DBの初期化はデプロイ時に flask --app app init-db で行う。
+"""
+
+from app import create_app
+
+app = create_app()
+application = app